@@ -0,0 +1,292 @@
+import os
+import tempfile
+from concurrent.futures import Future, ProcessPoolExecutor
+from hashlib import blake2b
+from multiprocessing import get_context
+from typing import Callable, Optional
+
+import matplotlib
+# Render without a display, figures are only ever written to files
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+from lightgbm import Booster, plot_tree
+from numpy import ndarray
+from sklearn.metrics import ConfusionMatrixDisplay
+
+import ansi_escape_codes as c
+from logger_config import logger
+
+# Size in inches and resolution of the decision tree image
+TREE_FIGURE_SIZE = (20, 10)
+TREE_DPI = 300
+
+# Resolution of the confusion matrix images
+MATRIX_DPI = 100
+
+# Suffix of the file next to every image holding the hash of the content it was rendered from
+HASH_SUFFIX = ".hash"
+
+class ArtifactRenderer:
+    """
+    Render images in background processes so the pipeline does not wait for them.
+
+    Jobs are skipped if the image already exists and was rendered from the same
+    content, which is recognized by a hash stored next to the image. Every
+    image is written to a temporary file and renamed into place, so readers
+    never see half-written files, and every figure is closed once saved. The
+    workers are started with 'spawn', as forking a process that has run
+    LightGBM's OpenMP threads can deadlock the child. With ``max_workers=0``
+    the jobs run in the calling process instead.
+    """
+
+    def __init__(self, max_workers: int = 1):
+        self.executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context("spawn")) if max_workers else None
+        self.futures = []
+
+    def render_tree(self, model: Booster, path: str, tree_index: int = 0) -> Optional[Future]:
+        """
+        Queue the rendering of a decision tree of a model.
+
+        Parameters
+        ----------
+        model : Booster
+            The LightGBM model.
+        path : str
+            The path of the PNG image.
+        tree_index : int
+            The index of the tree to render.
+
+        Returns
+        -------
+        Optional[Future]
+            The pending job, None if the image is up to date.
+        """
+        model_string = model.model_to_string()
+        content_hash = get_content_hash(model_string.encode(), f"tree {tree_index} {TREE_FIGURE_SIZE} {TREE_DPI}".encode())
+        return self.submit(draw_tree, path, content_hash, model_string, tree_index)
+
+    def render_confusion_matrix(self, confusion_matrix: ndarray, title: str, path: str) -> Optional[Future]:
+        """
+        Queue the rendering of a confusion matrix.
+
+        Parameters
+        ----------
+        confusion_matrix : ndarray
+            The confusion matrix.
+        title : str
+            The title of the plot.
+        path : str
+            The path of the PNG image.
+
+        Returns
+        -------
+        Optional[Future]
+            The pending job, None if the image is up to date.
+        """
+        content_hash = get_content_hash(confusion_matrix.tobytes(), str(confusion_matrix.shape).encode(),
+                                        f"matrix {title} {MATRIX_DPI}".encode())
+        return self.submit(draw_confusion_matrix, path, content_hash, confusion_matrix, title)
+
+    def submit(self, function: Callable, path: str, content_hash: str, *args) -> Optional[Future]:
+        """
+        Run a drawing function unless its image is up to date.
+
+        Parameters
+        ----------
+        function : Callable
+            The drawing function, called with the path, the content hash and ``args``.
+        path : str
+            The path of the image.
+        content_hash : str
+            The hash of everything the image is rendered from.
+
+        Returns
+        -------
+        Optional[Future]
+            The pending job, None if the image is up to date.
+        """
+        if is_current(path, content_hash):
+            logger.info(f"Image {c.MAGENTA}{path}{c.RESET} is up to date.")
+            return None
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        # Draw right away without workers
+        if self.executor is None:
+            future = Future()
+            future.set_result(function(path, content_hash, *args))
+        else:
+            future = self.executor.submit(function, path, content_hash, *args)
+
+        self.futures.append(future)
+        return future
+
+    def wait(self) -> list[str]:
+        """
+        Wait for every queued job.
+
+        Returns
+        -------
+        list[str]
+            The paths of the images rendered since the last call.
+        """
+        paths = [future.result() for future in self.futures]
+        self.futures = []
+        return paths
+
+    def close(self):
+        """
+        Wait for every queued job and stop the workers.
+        """
+        try:
+            self.wait()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+
+    def __enter__(self) -> "ArtifactRenderer":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def draw_tree(path: str, content_hash: str, model_string: str, tree_index: int) -> str:
+    """
+    Render a decision tree of a model into a PNG image.
+
+    Parameters
+    ----------
+    path : str
+        The path of the image.
+    content_hash : str
+        The hash stored next to the image.
+    model_string : str
+        The LightGBM model as saved by ``Booster.model_to_string``.
+    tree_index : int
+        The index of the tree to render.
+
+    Returns
+    -------
+    str
+        The path of the image.
+    """
+    figure, axes = plt.subplots(figsize=TREE_FIGURE_SIZE)
+    try:
+        plot_tree(Booster(model_str=model_string), tree_index=tree_index, ax=axes)
+    except BaseException:
+        plt.close(figure)
+        raise
+    return save_figure(figure, path, content_hash, TREE_DPI)
+
+def draw_confusion_matrix(path: str, content_hash: str, confusion_matrix: ndarray, title: str) -> str:
+    """
+    Render a confusion matrix into a PNG image.
+
+    Parameters
+    ----------
+    path : str
+        The path of the image.
+    content_hash : str
+        The hash stored next to the image.
+    confusion_matrix : ndarray
+        The confusion matrix.
+    title : str
+        The title of the plot.
+
+    Returns
+    -------
+    str
+        The path of the image.
+    """
+    figure, axes = plt.subplots()
+    try:
+        ConfusionMatrixDisplay(confusion_matrix=confusion_matrix, display_labels=["k0", "k1"]).plot(ax=axes)
+        axes.set_title(title)
+    except BaseException:
+        plt.close(figure)
+        raise
+    return save_figure(figure, path, content_hash, MATRIX_DPI)
+
+def save_figure(figure: plt.Figure, path: str, content_hash: str, dpi: int) -> str:
+    """
+    Write a figure atomically, close it and record the hash of its content.
+
+    Parameters
+    ----------
+    figure : Figure
+        The figure to save.
+    path : str
+        The path of the image.
+    content_hash : str
+        The hash stored next to the image.
+    dpi : int
+        The resolution of the image.
+
+    Returns
+    -------
+    str
+        The path of the image.
+    """
+    directory = os.path.dirname(path) or "."
+    try:
+        # Write to a temporary file in the same directory and rename it into place
+        descriptor, staging = tempfile.mkstemp(dir=directory, suffix=".png")
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                figure.savefig(file, format="png", dpi=dpi)
+            os.replace(staging, path)
+        except BaseException:
+            os.remove(staging)
+            raise
+    finally:
+        plt.close(figure)
+
+    # Record what the image was rendered from, also atomically
+    with open(f"{path}{HASH_SUFFIX}.tmp", "w") as file:
+        file.write(content_hash)
+    os.replace(f"{path}{HASH_SUFFIX}.tmp", f"{path}{HASH_SUFFIX}")
+
+    logger.info(f"Image saved at {c.MAGENTA}{path}{c.RESET}")
+    return path
+
+def is_current(path: str, content_hash: str) -> bool:
+    """
+    Return whether an image exists and was rendered from the given content.
+
+    Parameters
+    ----------
+    path : str
+        The path of the image.
+    content_hash : str
+        The hash of the content.
+
+    Returns
+    -------
+    bool
+        True if the image need not be rendered again.
+    """
+    try:
+        with open(f"{path}{HASH_SUFFIX}") as file:
+            return os.path.exists(path) and file.read() == content_hash
+    except FileNotFoundError:
+        return False
+
+def get_content_hash(*parts: bytes) -> str:
+    """
+    Hash the content an image is rendered from.
+
+    Parameters
+    ----------
+    *parts : bytes
+        The content.
+
+    Returns
+    -------
+    str
+        The hex digest of the content.
+    """
+    digest = blake2b(digest_size=16)
+    for part in parts:
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return digest.hexdigest()
@@ -0,0 +1,197 @@
+import argparse
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Optional
+
+import ansi_escape_codes as c
+import cli
+from logger_config import logger
+
+def run_batch(dataset_paths: list[str], config: Optional[dict] = None, max_workers: Optional[int] = None) -> dict:
+    """
+    Run the pipeline on many datasets concurrently and aggregate the reports.
+
+    Every dataset is processed by its own worker process through
+    ``cli.run_pipeline``, with its images written to a subdirectory of the
+    output directory named after the dataset. LightGBM's threads are divided
+    among the workers so the cores are not oversubscribed. A failing dataset
+    is recorded with its error and does not stop the others.
+
+    Parameters
+    ----------
+    dataset_paths : list[str]
+        The paths of the dataset files.
+    config : Optional[dict]
+        The pipeline settings, by default ``cli.DEFAULT_CONFIG``.
+    max_workers : Optional[int]
+        The number of worker processes, by default one per dataset up to the number of cores.
+
+    Returns
+    -------
+    dict
+        The report of every dataset, the total wall time of every stage, the
+        mean evaluation accuracy and the wall time of the whole run.
+    """
+    start = time.perf_counter()
+    config = {**cli.DEFAULT_CONFIG, **(config or {})}
+
+    # Size the pool and share the cores among the workers
+    cpu_count = os.cpu_count() or 1
+    max_workers = max(1, max_workers or min(len(dataset_paths), cpu_count))
+    num_threads = max(1, cpu_count // max_workers)
+
+    logger.info(f"Processing {c.CYAN}{len(dataset_paths)}{c.RESET} datasets on {c.CYAN}{max_workers}{c.RESET} workers "
+                f"with {c.CYAN}{num_threads}{c.RESET} threads each...")
+
+    # Run every dataset in the pool, collecting the reports as they finish
+    reports = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(run_dataset, dataset_path, get_dataset_config(config, dataset_path, num_threads)): dataset_path
+            for dataset_path in dataset_paths
+        }
+        for future in as_completed(futures):
+            dataset_path = futures[future]
+            reports[dataset_path] = future.result()
+            if 'error' in reports[dataset_path]:
+                logger.error(f"{c.RED}Failed to process {dataset_path}: {reports[dataset_path]['error']}{c.RESET}")
+            else:
+                logger.info(f"Processed {c.MAGENTA}{dataset_path}{c.RESET} in "
+                            f"{c.CYAN}{sum(reports[dataset_path]['timings'].values()):.3f}s{c.RESET}")
+
+    # Keep the input order and sum up the stages
+    results = [reports[dataset_path] for dataset_path in dataset_paths]
+    succeeded = [result for result in results if 'error' not in result]
+    stage_times = {}
+    for result in succeeded:
+        for stage, seconds in result['timings'].items():
+            stage_times[stage] = stage_times.get(stage, 0.0) + seconds
+    accuracies = [result['eval_accuracy'] for result in succeeded if 'eval_accuracy' in result]
+
+    report = {
+        'datasets': results,
+        'succeeded': len(succeeded),
+        'failed': len(results) - len(succeeded),
+        'stage_times': stage_times,
+        'mean_eval_accuracy': sum(accuracies) / len(accuracies) if accuracies else None,
+        'workers': max_workers,
+        'threads_per_worker': num_threads,
+        'wall_time': time.perf_counter() - start
+    }
+
+    logger.info(f"Processed {c.CYAN}{report['succeeded']}{c.RESET} of {c.CYAN}{len(results)}{c.RESET} datasets "
+                f"in {c.CYAN}{report['wall_time']:.3f}s{c.RESET} (stages took {c.CYAN}{sum(stage_times.values()):.3f}s{c.RESET} in total)")
+
+    return report
+
+def get_dataset_config(config: dict, dataset_path: str, num_threads: int) -> dict:
+    """
+    Return the pipeline settings of one dataset in a batch.
+
+    Parameters
+    ----------
+    config : dict
+        The pipeline settings of the batch.
+    dataset_path : str
+        The path of the dataset file.
+    num_threads : int
+        The number of LightGBM threads of the worker.
+
+    Returns
+    -------
+    dict
+        The settings with a per-dataset output directory and the thread limit.
+    """
+    name = os.path.splitext(os.path.basename(dataset_path))[0]
+    return {
+        **config,
+        'output_dir': os.path.join(config['output_dir'], name),
+        'params': {**config['params'], 'num_threads': num_threads}
+    }
+
+def run_dataset(dataset_path: str, config: dict) -> dict:
+    """
+    Run the pipeline on one dataset in a worker process.
+
+    Parameters
+    ----------
+    dataset_path : str
+        The path of the dataset file.
+    config : dict
+        The pipeline settings of the dataset.
+
+    Returns
+    -------
+    dict
+        The report of the dataset, or the dataset and the error it failed with.
+    """
+    try:
+        return cli.run_pipeline(dataset_path, config)
+    except Exception as error:
+        return {'dataset': dataset_path, 'error': f"{type(error).__name__}: {error}"}
+
+def expand_dataset_paths(patterns: list[str]) -> list[str]:
+    """
+    Expand glob patterns and directories into a sorted list of dataset files.
+
+    Parameters
+    ----------
+    patterns : list[str]
+        File paths, glob patterns, or directories whose ``*.txt`` files are used.
+
+    Returns
+    -------
+    list[str]
+        The dataset paths without duplicates.
+    """
+    dataset_paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "*.txt")
+        # Keep paths without wildcards even if missing, so they are reported as failures
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        dataset_paths.extend(path for path in matches if path not in dataset_paths)
+    return dataset_paths
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """
+    Run the pipeline on every dataset matching the given paths and write one report.
+
+    Accepts the options of ``cli.py`` plus ``--workers``.
+
+    Parameters
+    ----------
+    argv : Optional[list[str]]
+        The command line arguments, by default those of the process.
+
+    Returns
+    -------
+    int
+        The exit code, 1 if any dataset failed.
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--workers", type=int, help="number of worker processes")
+    args, remaining = parser.parse_known_args(argv)
+    config = cli.load_config(remaining)
+
+    dataset_paths = expand_dataset_paths(config['datasets'])
+    if not dataset_paths:
+        logger.fatal(f"{c.RED}No datasets match {', '.join(config['datasets'])}.{c.RESET}")
+        return 1
+
+    report = run_batch(dataset_paths, config, args.workers)
+
+    # Write the aggregated report next to the per-dataset outputs
+    os.makedirs(config['output_dir'], exist_ok=True)
+    report_path = os.path.join(config['output_dir'], "batch_report.json")
+    with open(report_path, "w") as file:
+        json.dump(report, file, indent=2)
+    logger.info(f"Report saved at {c.MAGENTA}{report_path}{c.RESET}")
+
+    return 1 if report['failed'] else 0
+
+if __name__ == "__main__":
+    exit(main())
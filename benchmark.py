@@ -0,0 +1,251 @@
+import argparse
+import json
+import os
+import platform
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Optional
+
+import ansi_escape_codes as c
+import cli
+import instrumentation
+from logger_config import logger
+import syntheticData
+
+# Directory holding the baseline, the latest results and the generated datasets
+BENCHMARK_DIRECTORY = "./benchmarks"
+
+# Dataset sizes the suite supports, the largest ones take minutes and gigabytes
+SIZES = [10**4, 10**5, 10**6, 10**7, 10**8]
+
+# Dataset sizes benchmarked by default
+DEFAULT_SIZES = SIZES[:3]
+
+# Stages benchmarked by default, 'plot' is left out as it mostly measures image rendering and needs Graphviz
+DEFAULT_STAGES = ["analyze", "train", "evaluate"]
+
+# Factor by which a stage may become slower than the baseline before it counts as a regression
+TIME_THRESHOLD = 1.25
+
+# Factor by which a stage may allocate more than the baseline before it counts as a regression
+MEMORY_THRESHOLD = 1.25
+
+# Stages faster than this in the baseline are not compared, as their timings are mostly noise
+MIN_TIME = 0.05
+
+# Stages allocating less than this in the baseline are not compared
+MIN_MEMORY = 1 << 20
+
+def run_benchmarks(sizes: list[int], repeats: int = 3, stages: list[str] = DEFAULT_STAGES, seed: int = 42) -> dict:
+    """
+    Run the pipeline on synthetic datasets of every size and measure every stage.
+
+    Every run happens in a fresh process, so no parsed dataset, profile, model
+    or prediction is reused between runs and the peak RSS belongs to the run.
+    The times of a stage are the best of ``repeats`` runs; the allocations are
+    measured in one extra run with tracemalloc, which would distort the times.
+    The datasets are generated on first use and kept for later runs.
+
+    Parameters
+    ----------
+    sizes : list[int]
+        The numbers of rows of the datasets.
+    repeats : int
+        The number of timed runs per size.
+    stages : list[str]
+        The pipeline stages to run, see ``cli.STAGES``.
+    seed : int
+        The seed of the datasets and the pipeline.
+
+    Returns
+    -------
+    dict
+        The measurements of every stage by size, and the machine they were taken on.
+    """
+    results = {'created': datetime.now().isoformat(timespec="seconds"), 'machine': get_machine(), 'sizes': {}}
+
+    for size in sizes:
+        dataset_path = os.path.join(BENCHMARK_DIRECTORY, "data", f"synthetic_{size}_{seed}.txt")
+        if not os.path.exists(dataset_path):
+            syntheticData.generate_data_set(dataset_path, size, seed)
+
+        logger.info(f"Benchmarking {c.CYAN}{size}{c.RESET} rows with {c.CYAN}{repeats}{c.RESET} repeats...")
+
+        # Time the stages in fresh processes, then measure their allocations once more
+        config = {**cli.DEFAULT_CONFIG, 'stages': stages, 'seed': seed, 'use_cache': False, 'use_registry': False}
+        with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as executor:
+            timed_runs = [executor.submit(run_case, dataset_path, config, False).result() for _ in range(repeats)]
+            traced_run = executor.submit(run_case, dataset_path, config, True).result()
+
+        results['sizes'][str(size)] = {
+            stage: {
+                'wall_time': min(run[stage]['wall_time'] for run in timed_runs),
+                'cpu_time': min(run[stage]['cpu_time'] for run in timed_runs),
+                'rows_per_second': max(run[stage]['rows_per_second'] or 0 for run in timed_runs) or None,
+                'peak_rss_bytes': min(run[stage]['peak_rss_bytes'] or 0 for run in timed_runs) or None,
+                'peak_allocated_bytes': traced_run[stage]['peak_allocated_bytes']
+            }
+            for stage in timed_runs[0]
+        }
+
+    return results
+
+def run_case(dataset_path: str, config: dict, trace_allocations: bool) -> dict[str, dict]:
+    """
+    Run the pipeline once in a worker process and merge its trace by stage.
+
+    A stage that runs several times, e.g. ``evaluate/predict``, is merged into
+    one entry with the summed times and rows and the largest memory peaks.
+
+    Parameters
+    ----------
+    dataset_path : str
+        The path of the dataset file.
+    config : dict
+        The pipeline settings.
+    trace_allocations : bool
+        Whether to measure the allocations of every stage.
+
+    Returns
+    -------
+    dict[str, dict]
+        The measurements of every stage by its path.
+    """
+    trace = instrumentation.Trace(trace_allocations)
+    with tempfile.TemporaryDirectory() as output_dir, instrumentation.activate(trace):
+        cli.run_stages(dataset_path, {**config, 'output_dir': output_dir}, trace)
+
+    stages = {}
+    for record in trace.records:
+        stage = stages.setdefault(record['stage'], {'wall_time': 0.0, 'cpu_time': 0.0, 'rows': None,
+                                                    'peak_rss_bytes': None, 'peak_allocated_bytes': None})
+        stage['wall_time'] += record['wall_time']
+        stage['cpu_time'] += record['cpu_time']
+        for key in ('peak_rss_bytes', 'peak_allocated_bytes'):
+            if record.get(key) is not None:
+                stage[key] = max(stage[key] or 0, record[key])
+        if record['rows'] is not None:
+            stage['rows'] = (stage['rows'] or 0) + record['rows']
+
+    # Compute the throughput of the merged stages
+    for stage in stages.values():
+        stage['rows_per_second'] = stage['rows'] / stage['wall_time'] if stage['rows'] and stage['wall_time'] > 0 else None
+
+    return stages
+
+def compare_to_baseline(results: dict, baseline: dict, time_threshold: float = TIME_THRESHOLD,
+                        memory_threshold: float = MEMORY_THRESHOLD) -> list[dict]:
+    """
+    Find the stages that became slower or allocate more than in the baseline.
+
+    Only sizes and stages present in both are compared, and stages below
+    ``MIN_TIME`` or ``MIN_MEMORY`` in the baseline are skipped for that metric.
+
+    Parameters
+    ----------
+    results : dict
+        The current measurements, from ``run_benchmarks``.
+    baseline : dict
+        The baseline measurements, from ``run_benchmarks``.
+    time_threshold : float
+        The allowed factor on the wall time.
+    memory_threshold : float
+        The allowed factor on the allocated memory.
+
+    Returns
+    -------
+    list[dict]
+        The size, stage, metric, baseline and current value and their ratio of every regression.
+    """
+    regressions = []
+    limits = [('wall_time', time_threshold, MIN_TIME), ('peak_allocated_bytes', memory_threshold, MIN_MEMORY)]
+
+    for size, stages in results['sizes'].items():
+        for stage, measurements in stages.items():
+            reference = baseline['sizes'].get(size, {}).get(stage)
+            if reference is None:
+                continue
+            for metric, threshold, minimum in limits:
+                if reference.get(metric) is None or measurements.get(metric) is None or reference[metric] < minimum:
+                    continue
+                ratio = measurements[metric] / reference[metric]
+                if ratio > threshold:
+                    regressions.append({'size': int(size), 'stage': stage, 'metric': metric, 'baseline': reference[metric],
+                                        'current': measurements[metric], 'ratio': ratio})
+
+    return regressions
+
+def get_machine() -> dict:
+    """
+    Describe the machine the benchmarks run on.
+
+    Returns
+    -------
+    dict
+        The platform, processor, number of cores and Python version.
+    """
+    return {'platform': platform.platform(), 'processor': platform.processor(), 'cpu_count': os.cpu_count(),
+            'python': platform.python_version()}
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """
+    Run the benchmark suite and compare it to the stored baseline.
+
+    Without a baseline, or with ``--update-baseline``, the results become the
+    new baseline. The committed ``benchmarks/baseline.json`` was taken on the
+    machine it describes; timings only compare on similar machines, so
+    recreate it with ``python benchmark.py --update-baseline`` before gating
+    on another machine.
+
+    Parameters
+    ----------
+    argv : Optional[list[str]]
+        The command line arguments, by default those of the process.
+
+    Returns
+    -------
+    int
+        The exit code, 1 if any stage regressed.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage on synthetic datasets.")
+    parser.add_argument("--sizes", type=lambda value: [int(float(size)) for size in value.split(",")], default=DEFAULT_SIZES,
+                        help="comma-separated dataset sizes, e.g. 1e4,1e5")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per size")
+    parser.add_argument("--stages", type=lambda value: value.split(","), default=DEFAULT_STAGES,
+                        help=f"comma-separated subset of {','.join(cli.STAGES)}")
+    parser.add_argument("--baseline", default=os.path.join(BENCHMARK_DIRECTORY, "baseline.json"))
+    parser.add_argument("--update-baseline", action="store_true", dest="update_baseline")
+    parser.add_argument("--time-threshold", type=float, default=TIME_THRESHOLD, dest="time_threshold")
+    parser.add_argument("--memory-threshold", type=float, default=MEMORY_THRESHOLD, dest="memory_threshold")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, args.repeats, args.stages)
+
+    # Keep the latest results for inspection
+    os.makedirs(BENCHMARK_DIRECTORY, exist_ok=True)
+    results_path = os.path.join(BENCHMARK_DIRECTORY, "results.json")
+    with open(results_path, "w") as file:
+        json.dump(results, file, indent=2)
+    logger.info(f"Results saved at {c.MAGENTA}{results_path}{c.RESET}")
+
+    # Store the results as the baseline if asked to or if there is none yet
+    if args.update_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, "w") as file:
+            json.dump(results, file, indent=2)
+        logger.info(f"Baseline saved at {c.MAGENTA}{args.baseline}{c.RESET}")
+        return 0
+
+    with open(args.baseline) as file:
+        regressions = compare_to_baseline(results, json.load(file), args.time_threshold, args.memory_threshold)
+
+    for regression in regressions:
+        logger.error(f"{c.RED}Regression in {regression['stage']} at {regression['size']} rows: {regression['metric']} "
+                     f"{regression['baseline']:.6g} -> {regression['current']:.6g} ({regression['ratio']:.2f}x){c.RESET}")
+    if not regressions:
+        logger.info("No stage regressed against the baseline.")
+
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,523 @@
+import argparse
+import copy
+import importlib.util
+import json
+import os
+import shutil
+from typing import Optional
+
+from numpy import array
+
+import ansi_escape_codes as c
+import instrumentation
+from logger_config import logger
+import metricsEngine
+
+# Stages of the pipeline in execution order
+STAGES = ["analyze", "train", "evaluate", "plot"]
+
+# Names of the dataset splits, in the order task2.split_code_matrix returns them
+SPLITS = ["training", "evaluation", "test"]
+
+# Settings used when neither the config file nor the command line sets them
+DEFAULT_CONFIG = {
+    'datasets': ["Test00.txt"],
+    'training_ratio': 0.6,
+    'eval_ratio': 0.2,
+    'seed': 42,
+    'stratify': False,
+    'params': {},
+    'output_dir': ".",
+    'stages': STAGES,
+    'use_cache': True,
+    'use_registry': True,
+    'trace': False,
+    'trace_allocations': False,
+    'profile': False,
+    'render_trees': [],
+    'threshold': metricsEngine.DECISION_THRESHOLD,
+    'select_features': False,
+    'selection_tolerance': None,
+    'scheduler': "graph"
+}
+
+# Ways to run the stages: one after another, or as a stage graph with cached, overlapping stages
+SCHEDULERS = ["graph", "sequential"]
+
+def run_pipeline(dataset_path: str, config: dict) -> dict:
+    """
+    Run the selected stages of the pipeline on one dataset.
+
+    Modules are imported by the stages that need them, so e.g. an analysis-only
+    run never imports LightGBM, scikit-learn or matplotlib. The 'evaluate' and
+    'plot' stages need a model and therefore include 'train'. With the 'graph'
+    scheduler, independent stages overlap and unchanged stages are taken from
+    the stage cache, see ``run_graph``. Every stage is measured by an
+    ``instrumentation.Trace``; with 'trace' set, its records are
+    added to the report and written to trace.json and trace.csv, and with
+    'profile' set, every stage is profiled into the profiles directory.
+
+    Parameters
+    ----------
+    dataset_path : str
+        The path to the dataset file.
+    config : dict
+        The pipeline settings, see ``DEFAULT_CONFIG``.
+
+    Returns
+    -------
+    dict
+        The report of the run with the metrics and the wall time in seconds of
+        every executed stage.
+    """
+    profile_dir = os.path.join(config['output_dir'], "profiles") if config['profile'] else None
+    trace = instrumentation.Trace(config['trace_allocations'], profile_dir)
+
+    # Run the stages with the pipeline modules reporting into the trace
+    with instrumentation.activate(trace):
+        run = run_graph if config['scheduler'] == "graph" else run_stages
+        report = run(dataset_path, config, trace)
+    report['timings'] = trace.get_timings()
+
+    # Write the trace next to the other outputs
+    if config['trace']:
+        report['trace'] = trace.records
+        os.makedirs(config['output_dir'], exist_ok=True)
+        trace.write_json(os.path.join(config['output_dir'], "trace.json"))
+        trace.write_csv(os.path.join(config['output_dir'], "trace.csv"))
+
+    return report
+
+def run_stages(dataset_path: str, config: dict, trace: instrumentation.Trace) -> dict:
+    """
+    Run the selected stages of the pipeline on one dataset, each as a stage of the trace.
+
+    Parameters
+    ----------
+    dataset_path : str
+        The path to the dataset file.
+    config : dict
+        The pipeline settings, see ``DEFAULT_CONFIG``.
+    trace : Trace
+        The trace measuring the stages.
+
+    Returns
+    -------
+    dict
+        The report of the run with the metrics of the executed stages.
+    """
+    stages = set(config['stages'])
+    report = {'dataset': dataset_path, 'stages': [stage for stage in STAGES if stage in stages]}
+
+    # Load the dataset as one code matrix shared by every stage
+    with trace.stage("load") as record:
+        import dataSource
+        matrix = dataSource.read_code_matrix(dataset_path, use_cache=config['use_cache'])
+        report['samples'] = record['rows'] = len(matrix)
+
+    if "analyze" in stages:
+        with trace.stage("analyze", len(matrix)):
+            import task1
+
+            # Profile the dataset once and report from the profile
+            profile = task1.get_profile(matrix)
+            task1.get_feature_size(matrix)
+            task1.get_feature_values(matrix)
+            task1.get_target_values(matrix)
+            task1.get_all_compliance_frequencies(matrix)
+            report['cardinalities'] = {name: profile.cardinality(name) for name in profile.vocabularies}
+
+    if not stages & {"train", "evaluate", "plot"}:
+        return report
+
+    # Split the dataset, the target codes are already the encoded targets
+    with trace.stage("split", len(matrix)):
+        import task2
+        import task3
+
+        split_ratio = [config['training_ratio'], config['eval_ratio'], 1 - config['training_ratio'] - config['eval_ratio']]
+        train, evaluation, test = task2.split_code_matrix(matrix, split_ratio, config['stratify'], config['seed'])
+
+    # Drop the features the model does not need, before training the final model on the rest
+    if config['select_features']:
+        with trace.stage("select", len(train)):
+            import featureSelection
+
+            tolerance = config['selection_tolerance']
+            report['feature_selection'] = featureSelection.select_features(
+                train, evaluation, featureSelection.SELECTION_TOLERANCE if tolerance is None else tolerance,
+                params={'seed': config['seed'], **config['params']})
+            selected = report['feature_selection']['features']
+            train, evaluation, test = train.select(selected), evaluation.select(selected), test.select(selected)
+
+    # Train on the compressed training rows, stopping early on the evaluation split
+    with trace.stage("train", len(train)):
+        train_unique, weights = task3.compress_code_matrix(train)
+        model = task3.get_trained_model(train_unique, None, evaluation, None,
+                                        params={'seed': config['seed'], **config['params']}, weight=weights,
+                                        use_registry=config['use_registry'])
+        report['trees'] = model.num_trees()
+
+        # Keep the feature frequencies of the training split with the model to monitor drift against
+        with trace.stage("reference", len(train)):
+            import driftMonitor
+
+            monitor = driftMonitor.DriftMonitor.from_matrix(train)
+            reference_path = driftMonitor.get_reference_path(model)
+            if reference_path is not None and not os.path.exists(reference_path):
+                monitor.save(reference_path)
+
+    image_dir = os.path.join(config['output_dir'], "images")
+
+    # Render the images in the background while the pipeline goes on
+    renderer = None
+    if "plot" in stages:
+        import artifactRenderer
+        renderer = artifactRenderer.ArtifactRenderer()
+
+    try:
+        if stages & {"evaluate", "plot"}:
+            # Evaluate the model and compute the metrics of every split at once, plotting the confusion matrices if requested
+            with trace.stage("evaluate", len(matrix)):
+                import predictionEngine
+                import task4
+
+                report['eval_accuracy'] = task3.evaluate_model(model, evaluation, None, config['threshold'])
+                probabilities = predictionEngine.predict_probabilities(model, train, evaluation, test)
+                with trace.stage("metrics", len(matrix)):
+                    report['metrics'] = metricsEngine.evaluate_splits({
+                        split: (part.targets, probability) for split, part, probability
+                        in zip(SPLITS, [train, evaluation, test], probabilities)
+                    }, config['threshold'])
+                report['confusion_matrices'] = {split: metrics['confusion_matrix'] for split, metrics in report['metrics'].items()}
+
+                # Compare the test split with the training frequencies
+                with trace.stage("drift", len(test)):
+                    monitor.update(test)
+                    report['drift'] = monitor.get_report()
+
+                if "plot" in stages:
+                    with trace.stage("render"):
+                        for split, confusion in report['confusion_matrices'].items():
+                            task4.save_confusion_matrix(array(confusion), f"{split}_data", image_dir, renderer)
+
+        if "plot" in stages:
+            # Export all trees as text, render the requested trees and wait for every image
+            with trace.stage("plot"):
+                import treeExport
+
+                tree_dir = os.path.join(config['output_dir'], "trees")
+                report['tree_summaries'] = treeExport.export_trees(model, tree_dir)
+                report['images'] = renderer.wait() + treeExport.render_trees(tree_dir, config['render_trees'])
+    finally:
+        if renderer is not None:
+            renderer.close()
+
+    return report
+
+def run_graph(dataset_path: str, config: dict, trace: instrumentation.Trace) -> dict:
+    """
+    Run the selected stages of the pipeline on one dataset as a stage graph.
+
+    Every stage declares the values it reads and produces, so it starts as soon
+    as its inputs exist: the drift report runs next to the evaluation, the tree
+    export next to both, and the images are queued while the pipeline goes on.
+    The outputs of the pure stages are kept in the stage cache under a hash of
+    their inputs, which starts from the content of the dataset file; a rerun
+    with unchanged data and settings takes the profile, model, metrics and
+    drift report from the cache without loading the dataset at all. The stages
+    with side effects (storing the drift reference and the accuracy in the
+    model registry, writing images and tree exports) are never cached and
+    always run.
+
+    Parameters
+    ----------
+    dataset_path : str
+        The path to the dataset file.
+    config : dict
+        The pipeline settings, see ``DEFAULT_CONFIG``.
+    trace : Trace
+        The trace measuring the stages.
+
+    Returns
+    -------
+    dict
+        The report of the run like that of ``run_stages``, with the start and
+        end of every stage and the critical path under 'schedule'.
+    """
+    import dataCache
+    import dataSource
+    import stageGraph
+
+    stages = set(config['stages'])
+    report = {'dataset': dataset_path, 'stages': [stage for stage in STAGES if stage in stages]}
+
+    def load(dataset_path, dataset_key, use_cache):
+        return dataSource.read_code_matrix(dataset_path, use_cache=use_cache)
+
+    def analyze(matrix):
+        import task1
+
+        # Profile the dataset once and report from the profile
+        profile = task1.get_profile(matrix)
+        task1.get_feature_size(matrix)
+        task1.get_feature_values(matrix)
+        task1.get_target_values(matrix)
+        task1.get_all_compliance_frequencies(matrix)
+        return {name: profile.cardinality(name) for name in profile.vocabularies}
+
+    def split(matrix, split_ratio, stratify, seed):
+        import task2
+        return task2.split_code_matrix(matrix, split_ratio, stratify, seed)
+
+    def select(train, evaluation, tolerance, params):
+        import featureSelection
+        return featureSelection.select_features(train, evaluation, tolerance, params=params)
+
+    def project(train, evaluation, test, feature_selection):
+        selected = feature_selection['features']
+        return train.select(selected), evaluation.select(selected), test.select(selected)
+
+    def train_model(train, evaluation, params, use_registry):
+        import modelRegistry
+        import task3
+
+        # Train on the compressed training rows, stopping early on the evaluation split
+        train_unique, weights = task3.compress_code_matrix(train)
+        model = task3.get_trained_model(train_unique, None, evaluation, None, params=params, weight=weights,
+                                        use_registry=use_registry)
+        return model, model.num_trees(), modelRegistry.MODEL_KEYS.get(model)
+
+    def link(model, model_key):
+        import modelRegistry
+
+        # A model taken from the stage cache is no longer linked to its registry entry
+        if model_key is not None:
+            modelRegistry.MODEL_KEYS.setdefault(model, model_key)
+
+    def reference(train):
+        import driftMonitor
+        return driftMonitor.DriftMonitor.from_matrix(train)
+
+    def save_reference(model, model_key, monitor):
+        import driftMonitor
+
+        # Keep the feature frequencies of the training split with the model to monitor drift against
+        link(model, model_key)
+        reference_path = driftMonitor.get_reference_path(model)
+        if reference_path is not None and not os.path.exists(reference_path):
+            monitor.save(reference_path)
+        return reference_path
+
+    def evaluate(model, train, evaluation, test, threshold):
+        import predictionEngine
+
+        # Score every split at once and take the evaluation accuracy like task3.evaluate_model does
+        probabilities = predictionEngine.predict_probabilities(model, train, evaluation, test)
+        eval_accuracy = float((metricsEngine.get_predictions(probabilities[1], threshold) == evaluation.targets).mean())
+        logger.info(f"Accuracy: {c.CYAN}{eval_accuracy*100:.6f}%{c.RESET}")
+
+        # Compute the metrics of every split
+        with trace.stage("metrics", len(train) + len(evaluation) + len(test)):
+            metrics = metricsEngine.evaluate_splits({
+                split: (part.targets, probability) for split, part, probability
+                in zip(SPLITS, [train, evaluation, test], probabilities)
+            }, threshold)
+        return eval_accuracy, metrics
+
+    def record(model, model_key, eval_accuracy):
+        import modelRegistry
+
+        # Keep the accuracy with the model if it is registered
+        link(model, model_key)
+        modelRegistry.update_metrics(model, {'eval_accuracy': eval_accuracy})
+
+    def drift(monitor, test):
+        # Compare the test split with the training frequencies, leaving the reference monitor untouched
+        monitor = copy.deepcopy(monitor)
+        monitor.update(test)
+        return monitor.get_report()
+
+    def render_matrices(metrics, image_dir):
+        import task4
+        for split, split_metrics in metrics.items():
+            task4.save_confusion_matrix(array(split_metrics['confusion_matrix']), f"{split}_data", image_dir, renderer)
+
+    # Declare the stages with the values they read and produce
+    import treeExport
+    parts = ("train", "evaluation", "test")
+    graph = [
+        stageGraph.Stage("load", load, ("dataset_path", "dataset_key", "use_cache"), ("matrix",)),
+        stageGraph.Stage("count", len, ("matrix",), ("samples",), cache=True),
+        stageGraph.Stage("analyze", analyze, ("matrix",), ("cardinalities",), cache=True),
+        stageGraph.Stage("split", split, ("matrix", "split_ratio", "stratify", "seed"), parts)
+    ]
+    if config['select_features']:
+        graph.append(stageGraph.Stage("select", select, ("train", "evaluation", "tolerance", "params"),
+                                      ("feature_selection",), cache=True))
+        graph.append(stageGraph.Stage("project", project, parts + ("feature_selection",), tuple(f"selected_{part}" for part in parts)))
+        parts = tuple(f"selected_{part}" for part in parts)
+    graph += [
+        stageGraph.Stage("train", train_model, (parts[0], parts[1], "params", "use_registry"), ("model", "trees", "model_key"), cache=True),
+        stageGraph.Stage("reference", reference, (parts[0],), ("monitor",), cache=True),
+        stageGraph.Stage("save_reference", save_reference, ("model", "model_key", "monitor"), ("reference_path",)),
+        stageGraph.Stage("evaluate", evaluate, ("model",) + parts + ("threshold",), ("eval_accuracy", "metrics"), cache=True),
+        stageGraph.Stage("record", record, ("model", "model_key", "eval_accuracy"), ("recorded",)),
+        stageGraph.Stage("drift", drift, ("monitor", parts[2]), ("drift",), cache=True),
+        stageGraph.Stage("render", render_matrices, ("metrics", "image_dir"), ("matrix_images",)),
+        stageGraph.Stage("export", treeExport.export_trees, ("model", "tree_dir"), ("tree_summaries",))
+    ]
+
+    # Request the values of the selected stages, the evaluation and plots need a model
+    targets = ["samples"] + (["cardinalities"] if "analyze" in stages else [])
+    if stages & {"train", "evaluate", "plot"}:
+        targets += ["trees", "reference_path"] + (["feature_selection"] if config['select_features'] else [])
+    if stages & {"evaluate", "plot"}:
+        targets += ["eval_accuracy", "metrics", "recorded", "drift"]
+    if "plot" in stages:
+        targets += ["matrix_images", "tree_summaries"]
+
+    # The dataset enters the stage keys by the hash of its content
+    values = {
+        'dataset_path': dataset_path,
+        'dataset_key': dataCache.get_cache_key(dataset_path, dataSource.COLUMN_NAMES),
+        'use_cache': config['use_cache'],
+        'split_ratio': [config['training_ratio'], config['eval_ratio'], 1 - config['training_ratio'] - config['eval_ratio']],
+        'stratify': config['stratify'],
+        'seed': config['seed'],
+        'params': {'seed': config['seed'], **config['params']},
+        'use_registry': config['use_registry'],
+        'threshold': config['threshold'],
+        'image_dir': os.path.join(config['output_dir'], "images"),
+        'tree_dir': os.path.join(config['output_dir'], "trees")
+    }
+    if config['select_features']:
+        import featureSelection
+
+        tolerance = config['selection_tolerance']
+        values['tolerance'] = featureSelection.SELECTION_TOLERANCE if tolerance is None else tolerance
+
+    # Render the images in the background while the pipeline goes on
+    renderer = None
+    if "plot" in stages:
+        import artifactRenderer
+        renderer = artifactRenderer.ArtifactRenderer()
+
+    try:
+        values, schedule = stageGraph.StageGraph(graph).run(values, targets, trace, use_cache=config['use_cache'])
+
+        # Report the values in the order of the sequential run
+        for name in ["samples", "cardinalities", "feature_selection", "trees", "eval_accuracy", "metrics"]:
+            if name in targets:
+                report[name] = values[name]
+        if "metrics" in targets:
+            report['confusion_matrices'] = {split: metrics['confusion_matrix'] for split, metrics in report['metrics'].items()}
+            report['drift'] = values['drift']
+        if "plot" in stages:
+            report['tree_summaries'] = values['tree_summaries']
+            report['images'] = renderer.wait() + treeExport.render_trees(values['tree_dir'], config['render_trees'])
+        report['schedule'] = schedule
+    finally:
+        if renderer is not None:
+            renderer.close()
+
+    return report
+
+def load_config(argv: Optional[list[str]] = None) -> dict:
+    """
+    Build the pipeline settings from the defaults, a config file and the command line.
+
+    Settings on the command line take precedence over the config file, which
+    takes precedence over ``DEFAULT_CONFIG``.
+
+    Parameters
+    ----------
+    argv : Optional[list[str]]
+        The command line arguments, by default those of the process.
+
+    Returns
+    -------
+    dict
+        The pipeline settings.
+    """
+    parser = argparse.ArgumentParser(description="Run the IBSYS 1 machine learning pipeline without interaction.")
+    parser.add_argument("datasets", nargs="*", help="dataset files to process")
+    parser.add_argument("--config", help="JSON file with settings, keys as in DEFAULT_CONFIG")
+    parser.add_argument("--training-ratio", type=float, dest="training_ratio")
+    parser.add_argument("--eval-ratio", type=float, dest="eval_ratio")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--threshold", type=float, help="probability above which a prediction is k1")
+    parser.add_argument("--stratify", action="store_true", default=None)
+    parser.add_argument("--params", type=json.loads, help="LightGBM parameters as JSON object")
+    parser.add_argument("--output-dir", dest="output_dir", help="directory for images and reports")
+    parser.add_argument("--stages", type=lambda value: value.split(","), help=f"comma-separated subset of {','.join(STAGES)}")
+    parser.add_argument("--no-cache", action="store_false", dest="use_cache", default=None,
+                        help="do not use the binary dataset cache and the stage cache")
+    parser.add_argument("--no-registry", action="store_false", dest="use_registry", default=None,
+                        help="always train instead of loading a registered model")
+    parser.add_argument("--trace", action="store_true", default=None, help="write a per-stage cost trace as JSON and CSV")
+    parser.add_argument("--trace-allocations", action="store_true", default=None, dest="trace_allocations",
+                        help="also record the peak allocations of every stage with tracemalloc (slower)")
+    parser.add_argument("--profile", action="store_true", default=None, help="dump a cProfile of every stage")
+    parser.add_argument("--select-features", action="store_true", default=None, dest="select_features",
+                        help="train on the smallest feature subset within the selection tolerance")
+    parser.add_argument("--selection-tolerance", type=float, dest="selection_tolerance",
+                        help="largest drop in held-out training accuracy the feature selection may cause")
+    parser.add_argument("--scheduler", choices=SCHEDULERS, help="run the stages one after another or as a stage graph")
+    parser.add_argument("--render-trees", type=lambda value: [int(index) for index in value.split(",")], dest="render_trees",
+                        help="comma-separated indices of trees to render from their DOT export (needs Graphviz)")
+    args = parser.parse_args(argv)
+
+    config = dict(DEFAULT_CONFIG)
+
+    # Apply the config file, then everything given on the command line
+    if args.config:
+        with open(args.config) as file:
+            config.update(json.load(file))
+    config.update({key: value for key, value in vars(args).items() if value not in (None, []) and key != "config"})
+
+    unknown = set(config['stages']) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    # Fail before any training if trees are to be rendered without the graphviz package or Graphviz
+    if config['render_trees'] and (importlib.util.find_spec("graphviz") is None or shutil.which("dot") is None):
+        parser.error("--render-trees needs the graphviz package (pip install graphviz) and the Graphviz dot program")
+
+    return config
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """
+    Run the pipeline on every configured dataset and write a JSON report.
+
+    Parameters
+    ----------
+    argv : Optional[list[str]]
+        The command line arguments, by default those of the process.
+
+    Returns
+    -------
+    int
+        The exit code, 1 if a dataset file is missing.
+    """
+    config = load_config(argv)
+
+    reports = []
+    for dataset_path in config['datasets']:
+        try:
+            reports.append(run_pipeline(dataset_path, config))
+        except FileNotFoundError:
+            logger.fatal(f"{c.RED}Invalid file path {dataset_path}.{c.RESET}")
+            return 1
+
+    # Write the report next to the other outputs
+    os.makedirs(config['output_dir'], exist_ok=True)
+    report_path = os.path.join(config['output_dir'], "report.json")
+    with open(report_path, "w") as file:
+        json.dump(reports, file, indent=2)
+    logger.info(f"Report saved at {c.MAGENTA}{report_path}{c.RESET}")
+
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,232 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+from typing import Optional
+
+from numpy import array_split, concatenate, dtype, float64, mean, ndarray, random, std
+from pandas import DataFrame, Series
+
+import ansi_escape_codes as c
+import dataSource
+import metricsEngine
+from logger_config import logger
+import task3
+
+def cross_validate(features: DataFrame, targets: Series, n_splits: int = 5, n_repeats: int = 1,
+                   max_workers: Optional[int] = None, params: Optional[dict] = None,
+                   random_state: int = 42) -> dict:
+    """
+    Run (repeated) k-fold cross-validation with the folds trained concurrently.
+
+    The dataset is converted into one code matrix placed in shared memory, which
+    every worker process maps read-only instead of receiving pickled frames. The
+    workers only receive the seed of their permutation and derive their fold
+    indices themselves. LightGBM's threads are divided among the workers so the
+    cores are not oversubscribed. The workers are started with 'spawn', as
+    forking a process that has run LightGBM can deadlock.
+
+    Parameters
+    ----------
+    features : DataFrame
+        The categorical feature dataset.
+    targets : Series
+        The categorical target dataset.
+    n_splits : int
+        The number of folds per repetition.
+    n_repeats : int
+        The number of repetitions, each with a different permutation.
+    max_workers : Optional[int]
+        The number of worker processes, by default one per fold up to the number of cores.
+    params : Optional[dict]
+        Parameters overriding the default LightGBM parameters.
+    random_state : int
+        The seed of the first permutation, repetition r uses ``random_state + r``.
+
+    Returns
+    -------
+    dict
+        The metrics and timing of every fold, their mean and standard deviation,
+        and the wall time of the whole run.
+    """
+    start = time.perf_counter()
+
+    # Size the pool and share the cores among the workers
+    cpu_count = os.cpu_count() or 1
+    folds = [(repeat, fold) for repeat in range(n_repeats) for fold in range(n_splits)]
+    max_workers = max_workers or min(len(folds), cpu_count)
+    num_threads = max(1, cpu_count // max_workers)
+
+    logger.info(f"Cross-validating {c.CYAN}{n_repeats}x{n_splits}{c.RESET} folds on {c.CYAN}{max_workers}{c.RESET} workers "
+                f"with {c.CYAN}{num_threads}{c.RESET} threads each...")
+
+    # Copy the code matrix into shared memory once
+    codes, vocabularies = dataSource.frame_to_codes(features, targets)
+    memory = shared_memory.SharedMemory(create=True, size=codes.nbytes)
+    try:
+        shared_codes = ndarray(codes.shape, dtype=codes.dtype, buffer=memory.buf)
+        shared_codes[:] = codes
+        del codes
+
+        # Train and score every fold in the pool
+        fold_params = {**(params or {}), 'num_threads': num_threads}
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context("spawn")) as executor:
+            futures = [
+                executor.submit(run_fold, memory.name, shared_codes.shape, shared_codes.dtype.str, vocabularies,
+                                random_state + repeat, n_splits, fold, fold_params)
+                for repeat, fold in folds
+            ]
+            results = [{'repeat': repeat, 'fold': fold, **future.result()}
+                       for (repeat, fold), future in zip(folds, futures)]
+        del shared_codes
+    finally:
+        memory.close()
+        memory.unlink()
+
+    # Summarize the folds
+    accuracies = [result['accuracy'] for result in results]
+    report = {
+        'folds': results,
+        'mean_accuracy': float(mean(accuracies)),
+        'std_accuracy': float(std(accuracies)),
+        'wall_time': time.perf_counter() - start
+    }
+
+    for result in results:
+        logger.info(f"Fold {c.CYAN}{result['repeat']}.{result['fold']}{c.RESET}: accuracy {c.CYAN}{result['accuracy']*100:.6f}%{c.RESET}, "
+                    f"trained in {c.CYAN}{result['train_time']:.3f}s{c.RESET}, scored in {c.CYAN}{result['predict_time']:.3f}s{c.RESET}")
+    logger.info(f"Cross-validated accuracy: {c.CYAN}{report['mean_accuracy']*100:.6f}%{c.RESET} "
+                f"(± {report['std_accuracy']*100:.6f}%) in {c.CYAN}{report['wall_time']:.3f}s{c.RESET}")
+
+    return report
+
+def get_fold_indices(num_rows: int, seed: int, n_splits: int, fold: int) -> tuple[ndarray, ndarray]:
+    """
+    Return the training and test row indices of one fold.
+
+    Parameters
+    ----------
+    num_rows : int
+        The number of rows of the dataset.
+    seed : int
+        The seed of the permutation of this repetition.
+    n_splits : int
+        The number of folds.
+    fold : int
+        The index of the fold.
+
+    Returns
+    -------
+    tuple[ndarray, ndarray]
+        The training and test row indices.
+    """
+    # Permute the rows and cut them into equally sized folds
+    parts = array_split(random.default_rng(seed).permutation(num_rows), n_splits)
+
+    # The fold is the test set, all other folds are the training set
+    return concatenate(parts[:fold] + parts[fold + 1:]), parts[fold]
+
+def run_fold(memory_name: str, shape: tuple[int, int], dtype_name: str, vocabularies: dict[str, list[str]],
+             seed: int, n_splits: int, fold: int, params: dict) -> dict:
+    """
+    Train and score one fold on the shared code matrix; runs in a worker process.
+
+    Parameters
+    ----------
+    memory_name : str
+        The name of the shared memory block holding the code matrix.
+    shape : tuple[int, int]
+        The shape of the code matrix.
+    dtype_name : str
+        The dtype of the code matrix.
+    vocabularies : dict[str, list[str]]
+        The categories of every column in column order.
+    seed : int
+        The seed of the permutation of this repetition.
+    n_splits : int
+        The number of folds.
+    fold : int
+        The index of the fold.
+    params : dict
+        Parameters overriding the default LightGBM parameters.
+
+    Returns
+    -------
+    dict
+        The accuracy, sample counts and timings of the fold.
+    """
+    # Map the shared code matrix without copying it
+    memory = shared_memory.SharedMemory(name=memory_name)
+    try:
+        codes = ndarray(shape, dtype=dtype(dtype_name), buffer=memory.buf)
+        train_index, test_index = get_fold_indices(shape[0], seed, n_splits, fold)
+
+        # Train on the training rows of the fold
+        start = time.perf_counter()
+        train_codes = codes[train_index]
+        model = task3.get_trained_model_from_dataset(
+            task3.get_dataset_from_codes(train_codes, vocabularies), len(train_codes), params
+        )
+        train_time = time.perf_counter() - start
+
+        # Score the held-out rows
+        start = time.perf_counter()
+        test_codes = codes[test_index]
+        y_pred = metricsEngine.get_predictions(model.predict(test_codes[:, :-1].astype(float64)))
+        accuracy = float((y_pred == test_codes[:, -1]).mean())
+        predict_time = time.perf_counter() - start
+
+        del codes, train_codes, test_codes
+    finally:
+        memory.close()
+
+    return {
+        'accuracy': accuracy,
+        'train_samples': len(train_index),
+        'test_samples': len(test_index),
+        'train_time': train_time,
+        'predict_time': predict_time
+    }
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """
+    Cross-validate the model on a dataset file from the command line.
+
+    Parameters
+    ----------
+    argv : Optional[list[str]]
+        The command line arguments, by default those of the process.
+
+    Returns
+    -------
+    int
+        The exit code.
+    """
+    parser = argparse.ArgumentParser(description="Cross-validate the LightGBM model on a dataset file.")
+    parser.add_argument("dataset", help="dataset file to cross-validate on")
+    parser.add_argument("--splits", type=int, default=5, help="number of folds per repetition")
+    parser.add_argument("--repeats", type=int, default=1, help="number of repetitions with different permutations")
+    parser.add_argument("--workers", type=int, dest="max_workers", help="number of worker processes")
+    parser.add_argument("--params", type=json.loads, help="LightGBM parameters as JSON object")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="JSON file to write the report to")
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(args.dataset):
+        logger.fatal(f"{c.RED}Invalid file path {args.dataset}.{c.RESET}")
+        exit(1)
+
+    features, targets = dataSource.read_data_set(args.dataset)
+    report = cross_validate(features, targets, args.splits, args.repeats, args.max_workers, args.params, args.seed)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        logger.info(f"Cross-validation report saved at {c.MAGENTA}{args.output}{c.RESET}")
+
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
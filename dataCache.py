@@ -0,0 +1,158 @@
+from hashlib import blake2b
+import json
+import os
+import shutil
+import tempfile
+from typing import Optional, Tuple
+
+from numpy import load, ndarray, save
+
+import ansi_escape_codes as c
+from logger_config import logger
+
+# Directory holding one sub-directory per cached dataset
+CACHE_DIRECTORY = "./cache"
+
+# Upper bound for the total size of the cache in bytes
+MAX_CACHE_BYTES = 2 * 1024 ** 3
+
+# Size of the blocks in which source files are hashed
+HASH_BLOCK_SIZE = 1024 ** 2
+
+# Prefix of the directories entries are written to before they are renamed into place
+STAGING_PREFIX = ".staging-"
+
+def get_cache_key(dataset_path: str, column_names: list[str]) -> str:
+    """
+    Compute the cache key of a dataset file.
+
+    The key is a hash over the raw content of the file and the schema it is
+    parsed with, so renamed or touched files still hit the cache while any change
+    to the data or the column layout misses it.
+
+    Parameters
+    ----------
+    dataset_path : str
+        The path to the dataset file.
+    column_names : list[str]
+        The column names the dataset is parsed with.
+
+    Returns
+    -------
+    str
+        The hexadecimal cache key.
+    """
+    # Hash the schema first, then the file content block by block
+    digest = blake2b(json.dumps(column_names).encode(), digest_size=16)
+    with open(dataset_path, "rb") as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+def load_data_set(key: str) -> Optional[Tuple[ndarray, dict[str, list[str]]]]:
+    """
+    Load a cached dataset without parsing any text.
+
+    The category code matrix is memory-mapped from disk, so only the pages that
+    are actually used are ever read.
+
+    Parameters
+    ----------
+    key : str
+        The cache key computed by ``get_cache_key``.
+
+    Returns
+    -------
+    Optional[Tuple[ndarray, dict[str, list[str]]]]
+        The code matrix and the vocabulary of each column, or None if the dataset
+        is not cached.
+    """
+    entry = os.path.join(CACHE_DIRECTORY, key)
+    if not os.path.isdir(entry):
+        return None
+
+    # Memory-map the column-major code matrix and read the vocabularies
+    codes = load(os.path.join(entry, "codes.npy"), mmap_mode='r')
+    with open(os.path.join(entry, "vocabularies.json")) as file:
+        vocabularies = json.load(file)
+
+    # Mark the entry as recently used for the eviction policy
+    os.utime(entry)
+
+    logger.info(f"Loaded dataset {c.MAGENTA}{key}{c.RESET} from cache.")
+
+    return codes, vocabularies
+
+def store_data_set(key: str, codes: ndarray, vocabularies: dict[str, list[str]]) -> None:
+    """
+    Store a parsed dataset in the cache.
+
+    The code matrix is written as one ``.npy`` file next to a JSON file with the
+    vocabulary of each column. The entry is written to a temporary directory and
+    renamed into place, so concurrent readers never see partial entries.
+
+    Parameters
+    ----------
+    key : str
+        The cache key computed by ``get_cache_key``.
+    codes : ndarray
+        The category code matrix with one column per dataset column.
+    vocabularies : dict[str, list[str]]
+        The categories of every column in column order.
+
+    Returns
+    -------
+    None
+    """
+    # Write the entry into a temporary directory and move it into place
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=CACHE_DIRECTORY)
+    save(os.path.join(staging, "codes.npy"), codes)
+    with open(os.path.join(staging, "vocabularies.json"), "w") as file:
+        json.dump(vocabularies, file)
+
+    try:
+        os.rename(staging, os.path.join(CACHE_DIRECTORY, key))
+    except OSError:
+        # Another process stored the same dataset in the meantime
+        shutil.rmtree(staging, ignore_errors=True)
+        return
+
+    logger.info(f"Stored dataset {c.MAGENTA}{key}{c.RESET} in cache.")
+
+    # Keep the cache within its size limit
+    evict_cache()
+
+def evict_cache(max_bytes: int = MAX_CACHE_BYTES) -> None:
+    """
+    Evict the least recently used cache entries until the cache fits its size limit.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The maximum total size of the cache in bytes.
+
+    Returns
+    -------
+    None
+    """
+    if not os.path.isdir(CACHE_DIRECTORY):
+        return
+
+    # Collect the size and last use of every completed entry, other processes may still be writing staging directories
+    entries = []
+    for name in os.listdir(CACHE_DIRECTORY):
+        entry = os.path.join(CACHE_DIRECTORY, name)
+        if os.path.isdir(entry) and not name.startswith(STAGING_PREFIX):
+            size = sum(file.stat().st_size for file in os.scandir(entry) if file.is_file())
+            entries.append((os.stat(entry).st_mtime, size, entry))
+
+    # Remove the oldest entries first until the total size fits
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total_size <= max_bytes:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total_size -= size
+        logger.info(f"Evicted cache entry {c.MAGENTA}{os.path.basename(entry)}{c.RESET}.")
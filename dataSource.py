@@ -1,10 +1,161 @@
-from typing import Tuple
-from numpy import ndarray
-from pandas import DataFrame, Series, read_csv
+from types import MappingProxyType
+from typing import Iterator, Mapping, Optional, Tuple
+from numpy import arange, argsort, array, empty, int8, int16, int64, lib, ndarray, prod, result_type, unique, where
+from pandas import Categorical, DataFrame, Series, read_csv
 from logger_config import logger
 import ansi_escape_codes as c
+import dataCache
+import instrumentation
 
-def get_data_set_from_url() -> Tuple[DataFrame, DataFrame]:
+# Define the column names of the dataset schema
+COLUMN_NAMES = [f"Feature_{i}" for i in range(1, 17)] + ["Target"]
+
+# Number of rows parsed at once in streaming mode
+CHUNK_SIZE = 1_000_000
+
+# Size of the blocks in which rows are counted
+COUNT_BLOCK_SIZE = 1024 ** 2
+
+class CodeMatrix:
+    """
+    A dataset held as one integer code matrix with frozen vocabularies.
+
+    The codes of the features and the target are stored in one matrix with a
+    column per feature followed by the target, using one byte per value (two if a
+    column has 128 categories or more) and -1 for missing values, so a row of
+    the 17-column schema takes 17 bytes. The vocabularies hold the categories of
+    every column in column order, sorted like pandas categories, and are shared
+    read-only between a matrix and the matrices taken from it. The matrix goes
+    to LightGBM as numeric input with every feature declared categorical, see
+    ``task3.get_dataset_from_codes``.
+    """
+
+    __slots__ = ('codes', 'vocabularies', '__weakref__')
+
+    def __init__(self, codes: ndarray, vocabularies: Mapping[str, list[str]]):
+        self.codes = codes
+        self.vocabularies = vocabularies if isinstance(vocabularies, MappingProxyType) else \
+            MappingProxyType({name: tuple(categories) for name, categories in vocabularies.items()})
+
+    @classmethod
+    def from_frame(cls, features: DataFrame, targets: Series) -> "CodeMatrix":
+        """
+        Build a code matrix from categorical features and targets.
+
+        Parameters
+        ----------
+        features : DataFrame
+            The categorical feature dataset.
+        targets : Series
+            The categorical target dataset.
+
+        Returns
+        -------
+        CodeMatrix
+            The code matrix.
+        """
+        return cls(*frame_to_codes(features, targets))
+
+    def to_frame(self) -> Tuple[DataFrame, Series]:
+        """
+        Wrap the codes into categorical features and targets without copying labels.
+
+        Returns
+        -------
+        features : DataFrame
+            The feature dataset with one categorical column per feature
+        targets : Series
+            The categorical target dataset
+        """
+        return codes_to_frame(self.codes, self.vocabularies)
+
+    def take(self, rows: ndarray) -> "CodeMatrix":
+        """
+        Gather rows into a new code matrix sharing the vocabularies.
+
+        A slice returns a view of the codes, row indices gather every column
+        into a new column-major matrix.
+
+        Parameters
+        ----------
+        rows : ndarray
+            The row indices, or a slice.
+
+        Returns
+        -------
+        CodeMatrix
+            The code matrix of the rows.
+        """
+        if isinstance(rows, slice):
+            return CodeMatrix(self.codes[rows], self.vocabularies)
+
+        # Gather column by column so every column stays contiguous
+        codes = empty((len(rows), self.codes.shape[1]), dtype=self.codes.dtype, order='F')
+        for index in range(self.codes.shape[1]):
+            codes[:, index] = self.codes[:, index].take(rows)
+        return CodeMatrix(codes, self.vocabularies)
+
+    def select(self, feature_names: list[str]) -> "CodeMatrix":
+        """
+        Keep only some features, followed by the target.
+
+        Parameters
+        ----------
+        feature_names : list[str]
+            The names of the features to keep, in the order to keep them.
+
+        Returns
+        -------
+        CodeMatrix
+            The code matrix of the features and the target.
+        """
+        names = [*feature_names, self.target_name]
+        columns = [list(self.vocabularies).index(name) for name in names]
+
+        # Copy column by column so every column stays contiguous
+        codes = empty((len(self.codes), len(columns)), dtype=self.codes.dtype, order='F')
+        for index, column in enumerate(columns):
+            codes[:, index] = self.codes[:, column]
+        return CodeMatrix(codes, {name: self.vocabularies[name] for name in names})
+
+    @property
+    def feature_names(self) -> list[str]:
+        """The names of the feature columns."""
+        return list(self.vocabularies)[:-1]
+
+    @property
+    def target_name(self) -> str:
+        """The name of the target column."""
+        return list(self.vocabularies)[-1]
+
+    @property
+    def features(self) -> ndarray:
+        """The feature codes, a view of the matrix."""
+        return self.codes[:, :-1]
+
+    @property
+    def targets(self) -> ndarray:
+        """The target codes, a view of the matrix."""
+        return self.codes[:, -1]
+
+    @property
+    def radices(self) -> list[int]:
+        """The number of categories of every column."""
+        return [len(categories) for categories in self.vocabularies.values()]
+
+    @property
+    def nbytes(self) -> int:
+        """The size of the codes in bytes."""
+        return self.codes.nbytes
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __reduce__(self):
+        # Pickle the vocabularies as plain lists, mapping proxies cannot be pickled
+        return CodeMatrix, (self.codes, {name: list(categories) for name, categories in self.vocabularies.items()})
+
+def get_data_set_from_url() -> Tuple[DataFrame, Series]:
     """
     Retrieve a dataset from a given URL and split it into features and targets.
 
@@ -14,12 +165,9 @@ def get_data_set_from_url() -> Tuple[DataFrame, DataFrame]:
     -------
     features : DataFrame
         The feature dataset
-    targets : DataFrame
+    targets : Series
         The target dataset
     """
-    # Define the column names
-    column_names = [f"Feature_{i}" for i in range(1, 17)] + ["Target"]
-
     # Prompt the user to enter the dataset path
     dataset_path = input(f"{c.YELLOW}Type in the path to the dataset: {c.RESET}")
 
@@ -29,21 +177,398 @@ def get_data_set_from_url() -> Tuple[DataFrame, DataFrame]:
 
     try:
         # Read the dataset from the given path
-        dataset = read_csv(dataset_path, sep=' ', header=None, names=column_names)
-
-        # Strip the semicolon from the end of each value
-        dataset = dataset.map(lambda x: str(x).rstrip(';'))
+        feature_data, target_data = read_data_set(dataset_path)
 
     except FileNotFoundError:
         # Raise an error if the file path is invalid
         logger.fatal(f"{c.RED}Invalid file path. Please try again.{c.RESET}")
         exit(1)
 
-    # Extract the feature data from the dataset
-    feature_data = dataset[[col for col in dataset.columns if col != 'Target']].astype('category')
+    # Return the features and target
+    return feature_data, target_data
+
+def read_data_set(dataset_path: str, use_cache: bool = True) -> Tuple[DataFrame, Series]:
+    """
+    Read a dataset file into categorical features and targets.
+
+    Every column is parsed directly into a categorical dtype by the C parser, so
+    no object-dtype copy of the table is ever built. The trailing semicolons are
+    then stripped from the (few) category labels instead of from every cell.
+
+    Parameters
+    ----------
+    dataset_path : str
+        The path to the dataset file.
+    use_cache : bool
+        Whether to load the parsed dataset from, and store it in, the binary cache.
+
+    Returns
+    -------
+    features : DataFrame
+        The feature dataset with one categorical column per feature
+    targets : Series
+        The categorical target dataset
+    """
+    # Skip parsing entirely if the file has been parsed before
+    if use_cache:
+        cache_key = dataCache.get_cache_key(dataset_path, COLUMN_NAMES)
+        with instrumentation.stage("cache") as record:
+            cached = dataCache.load_data_set(cache_key)
+            if cached is not None:
+                record['rows'] = len(cached[0])
+                return codes_to_frame(*cached)
+
+    # Parse every column straight into a categorical column
+    with instrumentation.stage("parse") as record:
+        dataset = read_csv(dataset_path, sep=' ', header=None, names=COLUMN_NAMES,
+                           usecols=range(len(COLUMN_NAMES)), dtype='category', engine='c')
+        record['rows'] = len(dataset)
 
-    # Extract the target data from the dataset 
-    target_data = dataset["Target"].astype('category')
+    # Strip the semicolon from the categories of each column
+    with instrumentation.stage("strip", len(dataset)):
+        for column in COLUMN_NAMES:
+            dataset[column] = strip_categories(dataset[column])
+
+    feature_data, target_data = dataset[COLUMN_NAMES[:-1]], dataset[COLUMN_NAMES[-1]]
+
+    # Store the parsed dataset for later runs
+    if use_cache:
+        dataCache.store_data_set(cache_key, *frame_to_codes(feature_data, target_data))
 
     # Return the features and target
     return feature_data, target_data
+
+def read_code_matrix(dataset_path: str, use_cache: bool = True) -> CodeMatrix:
+    """
+    Read a dataset file into a code matrix.
+
+    A cached dataset is mapped from the cache without building any frame.
+
+    Parameters
+    ----------
+    dataset_path : str
+        The path to the dataset file.
+    use_cache : bool
+        Whether to load the parsed dataset from, and store it in, the binary cache.
+
+    Returns
+    -------
+    CodeMatrix
+        The code matrix of the features and the target.
+    """
+    if use_cache:
+        cache_key = dataCache.get_cache_key(dataset_path, COLUMN_NAMES)
+        with instrumentation.stage("cache") as record:
+            cached = dataCache.load_data_set(cache_key)
+            if cached is not None:
+                record['rows'] = len(cached[0])
+                return CodeMatrix(*cached)
+
+    # Parse the file, which also stores it in the cache
+    return CodeMatrix.from_frame(*read_data_set(dataset_path, use_cache))
+
+def read_code_batches(dataset_path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[CodeMatrix]:
+    """
+    Read a dataset file as a stream of code matrices of at most ``chunk_size`` rows.
+
+    Only one chunk is held in memory at a time. Every batch has the vocabularies
+    of its own chunk, so the codes of different batches need not line up.
+
+    Parameters
+    ----------
+    dataset_path : str
+        The path to the dataset file.
+    chunk_size : int
+        The number of rows parsed at once.
+
+    Yields
+    ------
+    CodeMatrix
+        The code matrix of the next chunk of rows.
+    """
+    chunks = read_csv(dataset_path, sep=' ', header=None, names=COLUMN_NAMES, usecols=range(len(COLUMN_NAMES)),
+                      dtype='category', engine='c', chunksize=chunk_size)
+    for chunk in chunks:
+        # Strip the semicolon from the categories of each column
+        for column in COLUMN_NAMES:
+            chunk[column] = strip_categories(chunk[column])
+        yield CodeMatrix.from_frame(chunk[COLUMN_NAMES[:-1]], chunk[COLUMN_NAMES[-1]])
+
+def strip_categories(column: Series) -> Categorical:
+    """
+    Strip the semicolon separator from the categories of a categorical column.
+
+    The work is proportional to the number of categories, not the number of rows:
+    only the category labels are stripped, and the integer codes are remapped with
+    a single vectorized lookup. Labels that collapse onto the same value after
+    stripping (e.g. 'k1' and 'k1;') are merged, and the resulting categories are
+    sorted exactly like ``astype('category')`` on the stripped strings would be.
+
+    Parameters
+    ----------
+    column : Series
+        The categorical column whose categories still carry the separator.
+
+    Returns
+    -------
+    Categorical
+        The column with stripped, sorted and unique categories.
+    """
+    # Strip the separator from the category labels only
+    stripped = column.cat.categories.astype(str).str.rstrip(';')
+
+    # Sort and deduplicate the stripped labels and map each old category onto them
+    categories, remap = unique(stripped.to_numpy(dtype=object), return_inverse=True)
+
+    # Remap the codes, keeping missing values (code -1) missing
+    codes = column.cat.codes.to_numpy()
+    codes = where(codes < 0, -1, remap[codes])
+
+    # Build the categorical column from the remapped codes
+    return Categorical.from_codes(codes, categories=categories)
+
+def frame_to_codes(features: DataFrame, targets: Series) -> Tuple[ndarray, dict[str, list[str]]]:
+    """
+    Convert categorical features and targets into a code matrix.
+
+    The category codes of all columns are written into one column-major matrix
+    using the smallest sufficient integer type. Missing values keep the code -1.
+
+    Parameters
+    ----------
+    features : DataFrame
+        The categorical feature dataset.
+    targets : Series
+        The categorical target dataset.
+
+    Returns
+    -------
+    codes : ndarray
+        The code matrix with one column per feature followed by the target
+    vocabularies : dict[str, list[str]]
+        The categories of every column in column order
+    """
+    columns = [features[name] for name in features.columns] + [targets]
+
+    # Use one byte per code unless a column has too many categories
+    dtype = int8 if max(len(column.cat.categories) for column in columns) < 128 else int16
+
+    # Fill a column-major code matrix so every column stays contiguous
+    codes = empty((len(targets), len(columns)), dtype=dtype, order='F')
+    for index, column in enumerate(columns):
+        codes[:, index] = column.cat.codes
+
+    # Collect the vocabulary of every column in column order
+    vocabularies = {column.name: [str(value) for value in column.cat.categories] for column in columns}
+
+    return codes, vocabularies
+
+def codes_to_frame(codes: ndarray, vocabularies: dict[str, list[str]]) -> Tuple[DataFrame, Series]:
+    """
+    Wrap a code matrix into categorical features and targets.
+
+    The codes are used as they are, so no labels are looked up or compared.
+
+    Parameters
+    ----------
+    codes : ndarray
+        The code matrix with one column per feature followed by the target.
+    vocabularies : dict[str, list[str]]
+        The categories of every column in column order.
+
+    Returns
+    -------
+    features : DataFrame
+        The feature dataset with one categorical column per feature
+    targets : Series
+        The categorical target dataset
+    """
+    # Wrap each column of codes into a categorical column
+    columns = {
+        name: Categorical.from_codes(codes[:, index], categories=categories, validate=False)
+        for index, (name, categories) in enumerate(vocabularies.items())
+    }
+    dataset = DataFrame(columns)
+
+    # Return the features and target
+    names = list(vocabularies)
+    return dataset[names[:-1]], dataset[names[-1]]
+
+def stream_data_set(dataset_path: str, buffer_path: Optional[str] = None,
+                    chunk_size: int = CHUNK_SIZE, dtype: type = int8) -> Tuple[ndarray, dict[str, list[str]]]:
+    """
+    Read a dataset file in fixed-size chunks into a preallocated code matrix.
+
+    Only one chunk of parsed text is held in memory at a time. The vocabulary of
+    every column is discovered incrementally and the integer codes of each chunk
+    are written straight into the code matrix, which is memory-mapped to
+    ``buffer_path`` if given so that datasets larger than RAM can be ingested.
+    At the end the vocabularies are sorted, so the codes are identical to those
+    produced by ``read_data_set``.
+
+    Parameters
+    ----------
+    dataset_path : str
+        The path to the dataset file.
+    buffer_path : Optional[str]
+        The path of the ``.npy`` file backing the code matrix, or None to keep it in memory.
+    chunk_size : int
+        The number of rows parsed at once.
+    dtype : type
+        The integer type of the codes.
+
+    Returns
+    -------
+    codes : ndarray
+        The row-major code matrix with one column per feature followed by the target
+    vocabularies : dict[str, list[str]]
+        The sorted categories of every column in column order
+    """
+    # Count the rows to preallocate the code matrix
+    rows = count_rows(dataset_path)
+    shape = (rows, len(COLUMN_NAMES))
+    if buffer_path is None:
+        codes = empty(shape, dtype=dtype)
+    else:
+        codes = lib.format.open_memmap(buffer_path, mode='w+', dtype=dtype, shape=shape)
+
+    logger.info(f"Streaming {c.CYAN}{rows}{c.RESET} rows from {c.MAGENTA}{dataset_path}{c.RESET}...")
+
+    # Map every label seen so far to its code, one mapping per column
+    vocabularies = {name: {} for name in COLUMN_NAMES}
+    capacity = 2 ** (8 * codes.dtype.itemsize - 1)
+
+    # Parse the file chunk by chunk and write the codes into the matrix
+    start = 0
+    chunks = read_csv(dataset_path, sep=' ', header=None, names=COLUMN_NAMES, usecols=range(len(COLUMN_NAMES)),
+                      dtype='category', engine='c', chunksize=chunk_size)
+    for chunk in chunks:
+        end = start + len(chunk)
+        for index, name in enumerate(COLUMN_NAMES):
+            column = chunk[name]
+            vocabulary = vocabularies[name]
+
+            # Translate the chunk's own categories into the global codes
+            labels = column.cat.categories.astype(str).str.rstrip(';')
+            lookup = array([vocabulary.setdefault(label, len(vocabulary)) for label in labels], dtype=int64)
+            if len(vocabulary) > capacity:
+                raise ValueError(f"Column {name} has more than {capacity} categories, use a wider dtype.")
+
+            # Remap the chunk codes, keeping missing values missing
+            chunk_codes = column.cat.codes.to_numpy()
+            codes[start:end, index] = where(chunk_codes < 0, -1, lookup[chunk_codes])
+        start = end
+
+    # Drop rows that were counted but not parsed (e.g. blank lines)
+    codes = codes[:start]
+
+    # Sort every vocabulary and renumber the codes accordingly
+    sorted_vocabularies = {}
+    for index, (name, vocabulary) in enumerate(vocabularies.items()):
+        labels = list(vocabulary)
+        order = argsort(array(labels, dtype=object))
+        sorted_vocabularies[name] = [labels[position] for position in order]
+        if (order == arange(len(order))).all():
+            continue
+
+        # Map every old code onto its rank among the sorted labels
+        rank = empty(len(order), dtype=int64)
+        rank[order] = arange(len(order))
+        for block in range(0, start, chunk_size):
+            column = codes[block:block + chunk_size, index]
+            codes[block:block + chunk_size, index] = where(column < 0, -1, rank[column])
+
+    # Make sure a memory-mapped matrix is written to disk
+    if buffer_path is not None:
+        codes.flush()
+
+    logger.info(f"Streamed {c.CYAN}{start}{c.RESET} rows into the code matrix.")
+
+    return codes, sorted_vocabularies
+
+def count_rows(dataset_path: str) -> int:
+    """
+    Count the rows of a dataset file without parsing it.
+
+    Parameters
+    ----------
+    dataset_path : str
+        The path to the dataset file.
+
+    Returns
+    -------
+    int
+        The number of lines in the file.
+    """
+    rows = 0
+    last_block = b""
+    with open(dataset_path, "rb") as file:
+        for block in iter(lambda: file.read(COUNT_BLOCK_SIZE), b""):
+            rows += block.count(b"\n")
+            last_block = block
+
+    # Count a final line without a line break as well
+    if last_block and not last_block.endswith(b"\n"):
+        rows += 1
+
+    return rows
+
+def get_row_keys(codes: ndarray, radices: list[int]) -> ndarray:
+    """
+    Combine the codes of every row into a single integer key.
+
+    The codes are read as digits of a mixed-radix number, so two rows get the same
+    key exactly if all their codes are equal. Missing values (code -1) are kept
+    apart from every category.
+
+    Parameters
+    ----------
+    codes : ndarray
+        The code matrix, one row per sample.
+    radices : list[int]
+        The number of categories of every column.
+
+    Returns
+    -------
+    ndarray
+        One int64 key per row.
+    """
+    # Shift the codes by one so missing values become digit 0
+    radices = [radix + 1 for radix in radices]
+    if prod([float(radix) for radix in radices]) >= 2 ** 63:
+        raise ValueError("The columns have too many combinations to be keyed by a single integer.")
+
+    # Accumulate the digits column by column
+    keys = codes[:, 0].astype(int64) + 1
+    for column, radix in enumerate(radices[1:], start=1):
+        keys *= radix
+        keys += codes[:, column].astype(int64) + 1
+
+    return keys
+
+def concatenate_codes(X: DataFrame, y: Optional[Series] = None) -> ndarray:
+    """
+    Collect the category codes of a feature dataset and optionally its encoded targets.
+
+    Parameters
+    ----------
+    X : DataFrame
+        The categorical feature dataset.
+    y : Optional[Series]
+        The encoded target dataset.
+
+    Returns
+    -------
+    ndarray
+        The code matrix with one column per feature, followed by the target if given.
+    """
+    columns = [X[column].cat.codes.to_numpy() for column in X.columns]
+    if y is not None:
+        columns.append(y.to_numpy())
+
+    # Stack the columns into one matrix of the narrowest common type
+    codes = empty((len(X), len(columns)), dtype=result_type(*columns))
+    for index, column in enumerate(columns):
+        codes[:, index] = column
+
+    return codes
@@ -0,0 +1,338 @@
+import argparse
+import json
+import os
+from typing import Mapping, Optional
+
+from numpy import arange, array, bincount, concatenate, cumsum, errstate, int64, intp, load, log, log2, maximum, ndarray, \
+    savez, where, zeros
+
+import ansi_escape_codes as c
+import dataSource
+from logger_config import logger
+
+# Probabilities are floored to this value for the PSI and the chi-square expectations, so empty slots stay finite
+DRIFT_EPSILON = 1e-6
+
+# Population stability index above which a feature counts as drifted, 0.1 to 0.25 is usually read as moderate
+PSI_THRESHOLD = 0.2
+
+# Number of distinct unseen values whose names are kept per feature, further ones are only counted
+MAX_UNSEEN_VALUES = 32
+
+# Number of rows counted at once, bounding the temporary memory
+DRIFT_BLOCK_SIZE = 65536
+
+# Name of the drift reference file stored in a model registry entry
+REFERENCE_FILE = "drift.npz"
+
+class DriftMonitor:
+    """
+    Compare the feature frequencies of incoming rows with those seen at training time.
+
+    Every feature has a fixed row of counter slots: one for missing values, one
+    per category of its training vocabulary and one for unseen values. The
+    reference counts are taken once from the training data; batches of new
+    rows are then added to the current counts with a single ``bincount`` per
+    block of rows, so the memory per feature is constant however many rows
+    are streamed. Batches may come with their own vocabularies, whose codes are
+    mapped onto the reference slots through one small lookup table per column.
+    ``get_report`` compares both distributions of every feature by population
+    stability index, chi-square statistic and Jensen-Shannon divergence.
+    """
+
+    def __init__(self, vocabularies: Mapping[str, list[str]], reference: ndarray):
+        self.vocabularies = {name: list(categories) for name, categories in vocabularies.items()}
+        self.reference = reference.astype(int64)
+
+        # Lay the slots of all features out in one flat counter
+        sizes = [len(categories) + 2 for categories in self.vocabularies.values()]
+        self.offsets = concatenate([[0], cumsum(sizes)[:-1]]).astype(intp)
+        self.current = zeros(sum(sizes), dtype=int64)
+        self.unseen = {name: {} for name in self.vocabularies}
+
+        # Map the codes of every feature (shifted by one for missing values) onto its slots
+        self.identity = [offset + arange(size - 1, dtype=intp) for offset, size in zip(self.offsets, sizes)]
+
+    @classmethod
+    def from_matrix(cls, matrix: dataSource.CodeMatrix) -> "DriftMonitor":
+        """
+        Create a monitor with the feature frequencies of a training code matrix as reference.
+
+        Parameters
+        ----------
+        matrix : CodeMatrix
+            The training code matrix.
+
+        Returns
+        -------
+        DriftMonitor
+            The monitor, without any current counts yet.
+        """
+        monitor = cls({name: matrix.vocabularies[name] for name in matrix.feature_names},
+                      zeros(sum(len(matrix.vocabularies[name]) + 2 for name in matrix.feature_names), dtype=int64))
+
+        # Count the training rows like a batch and keep them as reference
+        monitor.update(matrix)
+        monitor.reference = monitor.current.copy()
+        monitor.reset()
+        return monitor
+
+    @classmethod
+    def load(cls, path: str) -> "DriftMonitor":
+        """
+        Load a monitor saved with ``save``.
+
+        Parameters
+        ----------
+        path : str
+            The path of the ``.npz`` file.
+
+        Returns
+        -------
+        DriftMonitor
+            The monitor with its reference and current counts.
+        """
+        with load(path) as data:
+            monitor = cls(json.loads(str(data['vocabularies'])), data['reference'])
+            monitor.current += data['current']
+            monitor.unseen = json.loads(str(data['unseen']))
+        return monitor
+
+    def save(self, path: str) -> None:
+        """
+        Save the reference and current counts atomically.
+
+        Parameters
+        ----------
+        path : str
+            The path of the ``.npz`` file.
+
+        Returns
+        -------
+        None
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(f"{path}.tmp", "wb") as file:
+            savez(file, reference=self.reference, current=self.current,
+                  vocabularies=json.dumps(self.vocabularies), unseen=json.dumps(self.unseen))
+        os.replace(f"{path}.tmp", path)
+
+    def update(self, batch: dataSource.CodeMatrix, block_size: int = DRIFT_BLOCK_SIZE) -> None:
+        """
+        Add the feature values of a batch of rows to the current counts.
+
+        Parameters
+        ----------
+        batch : CodeMatrix
+            The rows, with the features named like the reference features.
+        block_size : int
+            The number of rows counted at once.
+
+        Returns
+        -------
+        None
+        """
+        # Find the slots of the codes of every feature of the batch
+        names = list(self.vocabularies)
+        columns = [batch.feature_names.index(name) for name in names]
+        tables = [self.get_lookup(name, batch.vocabularies[name]) for name in names]
+        remapped = [index for index, table in enumerate(tables) if table is not self.identity[index]]
+        shifts = self.offsets + 1
+
+        # Count the slots of all features block by block
+        for start in range(0, len(batch), block_size):
+            block = batch.codes[start:start + block_size, columns].astype(intp)
+            block += shifts
+            for index in remapped:
+                block[:, index] = tables[index][block[:, index] - self.offsets[index]]
+            self.current += bincount(block.ravel(order='K'), minlength=len(self.current))
+
+        # Keep the names of the unseen values of the batch, up to a fixed number per feature
+        for index in remapped:
+            name, unseen_slot = names[index], self.offsets[index] + len(self.vocabularies[names[index]]) + 1
+            unseen_codes = (tables[index][1:] == unseen_slot).nonzero()[0]
+            if not len(unseen_codes):
+                continue
+            counts = bincount(batch.codes[:, columns[index]].astype(intp) + 1, minlength=len(tables[index]))
+            known = self.unseen[name]
+            for code in unseen_codes:
+                value = batch.vocabularies[name][code]
+                if counts[code + 1] and (value in known or len(known) < MAX_UNSEEN_VALUES):
+                    known[value] = known.get(value, 0) + int(counts[code + 1])
+
+    def get_lookup(self, name: str, categories: list[str]) -> ndarray:
+        """
+        Map the codes of a feature in a batch onto the slots of the feature.
+
+        Parameters
+        ----------
+        name : str
+            The name of the feature.
+        categories : list[str]
+            The categories of the feature in the batch.
+
+        Returns
+        -------
+        ndarray
+            The slot of every batch code shifted by one, missing values first.
+        """
+        index = list(self.vocabularies).index(name)
+        vocabulary = self.vocabularies[name]
+        if list(categories) == vocabulary:
+            return self.identity[index]
+
+        # Unseen categories go to the last slot of the feature
+        positions = {category: position for position, category in enumerate(vocabulary)}
+        unseen_slot = len(vocabulary) + 1
+        slots = [0] + [positions[category] + 1 if category in positions else unseen_slot for category in categories]
+        return self.offsets[index] + array(slots, dtype=intp)
+
+    def reset(self) -> None:
+        """
+        Forget the current counts, e.g. to start a new monitoring window.
+
+        Returns
+        -------
+        None
+        """
+        self.current[:] = 0
+        self.unseen = {name: {} for name in self.vocabularies}
+
+    def get_report(self) -> dict[str, dict]:
+        """
+        Compare the current with the reference frequencies of every feature.
+
+        The distributions cover the missing values, every training category and
+        the unseen values. The chi-square statistic tests the current counts
+        against the reference frequencies; with millions of rows even tiny
+        shifts are significant, so features are flagged by their PSI instead.
+
+        Returns
+        -------
+        dict[str, dict]
+            For every feature the number of samples, the PSI, the chi-square
+            statistic and its degrees of freedom, the Jensen-Shannon divergence
+            in bits, the missing and unseen counts, the names of the unseen
+            values and whether the feature drifted.
+        """
+        report = {}
+        for name, offset in zip(self.vocabularies, self.offsets):
+            size = len(self.vocabularies[name]) + 2
+            report[name] = compare_counts(self.reference[offset:offset + size], self.current[offset:offset + size])
+            report[name]['unseen_values'] = dict(self.unseen[name])
+
+            # Report drifted features and unseen values, which usually point to changed inputs
+            if report[name]['drifted']:
+                logger.warning(f"{c.CYAN}{name}{c.RESET} drifted: PSI {c.RED}{report[name]['psi']:.4f}{c.RESET}, "
+                               f"JS divergence {c.RED}{report[name]['js_divergence']:.4f}{c.RESET}")
+            if report[name]['unseen']:
+                logger.warning(f"{c.CYAN}{name}{c.RESET} has {c.RED}{report[name]['unseen']}{c.RESET} unseen values: "
+                               f"{c.RED}{list(self.unseen[name])}{c.RESET}")
+
+        return report
+
+def compare_counts(reference: ndarray, current: ndarray) -> dict:
+    """
+    Compare two count vectors over the same slots.
+
+    Parameters
+    ----------
+    reference : ndarray
+        The reference counts, missing values first and unseen values last.
+    current : ndarray
+        The current counts in the same slots.
+
+    Returns
+    -------
+    dict
+        The number of samples, PSI, chi-square statistic and degrees of freedom,
+        Jensen-Shannon divergence, missing and unseen counts, and the drift flag.
+    """
+    samples = int(current.sum())
+    result = {'samples': samples, 'missing': int(current[0]), 'unseen': int(current[-1])}
+    if not samples or not reference.sum():
+        return {**result, 'psi': None, 'chi_square': None, 'degrees_of_freedom': None, 'js_divergence': None, 'drifted': False}
+
+    expected = reference / reference.sum()
+    observed = current / samples
+
+    # Floor the probabilities so slots empty on one side stay finite
+    floored_expected, floored_observed = maximum(expected, DRIFT_EPSILON), maximum(observed, DRIFT_EPSILON)
+    psi = float(((floored_observed - floored_expected) * log(floored_observed / floored_expected)).sum())
+
+    # Test the current counts against the counts expected from the reference
+    used = (reference > 0) | (current > 0)
+    expected_counts = floored_expected[used] * samples
+    chi_square = float(((current[used] - expected_counts) ** 2 / expected_counts).sum())
+
+    # Average the divergences of both distributions from their mixture, in bits
+    mixture = (expected + observed) / 2
+    with errstate(divide="ignore", invalid="ignore"):
+        divergence = where(expected > 0, expected * log2(expected / mixture), 0.0).sum() \
+            + where(observed > 0, observed * log2(observed / mixture), 0.0).sum()
+
+    return {**result, 'psi': psi, 'chi_square': chi_square, 'degrees_of_freedom': int(used.sum()) - 1,
+            'js_divergence': float(max(divergence / 2, 0.0)), 'drifted': psi > PSI_THRESHOLD}
+
+def get_reference_path(model) -> Optional[str]:
+    """
+    Return the path of the drift reference stored with a registered model.
+
+    Parameters
+    ----------
+    model : Booster
+        The LightGBM model.
+
+    Returns
+    -------
+    Optional[str]
+        The path inside the registry entry of the model, None if it is not registered.
+    """
+    import modelRegistry
+
+    entry = modelRegistry.get_entry_path(model)
+    return os.path.join(entry, REFERENCE_FILE) if entry is not None else None
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """
+    Stream dataset files through a saved monitor and report the drift of every feature.
+
+    Parameters
+    ----------
+    argv : Optional[list[str]]
+        The command line arguments, by default those of the process.
+
+    Returns
+    -------
+    int
+        The exit code, 1 if any feature drifted or has unseen values.
+    """
+    parser = argparse.ArgumentParser(description="Compare dataset files with the feature frequencies a model was trained on.")
+    parser.add_argument("reference", help=f"drift reference, e.g. the {REFERENCE_FILE} of a registered model")
+    parser.add_argument("datasets", nargs="+", help="dataset files to monitor")
+    parser.add_argument("--chunk-size", type=int, default=dataSource.CHUNK_SIZE, dest="chunk_size")
+    parser.add_argument("--output", help="JSON file to write the report to")
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(args.reference):
+        logger.fatal(f"{c.RED}No drift reference found at {args.reference}{c.RESET}")
+        exit(1)
+    monitor = DriftMonitor.load(args.reference)
+    monitor.reset()
+
+    # Stream every file batch by batch into the current counts
+    for dataset_path in args.datasets:
+        logger.info(f"Monitoring {c.MAGENTA}{dataset_path}{c.RESET}...")
+        for batch in dataSource.read_code_batches(dataset_path, args.chunk_size):
+            monitor.update(batch)
+
+    report = monitor.get_report()
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        logger.info(f"Drift report saved at {c.MAGENTA}{args.output}{c.RESET}")
+
+    return 1 if any(feature['drifted'] or feature['unseen'] for feature in report.values()) else 0
+
+if __name__ == "__main__":
+    exit(main())
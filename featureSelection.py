@@ -0,0 +1,275 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+from typing import Optional
+
+from numpy import argsort, dtype, errstate, float64, log2, minimum, ndarray, sqrt, where, zeros
+
+import ansi_escape_codes as c
+import dataSource
+from logger_config import logger
+
+# Largest drop in held-out accuracy a smaller feature subset may cause
+SELECTION_TOLERANCE = 0.001
+
+# Share of the training rows held out to score the removals, the evaluation rows only stop training early
+SELECTION_HOLDOUT = 0.2
+
+# Number of lowest-ranked features whose removal is tried in every round
+SELECTION_CANDIDATES = 4
+
+def select_features(train: dataSource.CodeMatrix, evaluation: dataSource.CodeMatrix,
+                    tolerance: float = SELECTION_TOLERANCE, candidates: int = SELECTION_CANDIDATES,
+                    max_workers: Optional[int] = None, params: Optional[dict] = None,
+                    holdout: float = SELECTION_HOLDOUT) -> dict:
+    """
+    Find the smallest feature subset whose model stays within a tolerance of the full model.
+
+    The features are ranked by their mutual information and Cramér's V with the
+    target, taken from the contingency tables of the training profile, and by
+    their split and gain importance in the model of the current subset. Every
+    round of the backward elimination retrains without each of the
+    ``candidates`` lowest-ranked features in parallel and drops the one whose
+    removal costs the least accuracy, as long as the accuracy stays within
+    ``tolerance`` of the model on all features. The accuracy is measured on the
+    last ``holdout`` share of the (shuffled) training rows, which the models are
+    not fit on, so neither early stopping on the evaluation rows nor the test
+    rows take part in the selection. The training and evaluation codes are
+    placed in shared memory once, and the workers are started with 'spawn', as
+    forking a process that has run LightGBM can deadlock.
+
+    Parameters
+    ----------
+    train : CodeMatrix
+        The training code matrix.
+    evaluation : CodeMatrix
+        The evaluation code matrix, used for early stopping.
+    tolerance : float
+        The largest allowed drop in held-out accuracy.
+    candidates : int
+        The number of features whose removal is tried per round.
+    max_workers : Optional[int]
+        The number of worker processes, by default one per candidate up to the number of cores.
+    params : Optional[dict]
+        Parameters overriding the default LightGBM parameters.
+    holdout : float
+        The share of the training rows the removals are scored on.
+
+    Returns
+    -------
+    dict
+        The selected and removed features, the held-out accuracy of the full and
+        the selected model, the number of held-out rows, the scores of every
+        feature, every round, and the wall time.
+    """
+    import task1
+
+    start = time.perf_counter()
+
+    # Size the pool and share the cores among the workers
+    cpu_count = os.cpu_count() or 1
+    max_workers = max_workers or min(candidates, cpu_count)
+    num_threads = max(1, cpu_count // max_workers)
+    subset_params = {**(params or {}), 'num_threads': num_threads}
+
+    # Score the association of every feature with the target from the training profile
+    scores = get_association_scores(task1.get_profile(train))
+
+    # Fit on the first training rows and score on the rest, the split already shuffled them
+    num_fit = len(train) - max(1, int(len(train) * holdout))
+
+    # Copy the training and evaluation codes into shared memory once
+    shape = (len(train) + len(evaluation), train.codes.shape[1])
+    memory = shared_memory.SharedMemory(create=True, size=shape[0] * shape[1] * train.codes.itemsize)
+    try:
+        shared_codes = ndarray(shape, dtype=train.codes.dtype, buffer=memory.buf, order='F')
+        shared_codes[:len(train)] = train.codes
+        shared_codes[len(train):] = evaluation.codes
+        arguments = (memory.name, shape, shared_codes.dtype.str, {name: list(values) for name, values in train.vocabularies.items()},
+                     num_fit, len(train), subset_params)
+
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context("spawn")) as executor:
+            # Train on all features to get the reference accuracy and importances
+            selected = train.feature_names
+            current = executor.submit(run_subset, *arguments, selected).result()
+            baseline_accuracy = current['accuracy']
+            logger.info(f"Held-out accuracy with all {c.CYAN}{len(selected)}{c.RESET} features on "
+                        f"{c.CYAN}{len(train) - num_fit}{c.RESET} rows: {c.CYAN}{baseline_accuracy*100:.6f}%{c.RESET}")
+
+            rounds, removed = [], []
+            while len(selected) > 1:
+                # Try to drop each of the lowest-ranked features of the current subset
+                ranking = rank_features(selected, scores, current)
+                trials = ranking[:candidates]
+                futures = [executor.submit(run_subset, *arguments, [name for name in selected if name != trial])
+                           for trial in trials]
+                results = [future.result() for future in futures]
+
+                # Keep the removal that costs the least accuracy, the lower-ranked feature on ties
+                best = max(range(len(trials)), key=lambda index: (results[index]['accuracy'], -index))
+                rounds.append({'features': list(selected), 'tried': {trial: result['accuracy'] for trial, result in zip(trials, results)}})
+                if results[best]['accuracy'] < baseline_accuracy - tolerance:
+                    break
+
+                removed.append(trials[best])
+                selected = [name for name in selected if name != trials[best]]
+                current = results[best]
+                logger.info(f"Removed {c.CYAN}{trials[best]}{c.RESET}: {c.CYAN}{len(selected)}{c.RESET} features left "
+                            f"with accuracy {c.CYAN}{current['accuracy']*100:.6f}%{c.RESET}")
+        del shared_codes
+    finally:
+        memory.close()
+        memory.unlink()
+
+    report = {
+        'features': selected,
+        'removed': removed,
+        'baseline_accuracy': baseline_accuracy,
+        'accuracy': current['accuracy'],
+        'holdout_rows': len(train) - num_fit,
+        'scores': scores,
+        'rounds': rounds,
+        'wall_time': time.perf_counter() - start
+    }
+
+    logger.info(f"Selected {c.CYAN}{len(selected)}{c.RESET} of {c.CYAN}{len(train.feature_names)}{c.RESET} features "
+                f"with held-out accuracy {c.CYAN}{report['accuracy']*100:.6f}%{c.RESET} in {c.CYAN}{report['wall_time']:.3f}s{c.RESET}: "
+                f"{c.BLUE}{selected}{c.RESET}")
+
+    return report
+
+def get_association_scores(profile) -> dict[str, dict[str, float]]:
+    """
+    Compute the mutual information and Cramér's V of every feature with the target at once.
+
+    The contingency tables of all features are stacked into one zero-padded
+    array, so both measures are computed for all features in a few vectorized
+    operations. Missing values are left out.
+
+    Parameters
+    ----------
+    profile : DatasetProfile
+        The profile of the training data, see ``task1.get_profile``.
+
+    Returns
+    -------
+    dict[str, dict[str, float]]
+        The mutual information in bits and Cramér's V of every feature.
+    """
+    names = list(profile.counts)
+    tables = [profile.counts[name][1:, 1:] for name in names]
+
+    # Stack the tables, padding the feature values with empty rows
+    stacked = zeros((len(tables), max(len(table) for table in tables), tables[0].shape[1]), dtype=float64)
+    for index, table in enumerate(tables):
+        stacked[index, :len(table)] = table
+
+    # Compare the joint frequencies with the product of the marginal frequencies
+    totals = stacked.sum(axis=(1, 2))
+    joint = stacked / where(totals > 0, totals, 1)[:, None, None]
+    expected = joint.sum(axis=2, keepdims=True) * joint.sum(axis=1, keepdims=True)
+    with errstate(divide="ignore", invalid="ignore"):
+        mutual_information = where(joint > 0, joint * log2(joint / expected), 0.0).sum(axis=(1, 2))
+        chi_square = totals * where(expected > 0, (joint - expected) ** 2 / expected, 0.0).sum(axis=(1, 2))
+
+    # Normalize the chi-square statistic by the smaller number of occurring categories
+    occurring = minimum((stacked.sum(axis=2) > 0).sum(axis=1), (stacked.sum(axis=1) > 0).sum(axis=1))
+    with errstate(divide="ignore", invalid="ignore"):
+        cramers_v = where(occurring > 1, sqrt(chi_square / (totals * (occurring - 1))), 0.0)
+
+    return {name: {'mutual_information': float(information), 'cramers_v': float(v)}
+            for name, information, v in zip(names, mutual_information, cramers_v)}
+
+def rank_features(feature_names: list[str], scores: dict[str, dict[str, float]], result: dict) -> list[str]:
+    """
+    Order features from least to most useful.
+
+    Every feature gets its rank by mutual information, Cramér's V, split and
+    gain importance, and the features are ordered by their mean rank.
+
+    Parameters
+    ----------
+    feature_names : list[str]
+        The features of the current subset.
+    scores : dict[str, dict[str, float]]
+        The association scores from ``get_association_scores``.
+    result : dict
+        The result of ``run_subset`` for the current subset, holding the importances.
+
+    Returns
+    -------
+    list[str]
+        The features, least useful first.
+    """
+    measures = [
+        [scores[name]['mutual_information'] for name in feature_names],
+        [scores[name]['cramers_v'] for name in feature_names],
+        result['split_importance'],
+        result['gain_importance']
+    ]
+
+    # Average the ranks of every feature across the measures
+    ranks = sum(argsort(argsort(measure, kind="stable"), kind="stable") for measure in measures)
+    return [feature_names[index] for index in argsort(ranks, kind="stable")]
+
+def run_subset(memory_name: str, shape: tuple[int, int], dtype_name: str, vocabularies: dict[str, list[str]],
+               num_fit: int, num_train: int, params: dict, feature_names: list[str]) -> dict:
+    """
+    Train and score a model on a feature subset of the shared codes; runs in a worker process.
+
+    Parameters
+    ----------
+    memory_name : str
+        The name of the shared memory block holding the training rows followed by the evaluation rows.
+    shape : tuple[int, int]
+        The shape of the shared code matrix.
+    dtype_name : str
+        The dtype of the shared code matrix.
+    vocabularies : dict[str, list[str]]
+        The categories of every column in column order.
+    num_fit : int
+        The number of training rows the model is fit on, the remaining training rows score it.
+    num_train : int
+        The number of training rows.
+    params : dict
+        Parameters overriding the default LightGBM parameters.
+    feature_names : list[str]
+        The features to train on.
+
+    Returns
+    -------
+    dict
+        The held-out accuracy, the split and gain importance of every feature, and the training time.
+    """
+    import predictionEngine
+    import metricsEngine
+    import task3
+
+    # Map the shared code matrix and copy out the columns of the subset
+    memory = shared_memory.SharedMemory(name=memory_name)
+    try:
+        codes = ndarray(shape, dtype=dtype(dtype_name), buffer=memory.buf, order='F')
+        matrix = dataSource.CodeMatrix(codes, vocabularies).select(feature_names)
+        del codes
+    finally:
+        memory.close()
+    train, holdout = matrix.take(slice(None, num_fit)), matrix.take(slice(num_fit, num_train))
+    evaluation = matrix.take(slice(num_train, None))
+
+    # Train on the compressed training rows, stopping early on the evaluation rows
+    start = time.perf_counter()
+    train_unique, weights = task3.compress_code_matrix(train)
+    model = task3.get_trained_model(train_unique, None, evaluation, None, params=params, weight=weights, use_registry=False)
+    train_time = time.perf_counter() - start
+
+    # Score every distinct held-out row once
+    probabilities, = predictionEngine.predict_probabilities(model, holdout, cache=None)
+    accuracy = float((metricsEngine.get_predictions(probabilities) == holdout.targets).mean())
+
+    return {
+        'accuracy': accuracy,
+        'split_importance': model.feature_importance('split').tolist(),
+        'gain_importance': model.feature_importance('gain').tolist(),
+        'train_time': train_time
+    }
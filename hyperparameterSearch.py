@@ -0,0 +1,284 @@
+import argparse
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Optional
+
+from lightgbm import Dataset, early_stopping, train
+from numpy import random
+from pandas import DataFrame, Series
+
+import ansi_escape_codes as c
+import dataSource
+from logger_config import logger
+import task3
+
+# Search space: parameter -> (low, high, log scale, integer)
+SEARCH_SPACE = {
+    'num_leaves': (4, 256, True, True),
+    'learning_rate': (0.01, 0.3, True, False),
+    'min_data_in_leaf': (5, 500, True, True),
+    'cat_smooth': (1.0, 100.0, True, False),
+    'max_cat_threshold': (4, 64, False, True)
+}
+
+# Metric minimized by the search on the evaluation split
+SEARCH_METRIC = 'binary_logloss'
+
+# Dataset parameters, pre-filtering is disabled so min_data_in_leaf can vary per trial
+DATASET_PARAMS = {'verbosity': -1, 'feature_pre_filter': False}
+
+# Datasets loaded once per worker process by ``load_datasets``
+WORKER_DATASETS: dict[str, Dataset] = {}
+
+def search_hyperparameters(X_train: DataFrame | dataSource.CodeMatrix, y_train: Optional[Series],
+                           X_eval: DataFrame | dataSource.CodeMatrix, y_eval: Optional[Series],
+                           n_trials: int = 81, min_rounds: int = 10, max_rounds: int = 810,
+                           reduction_factor: int = 3, max_workers: Optional[int] = None,
+                           random_state: int = 42) -> dict:
+    """
+    Search LightGBM hyperparameters with random sampling and successive halving.
+
+    ``n_trials`` random configurations start with a budget of ``min_rounds``
+    boosting rounds. After every rung only the best ``1 / reduction_factor`` of
+    the configurations, ranked by their evaluation loss, continue with a budget
+    ``reduction_factor`` times larger, until ``max_rounds`` is reached. Within a
+    trial, training stops early on the evaluation split. Clearly losing
+    configurations therefore only ever cost a few rounds.
+
+    The training and evaluation datasets are constructed once and saved in
+    LightGBM's binary format, and every worker process loads that binary once
+    instead of receiving the data with each trial. The workers are started with
+    'spawn', as forking a process that has run LightGBM can deadlock. Code
+    matrices are read into the datasets directly; their rows are not compressed,
+    as weighted unique rows would change the meaning of the sampled
+    ``min_data_in_leaf``.
+
+    Parameters
+    ----------
+    X_train : DataFrame | CodeMatrix
+        The training feature dataset, or the training code matrix.
+    y_train : Optional[Series]
+        The encoded training target dataset, None for a code matrix.
+    X_eval : DataFrame | CodeMatrix
+        The evaluation feature dataset, or the evaluation code matrix.
+    y_eval : Optional[Series]
+        The encoded evaluation target dataset, None for a code matrix.
+    n_trials : int
+        The number of random configurations in the first rung.
+    min_rounds : int
+        The boosting rounds of the first rung.
+    max_rounds : int
+        The maximum boosting rounds of the last rung.
+    reduction_factor : int
+        The factor by which the configurations shrink and the budget grows per rung.
+    max_workers : Optional[int]
+        The number of worker processes, by default one per core.
+    random_state : int
+        The seed of the random sampling.
+
+    Returns
+    -------
+    dict
+        The best parameters, their evaluation loss and number of rounds, every
+        trial of every rung, and the wall time of the search.
+    """
+    start = time.perf_counter()
+
+    # Size the pool and share the cores among the workers
+    cpu_count = os.cpu_count() or 1
+    max_workers = max_workers or cpu_count
+    num_threads = max(1, cpu_count // max_workers)
+
+    # Sample the configurations of the first rung
+    generator = random.default_rng(random_state)
+    configurations = [sample_params(generator) for _ in range(n_trials)]
+
+    directory = tempfile.mkdtemp()
+    try:
+        # Construct the datasets once and share them as binary files
+        train_path, eval_path = os.path.join(directory, "train.bin"), os.path.join(directory, "eval.bin")
+        if isinstance(X_train, dataSource.CodeMatrix):
+            vocabularies = dict(X_train.vocabularies)
+            train_dataset = task3.get_dataset_from_codes(X_train.codes, vocabularies, params=DATASET_PARAMS)
+            train_dataset.save_binary(train_path)
+            task3.get_dataset_from_codes(X_eval.codes, vocabularies, params=DATASET_PARAMS,
+                                         reference=train_dataset).save_binary(eval_path)
+        else:
+            train_dataset = Dataset(X_train, label=y_train, params=DATASET_PARAMS)
+            train_dataset.save_binary(train_path)
+            Dataset(X_eval, label=y_eval, reference=train_dataset, params=DATASET_PARAMS).save_binary(eval_path)
+        del train_dataset
+
+        logger.info(f"Searching {c.CYAN}{n_trials}{c.RESET} configurations on {c.CYAN}{max_workers}{c.RESET} workers...")
+
+        trials = []
+        rounds = min_rounds
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context("spawn"), initializer=load_datasets,
+                                 initargs=(train_path, eval_path)) as executor:
+            while True:
+                # Run every remaining configuration with the budget of this rung
+                results = list(executor.map(run_trial, configurations, [rounds] * len(configurations),
+                                            [num_threads] * len(configurations)))
+                results.sort(key=lambda result: result['loss'])
+                trials.extend({**result, 'budget': rounds} for result in results)
+
+                logger.info(f"Rung with {c.CYAN}{rounds}{c.RESET} rounds: {c.CYAN}{len(results)}{c.RESET} configurations, "
+                            f"best loss {c.CYAN}{results[0]['loss']:.6f}{c.RESET}")
+
+                # Stop once the largest budget has been spent or a single configuration is left
+                if rounds >= max_rounds or len(results) == 1:
+                    break
+
+                # Keep the best configurations and grow their budget
+                survivors = max(1, len(results) // reduction_factor)
+                configurations = [result['params'] for result in results[:survivors]]
+                rounds = min(rounds * reduction_factor, max_rounds)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    best = results[0]
+    logger.info(f"Best parameters: {c.BLUE}{best['params']}{c.RESET} with loss {c.CYAN}{best['loss']:.6f}{c.RESET} "
+                f"after {c.CYAN}{best['best_iteration']}{c.RESET} rounds")
+
+    return {
+        'params': best['params'],
+        'loss': best['loss'],
+        'best_iteration': best['best_iteration'],
+        'trials': trials,
+        'wall_time': time.perf_counter() - start
+    }
+
+def sample_params(generator: random.Generator) -> dict:
+    """
+    Draw one random configuration from the search space.
+
+    Parameters
+    ----------
+    generator : random.Generator
+        The random number generator.
+
+    Returns
+    -------
+    dict
+        The sampled LightGBM parameters.
+    """
+    params = {}
+    for name, (low, high, log_scale, integer) in SEARCH_SPACE.items():
+        # Sample uniformly, on a log scale where the range spans magnitudes
+        if log_scale:
+            value = math.exp(generator.uniform(math.log(low), math.log(high)))
+        else:
+            value = generator.uniform(low, high)
+        params[name] = int(round(value)) if integer else value
+
+    return params
+
+def load_datasets(train_path: str, eval_path: str) -> None:
+    """
+    Load the shared training and evaluation datasets once per worker process.
+
+    Parameters
+    ----------
+    train_path : str
+        The path of the binary training dataset.
+    eval_path : str
+        The path of the binary evaluation dataset.
+
+    Returns
+    -------
+    None
+    """
+    WORKER_DATASETS['train'] = Dataset(train_path, params=DATASET_PARAMS)
+    WORKER_DATASETS['eval'] = Dataset(eval_path, reference=WORKER_DATASETS['train'], params=DATASET_PARAMS)
+
+def run_trial(params: dict, num_boost_round: int, num_threads: int) -> dict:
+    """
+    Train one configuration with early stopping on the evaluation split; runs in a worker process.
+
+    Parameters
+    ----------
+    params : dict
+        The LightGBM parameters of the configuration.
+    num_boost_round : int
+        The maximum number of boosting rounds.
+    num_threads : int
+        The number of LightGBM threads of this worker.
+
+    Returns
+    -------
+    dict
+        The parameters, the best evaluation loss and its boosting round, and the training time.
+    """
+    start = time.perf_counter()
+
+    # Train on the shared datasets and stop once the evaluation loss stops improving
+    model = train(
+        {**task3.PARAMS, **DATASET_PARAMS, 'metric': SEARCH_METRIC, 'num_threads': num_threads, **params},
+        train_set=WORKER_DATASETS['train'],
+        num_boost_round=num_boost_round,
+        valid_sets=[WORKER_DATASETS['eval']],
+        callbacks=[early_stopping(task3.EARLY_STOPPING_ROUNDS, verbose=False)]
+    )
+
+    return {
+        'params': params,
+        'loss': model.best_score['valid_0'][SEARCH_METRIC],
+        'best_iteration': model.best_iteration,
+        'train_time': time.perf_counter() - start
+    }
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """
+    Search the hyperparameters on the training and evaluation split of a dataset file from the command line.
+
+    Parameters
+    ----------
+    argv : Optional[list[str]]
+        The command line arguments, by default those of the process.
+
+    Returns
+    -------
+    int
+        The exit code.
+    """
+    import task2
+
+    parser = argparse.ArgumentParser(description="Search LightGBM hyperparameters with successive halving.")
+    parser.add_argument("dataset", help="dataset file to split and search on")
+    parser.add_argument("--training-ratio", type=float, default=0.6, dest="training_ratio")
+    parser.add_argument("--eval-ratio", type=float, default=0.2, dest="eval_ratio")
+    parser.add_argument("--trials", type=int, default=81, help="number of random configurations in the first rung")
+    parser.add_argument("--min-rounds", type=int, default=10, dest="min_rounds")
+    parser.add_argument("--max-rounds", type=int, default=810, dest="max_rounds")
+    parser.add_argument("--reduction-factor", type=int, default=3, dest="reduction_factor")
+    parser.add_argument("--workers", type=int, dest="max_workers", help="number of worker processes")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="JSON file to write the report to")
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(args.dataset):
+        logger.fatal(f"{c.RED}Invalid file path {args.dataset}.{c.RESET}")
+        exit(1)
+
+    # Search on the training and evaluation splits the pipeline would use, the test split stays unseen
+    matrix = dataSource.read_code_matrix(args.dataset)
+    split_ratio = [args.training_ratio, args.eval_ratio, 1 - args.training_ratio - args.eval_ratio]
+    train, evaluation, _ = task2.split_code_matrix(matrix, split_ratio, random_state=args.seed)
+    report = search_hyperparameters(train, None, evaluation, None, args.trials, args.min_rounds, args.max_rounds,
+                                    args.reduction_factor, args.max_workers, args.seed)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        logger.info(f"Search report saved at {c.MAGENTA}{args.output}{c.RESET}")
+
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,258 @@
+import argparse
+import json
+import os
+from typing import Optional, Tuple
+
+from lightgbm import Booster, Dataset, train
+from pandas import DataFrame, Series, concat
+
+import ansi_escape_codes as c
+import dataSource
+from logger_config import logger
+import metricsEngine
+import task3
+
+# Largest drop in evaluation accuracy an update may cause before it is rolled back
+ACCURACY_TOLERANCE = 0.001
+
+def encode_with_vocabulary(features: DataFrame, targets: Series, vocabularies: dict[str, list[str]],
+                           unseen: str = 'missing') -> Tuple[DataFrame, Series]:
+    """
+    Re-encode a dataset against the frozen vocabularies of a trained model.
+
+    The codes of new data only mean the same as the codes the model was trained
+    on if both use the same categories in the same order. Values outside the
+    frozen vocabulary are counted per column and handled according to ``unseen``.
+
+    Parameters
+    ----------
+    features : DataFrame
+        The categorical feature dataset.
+    targets : Series
+        The categorical target dataset.
+    vocabularies : dict[str, list[str]]
+        The frozen categories of every feature followed by the target.
+    unseen : str
+        How to handle unseen values: 'missing' turns them into missing values
+        (sent down the right branch of categorical splits, like LightGBM does),
+        'drop' removes their rows, and 'error' raises a ValueError.
+
+    Returns
+    -------
+    Tuple[DataFrame, Series]
+        The re-encoded features and targets.
+    """
+    if unseen not in ('missing', 'drop', 'error'):
+        raise ValueError(f"Unknown handling of unseen values: {unseen}")
+
+    names = list(vocabularies)
+    columns, unseen_rows = {}, None
+    for name, column in [*features.items(), (names[-1], targets)]:
+        # Map the values onto the frozen categories, unseen values become missing
+        recoded = column.cat.set_categories(vocabularies[name])
+        lost = recoded.isna() & column.notna()
+        if lost.any():
+            values = sorted(set(column[lost].astype(str)))
+            logger.warning(f"{c.CYAN}{name}{c.RESET} has {c.RED}{int(lost.sum())}{c.RESET} unseen values: {c.RED}{values}{c.RESET}")
+            if unseen == 'error':
+                raise ValueError(f"Column {name} has values outside the vocabulary: {values}")
+            unseen_rows = lost if unseen_rows is None else unseen_rows | lost
+        columns[name] = recoded
+
+    dataset = DataFrame(columns)
+
+    # Drop the rows with unseen values if requested
+    if unseen == 'drop' and unseen_rows is not None:
+        dataset = dataset[~unseen_rows.to_numpy()]
+
+    return dataset[names[:-1]], dataset[names[-1]]
+
+def update_model(model: Booster, vocabularies: dict[str, list[str]], dataset_paths: list[str],
+                 X_eval: DataFrame, y_eval: Series, params: Optional[dict] = None, num_boost_round: int = 20,
+                 unseen: str = 'missing', tolerance: float = ACCURACY_TOLERANCE) -> Tuple[Booster, dict]:
+    """
+    Continue boosting a trained model on newly arrived dataset files.
+
+    The new files are encoded against the frozen vocabularies and new trees are
+    added on top of the existing ones, starting from the existing model's
+    predictions, so the cost grows with the new data only. If the accuracy on
+    the evaluation split drops by more than ``tolerance``, the update is rolled
+    back and the existing model is returned unchanged.
+
+    Parameters
+    ----------
+    model : Booster
+        The trained LightGBM model.
+    vocabularies : dict[str, list[str]]
+        The categories the model was trained on, every feature followed by the target.
+    dataset_paths : list[str]
+        The paths of the new dataset files.
+    X_eval : DataFrame
+        The evaluation feature dataset, encoded with the same vocabularies.
+    y_eval : Series
+        The encoded evaluation target dataset.
+    params : Optional[dict]
+        Parameters overriding the default LightGBM parameters.
+    num_boost_round : int
+        The number of boosting rounds added.
+    unseen : str
+        How to handle unseen values, see ``encode_with_vocabulary``.
+    tolerance : float
+        The largest accepted drop in evaluation accuracy.
+
+    Returns
+    -------
+    Tuple[Booster, dict]
+        The updated (or, after a rollback, the existing) model and a report with
+        the accuracies before and after the update and whether it was accepted.
+    """
+    # Encode the new files against the frozen vocabularies
+    parts = [encode_with_vocabulary(*dataSource.read_data_set(path), vocabularies, unseen) for path in dataset_paths]
+    X_new = concat([features for features, _ in parts])
+    y_new = concat([targets for _, targets in parts]).cat.codes
+
+    # Measure the existing model before changing anything
+    accuracy_before = get_accuracy(model, X_eval, y_eval)
+
+    logger.info(f"Continuing training on {c.CYAN}{len(X_new)}{c.RESET} new samples from "
+                f"{c.CYAN}{len(dataset_paths)}{c.RESET} files...")
+
+    # Add trees on top of the existing model, starting from its predictions
+    updated = train({**task3.PARAMS, **(params or {})}, train_set=Dataset(X_new, label=y_new),
+                    num_boost_round=num_boost_round, init_model=model, keep_training_booster=True)
+    accuracy_after = get_accuracy(updated, X_eval, y_eval)
+
+    # Roll back if the update made the model worse
+    accepted = accuracy_after >= accuracy_before - tolerance
+    report = {
+        'new_samples': len(X_new),
+        'accuracy_before': accuracy_before,
+        'accuracy_after': accuracy_after,
+        'accepted': accepted
+    }
+    if accepted:
+        logger.info(f"Accepted update: accuracy {c.CYAN}{accuracy_before*100:.6f}%{c.RESET} -> {c.CYAN}{accuracy_after*100:.6f}%{c.RESET}")
+        return updated, report
+
+    logger.warning(f"Rolled back update: accuracy {c.CYAN}{accuracy_before*100:.6f}%{c.RESET} -> {c.RED}{accuracy_after*100:.6f}%{c.RESET}")
+    return model, report
+
+def get_accuracy(model: Booster, X_eval: DataFrame, y_eval: Series) -> float:
+    """
+    Calculate the accuracy of a model on the evaluation split.
+
+    Parameters
+    ----------
+    model : Booster
+        The LightGBM model.
+    X_eval : DataFrame
+        The evaluation feature dataset.
+    y_eval : Series
+        The encoded evaluation target dataset.
+
+    Returns
+    -------
+    float
+        The share of correctly predicted samples.
+    """
+    y_pred = metricsEngine.get_predictions(model.predict(X_eval))
+    return float((y_pred == y_eval.to_numpy()).mean())
+
+def update_saved_model(model_path: str, target_values: list[str], dataset_paths: list[str], X_eval: DataFrame,
+                       y_eval: Series, output_path: Optional[str] = None, **kwargs) -> dict:
+    """
+    Continue boosting a saved model on new dataset files and save it if the update is accepted.
+
+    The feature vocabularies are the pandas categories stored in the model file.
+
+    Parameters
+    ----------
+    model_path : str
+        The path of the saved LightGBM model.
+    target_values : list[str]
+        The target categories the model was trained on, in code order.
+    dataset_paths : list[str]
+        The paths of the new dataset files.
+    X_eval : DataFrame
+        The evaluation feature dataset.
+    y_eval : Series
+        The encoded evaluation target dataset.
+    output_path : Optional[str]
+        The path the updated model is saved to, by default ``model_path``.
+    **kwargs
+        Further arguments of ``update_model``.
+
+    Returns
+    -------
+    dict
+        The report of ``update_model``.
+    """
+    model = Booster(model_file=model_path)
+
+    # Recover the frozen vocabularies from the model file
+    vocabularies = dict(zip(model.feature_name(), model.pandas_categorical))
+    vocabularies[dataSource.COLUMN_NAMES[-1]] = target_values
+
+    updated, report = update_model(model, vocabularies, dataset_paths, X_eval, y_eval, **kwargs)
+    if report['accepted']:
+        updated.save_model(output_path or model_path)
+        logger.info(f"Updated model saved at {c.MAGENTA}{output_path or model_path}{c.RESET}")
+
+    return report
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """
+    Continue boosting a saved model on new dataset files from the command line.
+
+    The model file only stores the feature vocabularies, so the target
+    categories are given on the command line.
+
+    Parameters
+    ----------
+    argv : Optional[list[str]]
+        The command line arguments, by default those of the process.
+
+    Returns
+    -------
+    int
+        The exit code, 1 if the update was rolled back.
+    """
+    parser = argparse.ArgumentParser(description="Continue training a saved model on newly arrived dataset files.")
+    parser.add_argument("model", help="saved LightGBM model, e.g. the model.txt of a registered model")
+    parser.add_argument("datasets", nargs="+", help="new dataset files to train on")
+    parser.add_argument("--eval", required=True, dest="eval_path", help="dataset file the update is evaluated on")
+    parser.add_argument("--target-values", type=lambda value: value.split(","), required=True, dest="target_values",
+                        help="comma-separated target categories the model was trained on in code order, e.g. k0,k1")
+    parser.add_argument("--output", help="path the updated model is saved to, by default the model path")
+    parser.add_argument("--rounds", type=int, default=20, help="number of boosting rounds added")
+    parser.add_argument("--params", type=json.loads, help="LightGBM parameters as JSON object")
+    parser.add_argument("--unseen", choices=["missing", "drop", "error"], default="missing",
+                        help="how to handle values outside the vocabulary of the model")
+    parser.add_argument("--tolerance", type=float, default=ACCURACY_TOLERANCE,
+                        help="largest accepted drop in evaluation accuracy")
+    parser.add_argument("--report", help="JSON file to write the report to")
+    args = parser.parse_args(argv)
+
+    for path in [args.model, args.eval_path, *args.datasets]:
+        if not os.path.isfile(path):
+            logger.fatal(f"{c.RED}Invalid file path {path}.{c.RESET}")
+            exit(1)
+
+    # Encode the evaluation file against the vocabularies of the model
+    model = Booster(model_file=args.model)
+    vocabularies = dict(zip(model.feature_name(), model.pandas_categorical))
+    vocabularies[dataSource.COLUMN_NAMES[-1]] = args.target_values
+    X_eval, y_eval = encode_with_vocabulary(*dataSource.read_data_set(args.eval_path), vocabularies, args.unseen)
+
+    report = update_saved_model(args.model, args.target_values, args.datasets, X_eval, y_eval.cat.codes, args.output,
+                                params=args.params, num_boost_round=args.rounds, unseen=args.unseen,
+                                tolerance=args.tolerance)
+    if args.report:
+        with open(args.report, "w") as file:
+            json.dump(report, file, indent=2)
+        logger.info(f"Update report saved at {c.MAGENTA}{args.report}{c.RESET}")
+
+    return 0 if report['accepted'] else 1
+
+if __name__ == "__main__":
+    exit(main())
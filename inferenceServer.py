@@ -0,0 +1,251 @@
+import argparse
+import asyncio
+import time
+from typing import Optional
+
+from numpy import percentile
+
+import ansi_escape_codes as c
+from logger_config import logger
+import treeCompiler
+
+# Longest time a request waits for others to join its batch, in seconds
+LATENCY_BUDGET = 0.002
+
+# Largest number of rows scored at once
+MAX_BATCH_SIZE = 1024
+
+# Largest number of requests waiting to be scored before new ones are rejected
+MAX_QUEUE_SIZE = 10000
+
+# Reply sent when the request queue is full
+BUSY_REPLY = b"BUSY\n"
+
+def load_model(model_path: str) -> treeCompiler.CompiledModel:
+    """
+    Load a model for serving.
+
+    Compiled models (``.npz``) are loaded without LightGBM. LightGBM model files
+    are compiled on load, which imports LightGBM once.
+
+    Parameters
+    ----------
+    model_path : str
+        The path to a compiled model or a LightGBM model file.
+
+    Returns
+    -------
+    CompiledModel
+        The model to be served.
+    """
+    if model_path.endswith(".npz"):
+        return treeCompiler.load_compiled_model(model_path)
+
+    from lightgbm import Booster
+    return treeCompiler.compile_model(Booster(model_file=model_path))
+
+class InferenceServer:
+    """
+    Line-based inference server collecting concurrent requests into micro-batches.
+
+    Every request is one line with a raw row in the dataset format (``k1; kS; ...;``,
+    a trailing target token is ignored) and is answered by one line with the
+    predicted probability. Requests wait in a bounded queue, and a single batcher
+    takes everything that arrives within the latency budget of the first waiting
+    request and scores it at once. If the queue is full, requests are answered
+    with ``BUSY`` right away instead of piling up.
+    """
+
+    def __init__(self, model: treeCompiler.CompiledModel, latency_budget: float = LATENCY_BUDGET,
+                 max_batch_size: int = MAX_BATCH_SIZE, max_queue_size: int = MAX_QUEUE_SIZE):
+        self.model = model
+        self.latency_budget = latency_budget
+        self.max_batch_size = max_batch_size
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answer the requests of one connection in order."""
+        loop = asyncio.get_running_loop()
+        try:
+            while line := await reader.readline():
+                tokens = line.decode().split()
+                if len(tokens) < len(self.model.feature_names):
+                    writer.write(b"ERROR expected %d tokens\n" % len(self.model.feature_names))
+                elif self.queue.full():
+                    # Push back on the client instead of growing the queue
+                    writer.write(BUSY_REPLY)
+                else:
+                    future = loop.create_future()
+                    self.queue.put_nowait((tokens[:len(self.model.feature_names)], future))
+                    writer.write(f"{await future:.9f}\n".encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def run_batcher(self) -> None:
+        """Collect requests into micro-batches and score them."""
+        loop = asyncio.get_running_loop()
+        while True:
+            # Wait for the first request, then for others until its budget is spent
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.latency_budget
+            while len(batch) < self.max_batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            # Score the batch off the event loop, so connections keep being served
+            rows = [tokens for tokens, _ in batch]
+            try:
+                probabilities = await loop.run_in_executor(None, self.score, rows)
+            except Exception as error:
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+            for (_, future), probability in zip(batch, probabilities.tolist()):
+                future.set_result(probability)
+
+    def score(self, rows: list[list[str]]):
+        """Encode and score a batch of raw rows."""
+        return self.model.predict(self.model.encode(rows))
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765, unix_path: Optional[str] = None) -> None:
+        """Serve requests on a Unix socket or a localhost TCP port until cancelled."""
+        if unix_path is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, path=unix_path)
+            address = unix_path
+        else:
+            server = await asyncio.start_server(self.handle_connection, host=host, port=port)
+            address = f"{host}:{port}"
+
+        logger.info(f"Serving model on {c.MAGENTA}{address}{c.RESET} "
+                    f"(latency budget {c.CYAN}{self.latency_budget * 1000:.1f}ms{c.RESET}, "
+                    f"batches of up to {c.CYAN}{self.max_batch_size}{c.RESET})")
+
+        batcher = asyncio.create_task(self.run_batcher())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+async def run_load_generator(rows: list[str], num_requests: int = 10000, concurrency: int = 64,
+                             host: str = "127.0.0.1", port: int = 8765, unix_path: Optional[str] = None) -> dict:
+    """
+    Send requests from concurrent connections and measure throughput and latency.
+
+    Parameters
+    ----------
+    rows : list[str]
+        The raw rows to send, cycled through.
+    num_requests : int
+        The total number of requests.
+    concurrency : int
+        The number of concurrent connections, each sending one request at a time.
+    host : str
+        The host of the server.
+    port : int
+        The TCP port of the server.
+    unix_path : Optional[str]
+        The Unix socket of the server, used instead of host and port if given.
+
+    Returns
+    -------
+    dict
+        The number of requests and rejections, the throughput in requests per
+        second and the p50 and p99 latency in milliseconds.
+    """
+    latencies, rejected = [], 0
+
+    async def client(index: int) -> None:
+        nonlocal rejected
+        if unix_path is not None:
+            reader, writer = await asyncio.open_unix_connection(unix_path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+
+        # Every client sends its share of the requests one after another
+        for request in range(index, num_requests, concurrency):
+            start = time.perf_counter()
+            writer.write(rows[request % len(rows)].rstrip("\n").encode() + b"\n")
+            await writer.drain()
+            reply = await reader.readline()
+            latencies.append(time.perf_counter() - start)
+            rejected += reply == BUSY_REPLY
+
+        writer.close()
+        await writer.wait_closed()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(index) for index in range(concurrency)))
+    wall_time = time.perf_counter() - start
+
+    report = {
+        'requests': num_requests,
+        'rejected': rejected,
+        'throughput': num_requests / wall_time,
+        'p50_ms': float(percentile(latencies, 50)) * 1000,
+        'p99_ms': float(percentile(latencies, 99)) * 1000
+    }
+
+    logger.info(f"{c.CYAN}{report['requests']}{c.RESET} requests ({c.CYAN}{report['rejected']}{c.RESET} rejected): "
+                f"{c.CYAN}{report['throughput']:.0f}{c.RESET} requests/s, p50 {c.CYAN}{report['p50_ms']:.3f}ms{c.RESET}, "
+                f"p99 {c.CYAN}{report['p99_ms']:.3f}ms{c.RESET}")
+
+    return report
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """
+    Serve a model or generate load against a running server.
+
+    Parameters
+    ----------
+    argv : Optional[list[str]]
+        The command line arguments, by default those of the process.
+
+    Returns
+    -------
+    None
+    """
+    parser = argparse.ArgumentParser(description="Micro-batching inference server for the trained model.")
+    parser.add_argument("--host", default="127.0.0.1", help="host to serve on or connect to")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port to serve on or connect to")
+    parser.add_argument("--unix", help="Unix socket to serve on or connect to instead of TCP")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="serve a saved model")
+    serve.add_argument("model", help="compiled model (.npz) or LightGBM model file")
+    serve.add_argument("--latency-budget", type=float, default=LATENCY_BUDGET * 1000, help="batching budget in ms")
+    serve.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    serve.add_argument("--max-queue-size", type=int, default=MAX_QUEUE_SIZE)
+
+    load = commands.add_parser("load", help="send rows of a dataset file to a running server")
+    load.add_argument("dataset", help="dataset file whose rows are sent")
+    load.add_argument("--requests", type=int, default=10000)
+    load.add_argument("--concurrency", type=int, default=64)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        server = InferenceServer(load_model(args.model), args.latency_budget / 1000, args.max_batch_size,
+                                 args.max_queue_size)
+        try:
+            asyncio.run(server.serve(args.host, args.port, args.unix))
+        except KeyboardInterrupt:
+            pass
+    else:
+        with open(args.dataset) as file:
+            rows = [line for _, line in zip(range(args.requests), file)]
+        asyncio.run(run_load_generator(rows, args.requests, args.concurrency, args.host, args.port, args.unix))
+
+if __name__ == "__main__":
+    main()
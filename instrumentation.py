@@ -0,0 +1,226 @@
+import cProfile
+import csv
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where peak RSS is not reported
+    resource = None
+
+import ansi_escape_codes as c
+from logger_config import logger
+
+# Columns of the CSV trace, in order
+TRACE_FIELDS = ["stage", "depth", "wall_time", "cpu_time", "rows", "rows_per_second",
+                "peak_rss_bytes", "peak_allocated_bytes", "profile"]
+
+# The trace stages are currently recorded into, None if nothing is traced
+ACTIVE_TRACE = None
+
+class Trace:
+    """
+    Cost measurements of the stages of one pipeline run.
+
+    Stages are opened with ``stage``, either on the trace or through the module
+    level ``stage`` function used by the pipeline modules, and may be nested;
+    a nested stage is recorded under its path, e.g. ``train/fit``. Every record
+    holds the wall and CPU time, the peak resident set size of the process, the
+    row throughput if the stage reports its rows and, with allocation tracing,
+    the peak of the memory allocated by the stage. With a profile directory,
+    every outermost stage is also run under cProfile and dumped to
+    ``<profile_dir>/<stage>.prof``. Stages may run concurrently in several
+    threads, each thread nesting its own stages; the allocation peaks of
+    concurrent stages then include each other's allocations.
+    """
+
+    def __init__(self, trace_allocations: bool = False, profile_dir: Optional[str] = None):
+        self.records = []
+        self.trace_allocations = trace_allocations
+        self.profile_dir = profile_dir
+        self.local = threading.local()
+
+    @property
+    def stack(self) -> list[dict]:
+        """The stages currently open in the calling thread, outermost first."""
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    @contextmanager
+    def stage(self, name: str, rows: Optional[int] = None) -> Iterator[dict]:
+        """
+        Measure the cost of a stage.
+
+        Parameters
+        ----------
+        name : str
+            The name of the stage.
+        rows : Optional[int]
+            The number of rows processed, may also be set later through ``record['rows']``.
+
+        Yields
+        ------
+        dict
+            The record of the stage, filled in when the stage ends.
+        """
+        path = "/".join([entry['record']['stage'] for entry in self.stack] + [name])
+        record = {'stage': path, 'depth': len(self.stack), 'rows': rows}
+        entry = {'record': record, 'peak': 0}
+        self.records.append(record)
+
+        # Start allocation tracing if it is not running yet, keeping the peak of the enclosing stage
+        started_tracing = self.trace_allocations and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if self.trace_allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            if self.stack:
+                self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+            entry['start_allocated'] = current
+
+        # Profile outermost stages only, as only one profiler can be active at a time
+        profiler = cProfile.Profile() if self.profile_dir and not self.stack else None
+
+        self.stack.append(entry)
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            record['wall_time'] = time.perf_counter() - wall_start
+            record['cpu_time'] = time.process_time() - cpu_start
+            self.stack.pop()
+
+            # Compute the throughput if the rows are known
+            if record['rows'] is not None and record['wall_time'] > 0:
+                record['rows_per_second'] = record['rows'] / record['wall_time']
+            record['peak_rss_bytes'] = get_peak_rss()
+
+            # Take the allocation peak since the start of the stage and pass it on to the enclosing stage
+            if self.trace_allocations:
+                peak = max(entry['peak'], tracemalloc.get_traced_memory()[1])
+                record['peak_allocated_bytes'] = max(0, peak - entry['start_allocated'])
+                if self.stack:
+                    self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+            if started_tracing:
+                tracemalloc.stop()
+
+            # Dump the profile of the stage
+            if profiler is not None:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                record['profile'] = os.path.join(self.profile_dir, f"{path}.prof")
+                profiler.dump_stats(record['profile'])
+
+            logger.info(f"Stage {c.MAGENTA}{path}{c.RESET} took {c.CYAN}{record['wall_time']:.3f}s{c.RESET} "
+                        f"(CPU {c.CYAN}{record['cpu_time']:.3f}s{c.RESET})")
+
+    def get_timings(self) -> dict[str, float]:
+        """
+        Return the wall time of every outermost stage.
+
+        Returns
+        -------
+        dict[str, float]
+            The wall time in seconds by stage name.
+        """
+        return {record['stage']: record['wall_time'] for record in self.records if record['depth'] == 0}
+
+    def write_json(self, path: str):
+        """
+        Write the records to a JSON file.
+
+        Parameters
+        ----------
+        path : str
+            The path of the JSON file.
+        """
+        with open(path, "w") as file:
+            json.dump(self.records, file, indent=2)
+        logger.info(f"Trace saved at {c.MAGENTA}{path}{c.RESET}")
+
+    def write_csv(self, path: str):
+        """
+        Write the records to a CSV file with one row per stage.
+
+        Parameters
+        ----------
+        path : str
+            The path of the CSV file.
+        """
+        with open(path, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=TRACE_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.records)
+        logger.info(f"Trace saved at {c.MAGENTA}{path}{c.RESET}")
+
+@contextmanager
+def activate(trace: Trace) -> Iterator[Trace]:
+    """
+    Record the stages opened through the module level ``stage`` into a trace.
+
+    Parameters
+    ----------
+    trace : Trace
+        The trace to record into.
+
+    Yields
+    ------
+    Trace
+        The trace.
+    """
+    global ACTIVE_TRACE
+    previous, ACTIVE_TRACE = ACTIVE_TRACE, trace
+    try:
+        yield trace
+    finally:
+        ACTIVE_TRACE = previous
+
+@contextmanager
+def stage(name: str, rows: Optional[int] = None) -> Iterator[dict]:
+    """
+    Measure a stage in the active trace, or do nothing if no trace is active.
+
+    Parameters
+    ----------
+    name : str
+        The name of the stage.
+    rows : Optional[int]
+        The number of rows processed, may also be set later through ``record['rows']``.
+
+    Yields
+    ------
+    dict
+        The record of the stage, a throwaway record if no trace is active.
+    """
+    if ACTIVE_TRACE is None:
+        yield {'rows': rows}
+        return
+    with ACTIVE_TRACE.stage(name, rows) as record:
+        yield record
+
+def get_peak_rss() -> Optional[int]:
+    """
+    Return the peak resident set size of the process so far.
+
+    Returns
+    -------
+    Optional[int]
+        The peak resident set size in bytes, None where it is not available.
+    """
+    if resource is None:
+        return None
+    # Linux reports kilobytes, macOS reports bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
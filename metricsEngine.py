@@ -0,0 +1,277 @@
+from typing import Optional
+
+from numpy import arange, argmax, bincount, ceil, clip, concatenate, cumsum, diff, divide, errstate, float64, int64, intp, \
+    log, maximum, ndarray, where, zeros
+
+# Probability above which a binary prediction is the positive class
+DECISION_THRESHOLD = 0.5
+
+# Number of equal-width probability bins the curves and the threshold sweep are computed on
+CURVE_BINS = 4096
+
+# Probabilities are clipped to [LOGLOSS_EPSILON, 1 - LOGLOSS_EPSILON] for the log-loss
+LOGLOSS_EPSILON = 1e-15
+
+def get_predictions(probabilities: ndarray, threshold: float = DECISION_THRESHOLD) -> ndarray:
+    """
+    Turn predicted probabilities into class labels.
+
+    Parameters
+    ----------
+    probabilities : ndarray
+        The probability of the positive class, or one column of probabilities per class.
+    threshold : float
+        The probability above which a binary prediction is the positive class.
+
+    Returns
+    -------
+    ndarray
+        The predicted class of every sample.
+    """
+    if probabilities.ndim == 2:
+        return argmax(probabilities, axis=1)
+    return (probabilities > threshold).astype(int64)
+
+def get_confusion_matrix(labels: ndarray, predictions: ndarray, num_classes: Optional[int] = None) -> ndarray:
+    """
+    Count every (true class, predicted class) pair with one bincount.
+
+    Parameters
+    ----------
+    labels : ndarray
+        The true class of every sample.
+    predictions : ndarray
+        The predicted class of every sample.
+    num_classes : Optional[int]
+        The number of classes, by default the largest class seen plus one but at least two.
+
+    Returns
+    -------
+    ndarray
+        The confusion matrix with true classes as rows and predicted classes as columns.
+    """
+    labels, predictions = labels.astype(int64, copy=False), predictions.astype(int64, copy=False)
+    if num_classes is None:
+        num_classes = max(2, int(max(labels.max(initial=0), predictions.max(initial=0))) + 1)
+    return bincount(labels * num_classes + predictions, minlength=num_classes * num_classes).reshape(num_classes, num_classes)
+
+def evaluate_splits(splits: dict[str, tuple[ndarray, ndarray]], threshold: float = DECISION_THRESHOLD,
+                    curves: bool = False) -> dict[str, dict]:
+    """
+    Compute the metrics of several splits in one call.
+
+    Parameters
+    ----------
+    splits : dict[str, tuple[ndarray, ndarray]]
+        The integer labels and the predicted probabilities of every split.
+    threshold : float
+        The probability above which a binary prediction is the positive class.
+    curves : bool
+        Whether to include the ROC and precision-recall curves.
+
+    Returns
+    -------
+    dict[str, dict]
+        The metrics of every split, see ``evaluate_split``.
+    """
+    return {name: evaluate_split(labels, probabilities, threshold, curves) for name, (labels, probabilities) in splits.items()}
+
+def evaluate_split(labels: ndarray, probabilities: ndarray, threshold: float = DECISION_THRESHOLD, curves: bool = False) -> dict:
+    """
+    Compute every metric of one split from a few vectorized passes over its samples.
+
+    For a binary target, the true class, the prediction and the probability bin
+    of every sample are combined into one key and counted with a single
+    bincount; the confusion matrix, accuracy, precision, recall and F1, ROC-AUC,
+    average precision and the threshold sweep are all derived from these counts.
+    ROC-AUC, the curves and the sweep therefore use ``CURVE_BINS`` probability
+    bins and are exact up to ties within a bin. Multi-class probabilities are
+    given as one column per class; their predictions are the most probable
+    class and ROC-AUC is averaged one-vs-rest over the classes.
+
+    Parameters
+    ----------
+    labels : ndarray
+        The integer class of every sample.
+    probabilities : ndarray
+        The probability of the positive class, or one column of probabilities per class.
+    threshold : float
+        The probability above which a binary prediction is the positive class.
+    curves : bool
+        Whether to include the ROC and precision-recall curves of a binary target.
+
+    Returns
+    -------
+    dict
+        The number of samples, the confusion matrix, accuracy, per-class and macro
+        precision, recall and F1, log-loss and ROC-AUC, and for binary targets the
+        average precision and the best thresholds for F1 and accuracy.
+    """
+    labels = labels.astype(intp).ravel()
+    probabilities = probabilities.astype(float64, copy=False)
+
+    if probabilities.ndim == 2:
+        num_classes = max(probabilities.shape[1], int(labels.max(initial=0)) + 1)
+        result = get_matrix_metrics(get_confusion_matrix(labels, argmax(probabilities, axis=1), num_classes))
+
+        # Score every class against the rest and average the areas
+        areas = []
+        for scored_class in range(probabilities.shape[1]):
+            keys = (labels == scored_class) * CURVE_BINS + get_bins(probabilities[:, scored_class])
+            areas.append(get_curves(bincount(keys, minlength=2 * CURVE_BINS).reshape(2, CURVE_BINS))['roc_auc'])
+        known = [area for area in areas if area is not None]
+        result['roc_auc'] = float(sum(known) / len(known)) if known else None
+
+        true_probabilities = probabilities[arange(len(labels)), labels]
+    else:
+        # Count every (true class, prediction, probability bin) combination at once
+        keys = labels * (2 * CURVE_BINS)
+        keys += (probabilities > threshold) * CURVE_BINS
+        keys += get_bins(probabilities)
+        counts = bincount(keys, minlength=4 * CURVE_BINS).reshape(2, 2, CURVE_BINS)
+
+        result = get_matrix_metrics(counts.sum(axis=2))
+        histogram = counts.sum(axis=1)
+        area = get_curves(histogram)
+        result['roc_auc'] = area['roc_auc']
+        result['average_precision'] = area['average_precision']
+        result.update(get_threshold_sweep(histogram))
+        if curves:
+            result['curves'] = area['curves']
+
+        true_probabilities = where(labels == 1, probabilities, 1 - probabilities)
+
+    # Average the negative log-likelihood of the true classes
+    result['samples'] = len(labels)
+    result['log_loss'] = float(-log(clip(true_probabilities, LOGLOSS_EPSILON, 1)).mean()) if len(labels) else None
+    return result
+
+def get_bins(probabilities: ndarray) -> ndarray:
+    """
+    Return the probability bin of every sample.
+
+    Bin k holds the probabilities in (k / CURVE_BINS, (k + 1) / CURVE_BINS], so
+    the samples from bin k upwards are exactly those ``get_predictions`` calls
+    positive at the threshold k / CURVE_BINS. Bin 0 also holds probability 0.
+
+    Parameters
+    ----------
+    probabilities : ndarray
+        The probabilities in [0, 1].
+
+    Returns
+    -------
+    ndarray
+        The bin of every probability, in ``range(CURVE_BINS)``.
+    """
+    bins = ceil(probabilities * CURVE_BINS).astype(intp) - 1
+    return maximum(bins, 0, out=bins)
+
+def get_matrix_metrics(confusion_matrix: ndarray) -> dict:
+    """
+    Derive the accuracy and the per-class and macro precision, recall and F1 from a confusion matrix.
+
+    Classes never predicted or never present get a precision or recall of 0.
+
+    Parameters
+    ----------
+    confusion_matrix : ndarray
+        The confusion matrix with true classes as rows and predicted classes as columns.
+
+    Returns
+    -------
+    dict
+        The confusion matrix as lists, the accuracy, and the precision, recall and F1 per class and as macro average.
+    """
+    matrix = confusion_matrix.astype(float64)
+    correct = matrix.diagonal()
+    precision = divide(correct, matrix.sum(axis=0), out=zeros(len(correct)), where=matrix.sum(axis=0) > 0)
+    recall = divide(correct, matrix.sum(axis=1), out=zeros(len(correct)), where=matrix.sum(axis=1) > 0)
+    f1 = divide(2 * precision * recall, precision + recall, out=zeros(len(correct)), where=(precision + recall) > 0)
+
+    return {
+        'confusion_matrix': confusion_matrix.tolist(),
+        'accuracy': float(correct.sum() / matrix.sum()) if matrix.sum() else None,
+        'precision': precision.tolist(),
+        'recall': recall.tolist(),
+        'f1': f1.tolist(),
+        'macro_precision': float(precision.mean()),
+        'macro_recall': float(recall.mean()),
+        'macro_f1': float(f1.mean())
+    }
+
+def get_curves(histogram: ndarray) -> dict:
+    """
+    Compute the ROC and precision-recall curves from the binned probabilities of one class.
+
+    Parameters
+    ----------
+    histogram : ndarray
+        The number of negative (row 0) and positive (row 1) samples in every probability bin.
+
+    Returns
+    -------
+    dict
+        The ROC-AUC, the average precision and the curves with their thresholds, highest threshold first.
+    """
+    # Count the samples above every bin edge, from the highest bin down
+    negatives, positives = cumsum(histogram[:, ::-1], axis=1)
+    total_negatives, total_positives = negatives[-1], positives[-1]
+
+    with errstate(divide="ignore", invalid="ignore"):
+        false_positive_rate = concatenate([[0.0], negatives / total_negatives])
+        true_positive_rate = concatenate([[0.0], positives / total_positives])
+        precision = positives / (positives + negatives)
+
+    # Integrate the ROC curve with trapezoids, ties within a bin form the diagonal
+    roc_auc = float(((diff(false_positive_rate) * (true_positive_rate[1:] + true_positive_rate[:-1])) / 2).sum()) \
+        if total_negatives and total_positives else None
+
+    # Sum the precision at every bin that adds recall
+    average_precision = float((diff(true_positive_rate) * precision)[histogram[1, ::-1] > 0].sum()) if total_positives else None
+
+    thresholds = arange(CURVE_BINS - 1, -1, -1) / CURVE_BINS
+    return {
+        'roc_auc': roc_auc,
+        'average_precision': average_precision,
+        'curves': {
+            'thresholds': thresholds.tolist(),
+            'false_positive_rate': false_positive_rate[1:].tolist(),
+            'true_positive_rate': true_positive_rate[1:].tolist(),
+            'precision': precision.tolist()
+        }
+    }
+
+def get_threshold_sweep(histogram: ndarray) -> dict:
+    """
+    Find the decision thresholds with the best F1 and the best accuracy of a binary target.
+
+    Every bin edge is tried as threshold in one vectorized sweep over the cumulative counts;
+    a threshold reproduces its counts when passed to ``get_predictions``.
+
+    Parameters
+    ----------
+    histogram : ndarray
+        The number of negative (row 0) and positive (row 1) samples in every probability bin.
+
+    Returns
+    -------
+    dict
+        The best F1 and accuracy and the thresholds they are reached at.
+    """
+    # Predicting positive from bin k upwards: count the true and false positives for every k
+    false_positives, true_positives = cumsum(histogram[:, ::-1], axis=1)[:, ::-1]
+    total_negatives, total_positives = false_positives[0], true_positives[0]
+    thresholds = arange(CURVE_BINS) / CURVE_BINS
+
+    with errstate(divide="ignore", invalid="ignore"):
+        f1 = 2 * true_positives / (true_positives + false_positives + total_positives)
+    accuracy = (true_positives + total_negatives - false_positives) / max(total_negatives + total_positives, 1)
+
+    best_f1, best_accuracy = int(argmax(f1 if total_positives else zeros(CURVE_BINS))), int(argmax(accuracy))
+    return {
+        'best_f1_threshold': float(thresholds[best_f1]),
+        'best_f1': float(f1[best_f1]) if total_positives else None,
+        'best_accuracy_threshold': float(thresholds[best_accuracy]),
+        'best_accuracy': float(accuracy[best_accuracy])
+    }
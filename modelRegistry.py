@@ -0,0 +1,254 @@
+from hashlib import blake2b
+import json
+import os
+import shutil
+import tempfile
+from typing import Optional
+from weakref import WeakKeyDictionary
+
+from lightgbm import Booster
+from numpy import ascontiguousarray, ndarray
+from pandas import DataFrame, Series
+
+import ansi_escape_codes as c
+import dataSource
+from logger_config import logger
+
+# Directory holding one sub-directory per registered model
+REGISTRY_DIRECTORY = "./models"
+
+# Upper bound for the total size of the registry in bytes
+MAX_REGISTRY_BYTES = 1024 ** 3
+
+# Prefix of the directories entries are written to before they are renamed into place
+STAGING_PREFIX = ".staging-"
+
+# Registry key of every model loaded or stored during this run
+MODEL_KEYS: WeakKeyDictionary = WeakKeyDictionary()
+
+def get_model_key(X_train: DataFrame | dataSource.CodeMatrix, y_train: Optional[Series], params: dict,
+                  X_eval: Optional[DataFrame | dataSource.CodeMatrix] = None,
+                  y_eval: Optional[Series] = None, weight: Optional[ndarray] = None, **settings) -> str:
+    """
+    Compute the registry key of a model from everything its training depends on.
+
+    The key hashes the category codes and vocabularies of the training (and
+    evaluation) data, the sample weights, the parameters and any further
+    training settings. Since the split ratios and seed determine which rows end
+    up in which split, they are covered by the data content. A code matrix
+    gets the same key as the frames it was built from.
+
+    Parameters
+    ----------
+    X_train : DataFrame | CodeMatrix
+        The categorical training feature dataset, or the training code matrix.
+    y_train : Optional[Series]
+        The encoded training target dataset, None for a code matrix.
+    params : dict
+        The LightGBM parameters.
+    X_eval : Optional[DataFrame | CodeMatrix]
+        The categorical evaluation feature dataset or code matrix used for early stopping.
+    y_eval : Optional[Series]
+        The encoded evaluation target dataset used for early stopping, None for a code matrix.
+    weight : Optional[ndarray]
+        The weight of every training row.
+    **settings
+        Further training settings, e.g. the number of boosting rounds.
+
+    Returns
+    -------
+    str
+        The hexadecimal registry key.
+    """
+    digest = blake2b(digest_size=16)
+
+    # Hash the parameters, settings and vocabularies in a canonical form
+    if isinstance(X_train, dataSource.CodeMatrix):
+        vocabularies = {name: list(X_train.vocabularies[name]) for name in X_train.feature_names}
+    else:
+        vocabularies = {column: [str(value) for value in X_train[column].cat.categories] for column in X_train.columns}
+    digest.update(json.dumps([params, settings, vocabularies], sort_keys=True, default=str).encode())
+
+    # Hash the codes of the training and evaluation data and the weights
+    for X, y in ((X_train, y_train), (X_eval, y_eval)):
+        if isinstance(X, dataSource.CodeMatrix):
+            digest.update(ascontiguousarray(X.codes).data)
+        elif X is not None:
+            digest.update(ascontiguousarray(dataSource.concatenate_codes(X, y)).data)
+    if weight is not None:
+        digest.update(ascontiguousarray(weight).data)
+
+    return digest.hexdigest()
+
+def load_model(key: str) -> Optional[Booster]:
+    """
+    Load a registered model.
+
+    Parameters
+    ----------
+    key : str
+        The registry key computed by ``get_model_key``.
+
+    Returns
+    -------
+    Optional[Booster]
+        The model, or None if no model is registered under the key.
+    """
+    entry = os.path.join(REGISTRY_DIRECTORY, key)
+    if not os.path.isdir(entry):
+        return None
+
+    model = Booster(model_file=os.path.join(entry, "model.txt"))
+    MODEL_KEYS[model] = key
+
+    # Mark the entry as recently used for the eviction policy
+    os.utime(entry)
+
+    logger.info(f"Loaded model {c.MAGENTA}{key}{c.RESET} from registry.")
+
+    return model
+
+def load_metadata(key: str) -> Optional[dict]:
+    """
+    Load the vocabularies, parameters and metrics stored with a registered model.
+
+    Parameters
+    ----------
+    key : str
+        The registry key computed by ``get_model_key``.
+
+    Returns
+    -------
+    Optional[dict]
+        The metadata, or None if no model is registered under the key.
+    """
+    path = os.path.join(REGISTRY_DIRECTORY, key, "metadata.json")
+    if not os.path.isfile(path):
+        return None
+
+    with open(path) as file:
+        return json.load(file)
+
+def store_model(key: str, model: Booster, vocabularies: dict[str, list[str]], params: dict) -> None:
+    """
+    Register a trained model.
+
+    The model is saved in LightGBM's text format next to a JSON file with the
+    category vocabularies it was trained on, its parameters and (later) its
+    metrics. The entry is written to a temporary directory and renamed into
+    place, so concurrent readers never see partial entries.
+
+    Parameters
+    ----------
+    key : str
+        The registry key computed by ``get_model_key``.
+    model : Booster
+        The trained LightGBM model.
+    vocabularies : dict[str, list[str]]
+        The categories of every feature the model was trained on.
+    params : dict
+        The LightGBM parameters the model was trained with.
+
+    Returns
+    -------
+    None
+    """
+    # Write the entry into a temporary directory and move it into place
+    os.makedirs(REGISTRY_DIRECTORY, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=REGISTRY_DIRECTORY)
+    model.save_model(os.path.join(staging, "model.txt"))
+    with open(os.path.join(staging, "metadata.json"), "w") as file:
+        json.dump({'vocabularies': vocabularies, 'params': params, 'metrics': {}}, file, default=str)
+
+    try:
+        os.rename(staging, os.path.join(REGISTRY_DIRECTORY, key))
+    except OSError:
+        # Another process registered the same model in the meantime
+        shutil.rmtree(staging, ignore_errors=True)
+
+    MODEL_KEYS[model] = key
+
+    logger.info(f"Stored model {c.MAGENTA}{key}{c.RESET} in registry.")
+
+    # Keep the registry within its size limit
+    evict_registry()
+
+def get_entry_path(model: Booster) -> Optional[str]:
+    """
+    Return the registry directory of a model, for files stored alongside it.
+
+    Parameters
+    ----------
+    model : Booster
+        The LightGBM model.
+
+    Returns
+    -------
+    Optional[str]
+        The directory of the registry entry, None if the model was neither loaded from nor stored in the registry.
+    """
+    key = MODEL_KEYS.get(model)
+    entry = os.path.join(REGISTRY_DIRECTORY, key) if key is not None else None
+    return entry if entry is not None and os.path.isdir(entry) else None
+
+def update_metrics(model: Booster, metrics: dict[str, float]) -> None:
+    """
+    Record metrics of a registered model.
+
+    Models that were neither loaded from nor stored in the registry are ignored.
+
+    Parameters
+    ----------
+    model : Booster
+        The LightGBM model.
+    metrics : dict[str, float]
+        The metrics to be added to the model's metadata.
+
+    Returns
+    -------
+    None
+    """
+    key = MODEL_KEYS.get(model)
+    metadata = load_metadata(key) if key is not None else None
+    if metadata is None:
+        return
+
+    # Merge the metrics and replace the metadata file atomically
+    metadata['metrics'].update(metrics)
+    path = os.path.join(REGISTRY_DIRECTORY, key, "metadata.json")
+    with open(f"{path}.tmp", "w") as file:
+        json.dump(metadata, file, default=str)
+    os.replace(f"{path}.tmp", path)
+
+def evict_registry(max_bytes: int = MAX_REGISTRY_BYTES) -> None:
+    """
+    Evict the least recently used models until the registry fits its size limit.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The maximum total size of the registry in bytes.
+
+    Returns
+    -------
+    None
+    """
+    if not os.path.isdir(REGISTRY_DIRECTORY):
+        return
+
+    # Collect the size and last use of every completed entry, other processes may still be writing staging directories
+    entries = []
+    for name in os.listdir(REGISTRY_DIRECTORY):
+        entry = os.path.join(REGISTRY_DIRECTORY, name)
+        if os.path.isdir(entry) and not name.startswith(STAGING_PREFIX):
+            size = sum(file.stat().st_size for file in os.scandir(entry) if file.is_file())
+            entries.append((os.stat(entry).st_mtime, size, entry))
+
+    # Remove the oldest entries first until the total size fits
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total_size <= max_bytes:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total_size -= size
+        logger.info(f"Evicted model {c.MAGENTA}{os.path.basename(entry)}{c.RESET}.")
@@ -0,0 +1,177 @@
+from collections import OrderedDict
+from hashlib import blake2b
+import json
+from typing import Optional
+from weakref import WeakKeyDictionary
+
+from lightgbm import Booster
+from numpy import array, concatenate, cumsum, float64, ndarray, unique
+from pandas import Categorical, DataFrame
+
+import ansi_escape_codes as c
+import dataSource
+import instrumentation
+from logger_config import logger
+
+# Maximum number of (model version, row key) -> probability entries kept in memory
+PREDICTION_CACHE_SIZE = 1_000_000
+
+class PredictionCache:
+    """
+    Bounded least-recently-used cache of predicted probabilities.
+
+    Entries are keyed by a version and the key of a feature row. The version
+    covers the model and the vocabularies the row codes index into, so neither
+    retrained models nor datasets with other category orders see stale
+    probabilities.
+    """
+
+    def __init__(self, max_size: int = PREDICTION_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def lookup(self, version: str, keys: ndarray) -> list:
+        """Return the cached probability of every row key, or None where there is none."""
+        values = []
+        for key in keys.tolist():
+            value = self.entries.get((version, key))
+            if value is not None:
+                # Mark the entry as recently used
+                self.entries.move_to_end((version, key))
+            values.append(value)
+        return values
+
+    def store(self, version: str, keys: ndarray, values: ndarray) -> None:
+        """Store the probabilities of the given row keys, evicting the least recently used entries."""
+        for key, value in zip(keys.tolist(), values):
+            self.entries[(version, key)] = value
+            self.entries.move_to_end((version, key))
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+# Cache shared by all predictions of this process
+PREDICTION_CACHE = PredictionCache()
+
+# Version of every model seen so far, together with the iteration it was computed at
+MODEL_VERSIONS: WeakKeyDictionary = WeakKeyDictionary()
+
+def get_model_version(model: Booster) -> str:
+    """
+    Return a content hash identifying the current state of a model.
+
+    The hash is remembered per model and only recomputed once the model has
+    been trained further.
+
+    Parameters
+    ----------
+    model : Booster
+        The LightGBM model.
+
+    Returns
+    -------
+    str
+        The hexadecimal model version.
+    """
+    iteration = model.current_iteration()
+    known = MODEL_VERSIONS.get(model)
+    if known is None or known[0] != iteration:
+        known = (iteration, blake2b(model.model_to_string().encode(), digest_size=16).hexdigest())
+        MODEL_VERSIONS[model] = known
+
+    return known[1]
+
+def get_vocabulary_hash(template: DataFrame | dataSource.CodeMatrix) -> str:
+    """
+    Return a hash of the categories the feature codes of a dataset index into.
+
+    Parameters
+    ----------
+    template : DataFrame | CodeMatrix
+        The categorical feature dataset or code matrix.
+
+    Returns
+    -------
+    str
+        The hexadecimal hash of the feature vocabularies in column order.
+    """
+    if isinstance(template, dataSource.CodeMatrix):
+        vocabularies = [[name, list(template.vocabularies[name])] for name in template.feature_names]
+    else:
+        vocabularies = [[column, [str(value) for value in template[column].cat.categories]] for column in template.columns]
+
+    return blake2b(json.dumps(vocabularies).encode(), digest_size=16).hexdigest()
+
+def predict_probabilities(model: Booster, *feature_sets: DataFrame | dataSource.CodeMatrix,
+                          cache: Optional[PredictionCache] = PREDICTION_CACHE) -> list[ndarray]:
+    """
+    Predict the probabilities of several feature datasets, scoring every distinct row once.
+
+    The rows of all datasets are keyed by their category codes, so the union of
+    all requested rows is reduced to its unique rows. Unique rows scored before
+    by the same model version are taken from the cache, only the remaining ones
+    are passed to the model, and the results are scattered back to every row.
+    Since the row keys are built from category codes, the cache is also keyed
+    by the vocabularies of the datasets, see ``get_vocabulary_hash``.
+    All datasets must share the categorical dtypes of their columns, as the
+    splits of ``task2.splitDataSet`` do. Code matrices, e.g. the splits of
+    ``task2.split_code_matrix``, must share their vocabularies with each other
+    and with the model; their unique rows are passed to the model as numeric
+    codes without building a frame.
+
+    Parameters
+    ----------
+    model : Booster
+        The LightGBM model to be used for prediction.
+    *feature_sets : DataFrame | CodeMatrix
+        The categorical feature datasets or code matrices to predict.
+    cache : Optional[PredictionCache]
+        The cache of previously predicted rows, or None to disable caching.
+
+    Returns
+    -------
+    list[ndarray]
+        The predicted probabilities of every dataset, in the order given.
+    """
+    template = feature_sets[0]
+
+    with instrumentation.stage("dedupe", sum(len(X) for X in feature_sets)):
+        # Key every row of every dataset by its feature codes
+        if isinstance(template, dataSource.CodeMatrix):
+            codes = concatenate([X.features for X in feature_sets])
+            radices = template.radices[:-1]
+        else:
+            codes = concatenate([dataSource.concatenate_codes(X) for X in feature_sets])
+            radices = [len(template[column].cat.categories) for column in template.columns]
+        keys = dataSource.get_row_keys(codes, radices)
+
+        # Reduce the requested rows to their unique rows
+        unique_keys, first_rows, inverse = unique(keys, return_index=True, return_inverse=True)
+
+    # Take what is known from the cache and find the rows still to be scored
+    version = f"{get_model_version(model)}:{get_vocabulary_hash(template)}" if cache is not None else None
+    cached = cache.lookup(version, unique_keys) if cache is not None else [None] * len(unique_keys)
+    missing = array([index for index, value in enumerate(cached) if value is None], dtype=int)
+
+    logger.info(f"Scoring {c.CYAN}{len(missing)}{c.RESET} of {c.CYAN}{len(unique_keys)}{c.RESET} unique rows "
+                f"for {c.CYAN}{len(keys)}{c.RESET} requested rows...")
+
+    # Score the missing unique rows in one batch
+    if len(missing):
+        if isinstance(template, dataSource.CodeMatrix):
+            unique_rows = codes[first_rows[missing]].astype(float64)
+        else:
+            unique_rows = DataFrame({
+                column: Categorical.from_codes(codes[first_rows[missing], index], dtype=template[column].dtype)
+                for index, column in enumerate(template.columns)
+            })
+        with instrumentation.stage("predict", len(missing)):
+            scores = model.predict(unique_rows)
+        for index, score in zip(missing, scores):
+            cached[index] = score
+        if cache is not None:
+            cache.store(version, unique_keys[missing], scores)
+
+    # Scatter the unique probabilities back to every row and cut them per dataset
+    probabilities = array(cached)[inverse]
+    boundaries = cumsum([len(X) for X in feature_sets])[:-1]
+    return [probabilities[start:end] for start, end in zip([0, *boundaries], [*boundaries, len(probabilities)])]
@@ -0,0 +1,454 @@
+import inspect
+import json
+import os
+import pickle
+import platform
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from functools import lru_cache
+from hashlib import blake2b
+from importlib import metadata
+from multiprocessing import get_context
+from typing import Any, Callable, NamedTuple, Optional
+
+import ansi_escape_codes as c
+import instrumentation
+from logger_config import logger
+
+# Directory holding the cached outputs of stages, one file per stage key
+STAGE_CACHE_DIRECTORY = "./stage_cache"
+
+# Upper bound for the total size of the stage cache in bytes
+MAX_STAGE_CACHE_BYTES = 1024 ** 3
+
+# Libraries whose versions enter every stage key, as their defaults and results may change between releases
+STAGE_LIBRARIES = ("lightgbm", "numpy", "pandas", "scikit-learn")
+
+class Stage(NamedTuple):
+    """
+    One step of a stage graph.
+
+    Attributes
+    ----------
+    name : str
+        The name of the stage, unique within its graph.
+    function : Callable
+        Called with the input values in order; returns the output values as a
+        tuple, or the value itself if there is only one output.
+    inputs : tuple[str, ...]
+        The names of the values the stage reads.
+    outputs : tuple[str, ...]
+        The names of the values the stage produces.
+    pool : str
+        Where the stage runs: 'thread' for work that releases the GIL (numpy,
+        LightGBM) or waits, 'process' for pure Python work that was measured to
+        outweigh spawning a worker, which imports the project afresh, and
+        pickling the inputs. Process stages need a picklable module level
+        function and picklable values.
+    cache : bool
+        Whether the outputs may be stored and reused while the inputs do not
+        change. Stages with side effects, e.g. writing files, must not be cached.
+    version : str
+        Changed to invalidate the cached outputs, e.g. after a change outside
+        the project sources the code fingerprint does not cover.
+    """
+    name: str
+    function: Callable
+    inputs: tuple[str, ...]
+    outputs: tuple[str, ...]
+    pool: str = "thread"
+    cache: bool = False
+    version: str = "1"
+
+class StageGraph:
+    """
+    Run stages as soon as their inputs exist, independent stages concurrently.
+
+    Every value has a hash: given values are hashed by content, and the
+    outputs of a stage by the stage's key, a hash of its name, version, code
+    fingerprint (see ``get_code_fingerprint``) and input hashes. All keys are
+    therefore known before anything runs. A run only executes the stages whose
+    outputs are needed for the requested values and are not cached under their
+    key; so after an unchanged rerun whole chains of stages are skipped,
+    including those that only feed cached stages.
+    """
+
+    def __init__(self, stages: list[Stage]):
+        self.stages = stages
+        self.order = get_topological_order(stages)
+
+    def run(self, values: dict[str, Any], targets: list[str], trace: Optional[instrumentation.Trace] = None,
+            max_workers: Optional[int] = None, use_cache: bool = True) -> tuple[dict[str, Any], dict]:
+        """
+        Compute the requested values.
+
+        Parameters
+        ----------
+        values : dict[str, Any]
+            The given values, e.g. paths and settings.
+        targets : list[str]
+            The names of the values to compute.
+        trace : Optional[Trace]
+            The trace every executed stage is measured in.
+        max_workers : Optional[int]
+            The number of threads and of processes, by default the number of cores but at least two.
+        use_cache : bool
+            Whether to reuse and store the outputs of cached stages.
+
+        Returns
+        -------
+        tuple[dict[str, Any], dict]
+            All values known at the end, and the schedule: the start, end and
+            wall time of every stage, which stages were taken from the cache,
+            the critical path and its time, the summed stage time and the
+            wall time of the run.
+        """
+        start = time.perf_counter()
+        max_workers = max_workers or max(2, os.cpu_count() or 1)
+        values = dict(values)
+
+        # Derive the key of every stage and the hash of every value before running anything
+        hashes = {name: get_value_hash(value) for name, value in values.items()}
+        keys = {}
+        for stage in self.order:
+            if not all(name in hashes for name in stage.inputs):
+                continue
+            keys[stage.name] = get_hash(stage.name, stage.version, get_code_fingerprint(stage.function),
+                                        *[hashes[name] for name in stage.inputs])
+            hashes.update({name: get_hash(keys[stage.name], name) for name in stage.outputs})
+
+        # Walk back from the targets, taking outputs from the cache where possible
+        needed, pending, schedule = set(targets), [], {}
+        for stage in reversed(self.order):
+            if not needed & set(stage.outputs):
+                continue
+            cached = load_outputs(keys[stage.name]) if use_cache and stage.cache and stage.name in keys else None
+            if cached is not None:
+                values.update(zip(stage.outputs, cached))
+                schedule[stage.name] = {'cached': True}
+                logger.info(f"Stage {c.MAGENTA}{stage.name}{c.RESET} is up to date.")
+                continue
+            pending.append(stage)
+            needed.update(stage.inputs)
+        pending.reverse()
+
+        # Run every stage once all its inputs exist
+        threads = ThreadPoolExecutor(max_workers=max_workers)
+        processes = None
+        running = {}
+        try:
+            while pending or running:
+                for stage in [stage for stage in pending if all(name in values for name in stage.inputs)]:
+                    if stage.pool == "process" and processes is None:
+                        processes = ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context("spawn"))
+                    arguments = [values[name] for name in stage.inputs]
+                    running[threads.submit(run_stage, stage, arguments, trace, processes, start)] = stage
+                    pending.remove(stage)
+
+                if not running:
+                    missing = sorted({name for stage in pending for name in stage.inputs} - set(values))
+                    raise ValueError(f"Stages {[stage.name for stage in pending]} miss the values {missing}.")
+
+                # Collect the stages that finished and store their outputs
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    outputs, stage_start, stage_end = future.result()
+                    values.update(zip(stage.outputs, outputs))
+                    schedule[stage.name] = {'cached': False, 'start': stage_start, 'end': stage_end,
+                                            'wall_time': stage_end - stage_start}
+                    if use_cache and stage.cache:
+                        store_outputs(keys[stage.name], outputs)
+        finally:
+            threads.shutdown(cancel_futures=True)
+            if processes is not None:
+                processes.shutdown(cancel_futures=True)
+
+        schedule = {stage.name: schedule[stage.name] for stage in self.order if stage.name in schedule}
+        report = {'stages': schedule, **self.get_critical_path(schedule), 'wall_time': time.perf_counter() - start}
+        report['stage_time'] = sum(entry.get('wall_time', 0.0) for entry in schedule.values())
+
+        logger.info(f"Ran {c.CYAN}{sum(not entry['cached'] for entry in schedule.values())}{c.RESET} stages "
+                    f"({c.CYAN}{sum(entry['cached'] for entry in schedule.values())}{c.RESET} cached) in "
+                    f"{c.CYAN}{report['wall_time']:.3f}s{c.RESET} for {c.CYAN}{report['stage_time']:.3f}s{c.RESET} of stage time; "
+                    f"critical path {c.BLUE}{' -> '.join(report['critical_path'])}{c.RESET} "
+                    f"({c.CYAN}{report['critical_path_time']:.3f}s{c.RESET})")
+
+        return values, report
+
+    def get_critical_path(self, schedule: dict[str, dict]) -> dict:
+        """
+        Find the chain of dependent executed stages with the longest total wall time.
+
+        Parameters
+        ----------
+        schedule : dict[str, dict]
+            The schedule entry of every stage of the run.
+
+        Returns
+        -------
+        dict
+            The stages of the critical path in order and its summed wall time.
+        """
+        producers = {name: stage.name for stage in self.stages for name in stage.outputs}
+
+        # Accumulate the longest chain ending in every executed stage, in dependency order
+        finish, previous = {}, {}
+        for stage in self.order:
+            entry = schedule.get(stage.name)
+            if entry is None or entry['cached']:
+                continue
+            before = [producers[name] for name in stage.inputs if producers.get(name) in finish]
+            previous[stage.name] = max(before, key=finish.get, default=None)
+            finish[stage.name] = entry['wall_time'] + (finish[previous[stage.name]] if previous[stage.name] else 0.0)
+
+        # Follow the longest chain back from its last stage
+        path, name = [], max(finish, key=finish.get, default=None)
+        while name is not None:
+            path.append(name)
+            name = previous[name]
+
+        return {'critical_path': path[::-1], 'critical_path_time': finish[path[0]] if path else 0.0}
+
+def run_stage(stage: Stage, arguments: list, trace: Optional[instrumentation.Trace],
+              processes: Optional[ProcessPoolExecutor], origin: float) -> tuple[tuple, float, float]:
+    """
+    Run one stage in a worker thread, handing process stages on to the process pool.
+
+    Parameters
+    ----------
+    stage : Stage
+        The stage.
+    arguments : list
+        The input values in order.
+    trace : Optional[Trace]
+        The trace the stage is measured in.
+    processes : Optional[ProcessPoolExecutor]
+        The process pool for process stages.
+    origin : float
+        The start of the run, on the ``time.perf_counter`` clock.
+
+    Returns
+    -------
+    tuple[tuple, float, float]
+        The output values, and the start and end of the stage in seconds since the start of the run.
+    """
+    start = time.perf_counter()
+    with trace.stage(stage.name) if trace is not None else nullcontext():
+        if stage.pool == "process":
+            outputs = processes.submit(stage.function, *arguments).result()
+        else:
+            outputs = stage.function(*arguments)
+    end = time.perf_counter()
+
+    return (outputs if len(stage.outputs) > 1 else (outputs,)), start - origin, end - origin
+
+def get_topological_order(stages: list[Stage]) -> list[Stage]:
+    """
+    Order stages so that every stage comes after the stages producing its inputs.
+
+    Parameters
+    ----------
+    stages : list[Stage]
+        The stages, each output produced by at most one stage.
+
+    Returns
+    -------
+    list[Stage]
+        The stages in dependency order, otherwise in the given order.
+    """
+    producers = {}
+    for stage in stages:
+        for name in stage.outputs:
+            if name in producers:
+                raise ValueError(f"Value {name} is produced by both {producers[name]} and {stage.name}.")
+            producers[name] = stage.name
+
+    # Repeatedly take the stages whose producing stages are all placed
+    order, placed, remaining = [], set(), list(stages)
+    while remaining:
+        ready = [stage for stage in remaining if all(producers[name] in placed for name in stage.inputs if name in producers)]
+        if not ready:
+            raise ValueError(f"The stages {[stage.name for stage in remaining]} depend on each other.")
+        for stage in ready:
+            order.append(stage)
+            placed.add(stage.name)
+            remaining.remove(stage)
+
+    return order
+
+def get_code_fingerprint(function: Callable) -> str:
+    """
+    Fingerprint the code a stage function may run.
+
+    Stage functions call into the other modules of the project, so the sources
+    of all modules next to the module of the function are hashed, together with
+    the Python version and the versions of ``STAGE_LIBRARIES``.
+
+    Parameters
+    ----------
+    function : Callable
+        The stage function.
+
+    Returns
+    -------
+    str
+        The hexadecimal fingerprint.
+    """
+    path = getattr(inspect.getmodule(function), "__file__", None)
+    return get_source_fingerprint(os.path.dirname(os.path.abspath(path)) if path is not None else None)
+
+@lru_cache(maxsize=None)
+def get_source_fingerprint(directory: Optional[str]) -> str:
+    """
+    Hash the Python sources of a directory and the versions of the libraries, once per process.
+
+    Parameters
+    ----------
+    directory : Optional[str]
+        The directory of the modules, None for functions without a source file.
+
+    Returns
+    -------
+    str
+        The hexadecimal fingerprint.
+    """
+    parts = [platform.python_version()]
+    for library in STAGE_LIBRARIES:
+        try:
+            parts.append(f"{library} {metadata.version(library)}")
+        except metadata.PackageNotFoundError:
+            parts.append(f"{library} missing")
+
+    # Hash every module of the directory in name order
+    if directory is not None:
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".py"):
+                with open(os.path.join(directory, name), "rb") as file:
+                    parts += [name, file.read()]
+
+    return get_hash(*parts)
+
+def get_value_hash(value: Any) -> str:
+    """
+    Hash a given value by its content.
+
+    Parameters
+    ----------
+    value : Any
+        A JSON serializable or picklable value.
+
+    Returns
+    -------
+    str
+        The hexadecimal hash.
+    """
+    try:
+        content = json.dumps(value, sort_keys=True).encode()
+    except TypeError:
+        content = pickle.dumps(value)
+    return get_hash(content)
+
+def get_hash(*parts: str | bytes) -> str:
+    """
+    Hash a sequence of strings or bytes.
+
+    Parameters
+    ----------
+    *parts : str | bytes
+        The content.
+
+    Returns
+    -------
+    str
+        The hexadecimal hash.
+    """
+    digest = blake2b(digest_size=16)
+    for part in parts:
+        part = part.encode() if isinstance(part, str) else part
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return digest.hexdigest()
+
+def load_outputs(key: str) -> Optional[tuple]:
+    """
+    Load the cached outputs of a stage.
+
+    Parameters
+    ----------
+    key : str
+        The key of the stage.
+
+    Returns
+    -------
+    Optional[tuple]
+        The output values, None if nothing (readable) is cached under the key.
+    """
+    path = os.path.join(STAGE_CACHE_DIRECTORY, f"{key}.pkl")
+    try:
+        with open(path, "rb") as file:
+            outputs = pickle.load(file)
+    except FileNotFoundError:
+        return None
+    except Exception as error:
+        logger.warning(f"Ignoring unreadable stage cache entry {c.MAGENTA}{path}{c.RESET}: {c.RED}{error}{c.RESET}")
+        return None
+
+    # Mark the entry as recently used for the eviction policy
+    os.utime(path)
+    return outputs
+
+def store_outputs(key: str, outputs: tuple) -> None:
+    """
+    Cache the outputs of a stage, written to a temporary file and renamed into place.
+
+    Parameters
+    ----------
+    key : str
+        The key of the stage.
+    outputs : tuple
+        The output values.
+
+    Returns
+    -------
+    None
+    """
+    os.makedirs(STAGE_CACHE_DIRECTORY, exist_ok=True)
+    descriptor, staging = tempfile.mkstemp(dir=STAGE_CACHE_DIRECTORY, suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            pickle.dump(outputs, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(staging, os.path.join(STAGE_CACHE_DIRECTORY, f"{key}.pkl"))
+    except BaseException:
+        os.remove(staging)
+        raise
+
+    # Keep the cache within its size limit
+    evict_stage_cache()
+
+def evict_stage_cache(max_bytes: int = MAX_STAGE_CACHE_BYTES) -> None:
+    """
+    Evict the least recently used stage outputs until the cache fits its size limit.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The maximum total size of the cache in bytes.
+
+    Returns
+    -------
+    None
+    """
+    entries = [(entry.stat().st_mtime, entry.stat().st_size, entry.path)
+               for entry in os.scandir(STAGE_CACHE_DIRECTORY) if entry.is_file() and entry.name.endswith(".pkl")]
+
+    # Remove the oldest entries first until the total size fits
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_bytes:
+            break
+        os.remove(path)
+        total_size -= size
+        logger.info(f"Evicted stage output {c.MAGENTA}{os.path.basename(path)}{c.RESET}.")
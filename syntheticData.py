@@ -0,0 +1,196 @@
+import argparse
+import os
+from typing import Optional
+
+from numpy import arange, argsort, column_stack, float64, ndarray, random
+
+import ansi_escape_codes as c
+import dataSource
+from logger_config import logger
+
+# Values of every feature as listed in results.md, most frequent first
+FEATURE_VALUES = [
+    ["k1", "k0"],
+    ["kS", "kB", "kP", "kH", "kV"],
+    "kMB kMA kSI kPS kAG kRU kAV kAS kSH kAD kOO kMD kFF kTP kNL kKA kME kEP kHV kHE".split(),
+    ["k1", "k0"],
+    ["k1", "k0"],
+    ["k1", "k0", "k2"],
+    ["k1", "k2", "k0", "k3"],
+    ["k1", "k0", "k2"],
+    ["k1", "k0"],
+    ["k1", "k0"],
+    "kGB kL kNL kF kB kPL kD kO kW kA kI".split(),
+    *[["k0", "k5", "k3", "k9", "k1", "k6", "k8", "k7", "k4", "k2"]] * 4,
+    ["k0", "k5", "k3", "k9", "k1", "k7", "k8", "k6", "k.", "k4", "k2"]
+]
+
+# Share of k1 targets, about 92% in Test00.txt
+TARGET_SHARE = 0.92
+
+# Number of consecutive copies of every row, Test00.txt repeats every row 15 times
+DUPLICATION = 15
+
+# Number of distinct feature combinations the rows are drawn from
+NUM_PATTERNS = 5000
+
+# Exponent of the Zipf-like frequencies of values and patterns, larger is more skewed
+SKEW = 1.5
+
+# Share of patterns whose target is flipped, so the target is not fully determined by the features
+LABEL_NOISE = 0.02
+
+# Number of patterns written per block
+WRITE_BLOCK_SIZE = 65536
+
+def generate_data_set(dataset_path: str, num_rows: int, seed: int = 42, num_patterns: int = NUM_PATTERNS,
+                      duplication: int = DUPLICATION, target_share: float = TARGET_SHARE) -> str:
+    """
+    Write a synthetic dataset file in the format of Test00.txt.
+
+    The rows are drawn from a pool of distinct feature combinations whose values
+    follow skewed frequencies, and every drawn row is repeated ``duplication``
+    times in a row, like in Test00.txt. The pattern frequencies are skewed too,
+    so large files are dominated by few distinct rows. The target of a pattern
+    depends on its feature values, with ``target_share`` of the patterns k1
+    and a little label noise, so models have something to learn. The file is
+    written block by block, so its size is only bounded by the disk.
+
+    Parameters
+    ----------
+    dataset_path : str
+        The path of the dataset file to write.
+    num_rows : int
+        The number of rows to write.
+    seed : int
+        The seed of the generator, the same seed gives the same file.
+    num_patterns : int
+        The number of distinct feature combinations.
+    duplication : int
+        The number of consecutive copies of every drawn row.
+    target_share : float
+        The share of patterns with target k1.
+
+    Returns
+    -------
+    str
+        The path of the dataset file.
+    """
+    generator = random.default_rng(seed)
+
+    # Draw the patterns and render each of its copies into one line block
+    codes = draw_patterns(generator, num_patterns)
+    targets = draw_targets(generator, codes, target_share)
+    blocks = [
+        (" ".join(f"{value};" for value in [*(FEATURE_VALUES[feature][code] for feature, code in enumerate(row)),
+                                           "k1" if target else "k0"]) + "\n").encode() * duplication
+        for row, target in zip(codes, targets)
+    ]
+    pattern_weights = get_zipf_weights(num_patterns)
+
+    logger.info(f"Generating {c.CYAN}{num_rows}{c.RESET} rows from {c.CYAN}{num_patterns}{c.RESET} patterns "
+                f"into {c.MAGENTA}{dataset_path}{c.RESET}...")
+
+    # Write the drawn patterns block by block, cutting the last one to the requested rows
+    num_draws = -(-num_rows // duplication)
+    os.makedirs(os.path.dirname(dataset_path) or ".", exist_ok=True)
+    with open(dataset_path, "wb") as file:
+        for start in range(0, num_draws, WRITE_BLOCK_SIZE):
+            draws = generator.choice(num_patterns, size=min(WRITE_BLOCK_SIZE, num_draws - start), p=pattern_weights)
+            file.write(b"".join(blocks[pattern] for pattern in draws[:-1]))
+            rows_left = num_rows - (start + len(draws) - 1) * duplication
+            file.write(b"".join(blocks[draws[-1]].splitlines(keepends=True)[:rows_left]))
+
+    return dataset_path
+
+def draw_patterns(generator: random.Generator, num_patterns: int) -> ndarray:
+    """
+    Draw distinct-ish feature combinations with skewed value frequencies.
+
+    Parameters
+    ----------
+    generator : random.Generator
+        The random number generator.
+    num_patterns : int
+        The number of combinations to draw.
+
+    Returns
+    -------
+    ndarray
+        The value index of every feature, one row per pattern.
+    """
+    columns = [generator.choice(len(values), size=num_patterns, p=get_zipf_weights(len(values)))
+               for values in FEATURE_VALUES]
+    return column_stack(columns)
+
+def draw_targets(generator: random.Generator, codes: ndarray, target_share: float) -> ndarray:
+    """
+    Assign targets to patterns from random per-value effects.
+
+    Parameters
+    ----------
+    generator : random.Generator
+        The random number generator.
+    codes : ndarray
+        The value index of every feature, one row per pattern.
+    target_share : float
+        The share of patterns with target k1.
+
+    Returns
+    -------
+    ndarray
+        Whether each pattern has target k1.
+    """
+    # Score every pattern by the sum of the effects of its values
+    scores = sum(generator.normal(size=len(values))[codes[:, feature]] for feature, values in enumerate(FEATURE_VALUES))
+
+    # Label the best scored share as k1 and flip a few labels
+    targets = argsort(argsort(-scores)) < target_share * len(scores)
+    return targets ^ (generator.random(len(targets)) < LABEL_NOISE)
+
+def get_zipf_weights(size: int) -> ndarray:
+    """
+    Return Zipf-like probabilities of ``size`` ranked outcomes.
+
+    Parameters
+    ----------
+    size : int
+        The number of outcomes.
+
+    Returns
+    -------
+    ndarray
+        The probability of every outcome, largest first.
+    """
+    weights = 1 / (arange(1, size + 1, dtype=float64) ** SKEW)
+    return weights / weights.sum()
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """
+    Write a synthetic dataset file from the command line.
+
+    Parameters
+    ----------
+    argv : Optional[list[str]]
+        The command line arguments, by default those of the process.
+
+    Returns
+    -------
+    int
+        The exit code.
+    """
+    parser = argparse.ArgumentParser(description="Write a synthetic dataset in the format of Test00.txt.")
+    parser.add_argument("path", help="dataset file to write")
+    parser.add_argument("rows", type=lambda value: int(float(value)), help="number of rows, e.g. 1e6")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--patterns", type=int, default=NUM_PATTERNS, help="number of distinct feature combinations")
+    parser.add_argument("--duplication", type=int, default=DUPLICATION, help="consecutive copies of every row")
+    parser.add_argument("--target-share", type=float, default=TARGET_SHARE, dest="target_share", help="share of k1 targets")
+    args = parser.parse_args(argv)
+
+    generate_data_set(args.path, args.rows, args.seed, args.patterns, args.duplication, args.target_share)
+    logger.info(f"Wrote {c.CYAN}{dataSource.count_rows(args.path)}{c.RESET} rows to {c.MAGENTA}{args.path}{c.RESET}")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
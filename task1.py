@@ -1,9 +1,244 @@
-from numpy import unique 
-from pandas import DataFrame, Series
+import re
+from typing import NamedTuple, Optional
+from weakref import ref
+from numpy import concatenate, cumsum, bincount, full, int8, int16, int64, ndarray, unique, zeros
+from pandas import Categorical, DataFrame, Series
 import ansi_escape_codes as c
+import dataSource
+import instrumentation
 from logger_config import logger
 
-def get_feature_size(features: DataFrame) -> int:
+# Number of rows counted at once by the contingency-table engine
+CONTINGENCY_BLOCK_SIZE = 65536
+
+# Pattern of regular value tokens, any other observed value is reported as odd
+VALUE_PATTERN = re.compile(r"k[0-9A-Za-z]+")
+
+class ContingencyTable(NamedTuple):
+    """
+    Absolute frequencies of target values for each value of a feature.
+
+    Attributes
+    ----------
+    feature : str
+        The name of the feature (or feature pair).
+    feature_values : list[str]
+        The values of the feature, one per row of the table.
+    target_values : list[str]
+        The target values, one per column of the table.
+    absolute : ndarray
+        The absolute frequencies with shape (feature values, target values).
+    total : int
+        The number of samples the relative frequencies refer to.
+    """
+    feature: str
+    feature_values: list[str]
+    target_values: list[str]
+    absolute: ndarray
+    total: int
+
+    @property
+    def relative(self) -> ndarray:
+        """The frequencies relative to the total number of samples."""
+        return self.absolute / max(self.total, 1)
+
+    def to_dict(self, relative: bool = False) -> dict[str, dict[str, float]]:
+        """
+        Return the table as nested dictionary of feature value -> target value -> frequency.
+
+        Only feature values that actually occur are included, matching the
+        format of ``get_compliance_absolute_frequencies``.
+        """
+        table = self.relative if relative else self.absolute
+        return {
+            feature_value: {target_value: row[index].item() for index, target_value in enumerate(self.target_values)}
+            for feature_value, row, counts in zip(self.feature_values, table, self.absolute) if counts.any()
+        }
+
+class DatasetProfile(NamedTuple):
+    """
+    Statistics of a dataset collected in a single pass over its category codes.
+
+    Attributes
+    ----------
+    num_rows : int
+        The number of rows of the dataset.
+    vocabularies : dict[str, list[str]]
+        The categories of every column in column order, the target last.
+    counts : dict[str, ndarray]
+        For every feature, the counts of all (feature value, target value) combinations
+        as returned by ``count_combinations``, missing values in row and column 0.
+    """
+    num_rows: int
+    vocabularies: dict[str, list[str]]
+    counts: dict[str, ndarray]
+
+    @property
+    def target_name(self) -> str:
+        """The name of the target column."""
+        return list(self.vocabularies)[-1]
+
+    def value_counts(self, name: str) -> ndarray:
+        """The number of occurrences of every category of a feature or the target."""
+        return self.full_value_counts(name)[1:]
+
+    def missing_count(self, name: str) -> int:
+        """The number of missing values of a feature or the target."""
+        return self.full_value_counts(name)[0].item()
+
+    def full_value_counts(self, name: str) -> ndarray:
+        """The value counts of a feature or the target, with the missing values first."""
+        if name == self.target_name:
+            return next(iter(self.counts.values())).sum(axis=0)
+        return self.counts[name].sum(axis=1)
+
+    def unique_values(self, name: str) -> list[str]:
+        """The categories of a feature or the target that actually occur."""
+        return [value for value, count in zip(self.vocabularies[name], self.value_counts(name)) if count]
+
+    def cardinality(self, name: str) -> int:
+        """The number of distinct values of a feature or the target that actually occur."""
+        return int((self.value_counts(name) > 0).sum())
+
+    def odd_values(self, name: str) -> list[str]:
+        """The occurring values of a feature or the target that do not look like regular tokens."""
+        return [value for value in self.unique_values(name) if not VALUE_PATTERN.fullmatch(value)]
+
+    @property
+    def tables(self) -> dict[str, ContingencyTable]:
+        """The contingency table of every feature, without missing values."""
+        return {
+            name: ContingencyTable(
+                feature=name,
+                feature_values=self.vocabularies[name],
+                target_values=self.vocabularies[self.target_name],
+                absolute=counts[1:, 1:],
+                total=self.num_rows
+            )
+            for name, counts in self.counts.items()
+        }
+
+# Profiles of the datasets analysed so far, keyed by the identity of their frames
+PROFILES: dict[int, tuple[ref, DatasetProfile]] = {}
+
+def profile_codes(codes: ndarray, vocabularies: dict[str, list[str]]) -> DatasetProfile:
+    """
+    Profile a dataset given as code matrix in a single pass.
+
+    Parameters
+    ----------
+    codes : ndarray
+        The code matrix with one column per feature followed by the target.
+    vocabularies : dict[str, list[str]]
+        The categories of every column in column order.
+
+    Returns
+    -------
+    DatasetProfile
+        The profile of the dataset.
+    """
+    # Count all value/target combinations, everything else is derived from them
+    profile = DatasetProfile(
+        num_rows=len(codes),
+        vocabularies=vocabularies,
+        counts=count_combinations(codes, vocabularies)
+    )
+
+    # Report missing and odd values, which usually point to broken records
+    for name in vocabularies:
+        if profile.missing_count(name):
+            logger.warning(f"{c.CYAN}{name}{c.RESET} has {c.RED}{profile.missing_count(name)}{c.RESET} missing values")
+        if profile.odd_values(name):
+            logger.warning(f"{c.CYAN}{name}{c.RESET} has odd values: {c.RED}{profile.odd_values(name)}{c.RESET}")
+
+    return profile
+
+def get_profile(features: DataFrame | dataSource.CodeMatrix, targets: Optional[Series] = None) -> DatasetProfile:
+    """
+    Return the profile of a dataset, computing it on first use.
+
+    The profile is kept alongside the dataset for as long as the feature frame
+    (or code matrix) lives, so the task1 functions below are cheap views over
+    it. Without targets the per-target frequencies are left empty. A code
+    matrix already holds its targets and is profiled without any conversion.
+
+    Parameters
+    ----------
+    features : DataFrame | CodeMatrix
+        The categorical feature dataset, or the code matrix of the whole dataset.
+    targets : Optional[Series]
+        The categorical target dataset, ignored for a code matrix.
+
+    Returns
+    -------
+    DatasetProfile
+        The profile of the dataset.
+    """
+    # Reuse the profile if it covers the requested targets
+    profile = find_profile(features)
+    if profile is not None and (targets is None or isinstance(features, dataSource.CodeMatrix) or find_profile(targets) is profile):
+        return profile
+
+    # Profile a code matrix as it is
+    if isinstance(features, dataSource.CodeMatrix):
+        with instrumentation.stage("profile", len(features)):
+            profile = profile_codes(features.codes, dict(features.vocabularies))
+        key = id(features)
+        PROFILES[key] = (ref(features, lambda _, key=key: PROFILES.pop(key, None)), profile)
+        return profile
+
+    # Stand in an empty target if none is given
+    if targets is None:
+        targets = Series(Categorical.from_codes(full(len(features), -1, dtype=int8), categories=[]), name="Target")
+
+    # Profile the codes and keep the result with both frames
+    with instrumentation.stage("profile", len(features)):
+        profile = profile_codes(*dataSource.frame_to_codes(features, targets))
+    for frame in (features, targets):
+        key = id(frame)
+        PROFILES[key] = (ref(frame, lambda _, key=key: PROFILES.pop(key, None)), profile)
+
+    return profile
+
+def find_profile(frame: DataFrame | Series | dataSource.CodeMatrix) -> Optional[DatasetProfile]:
+    """
+    Return the profile computed for a feature or target frame, if any.
+
+    Parameters
+    ----------
+    frame : DataFrame | Series | CodeMatrix
+        The feature or target dataset, or the code matrix of the whole dataset.
+
+    Returns
+    -------
+    Optional[DatasetProfile]
+        The profile of the dataset, or None if it has not been profiled.
+    """
+    entry = PROFILES.get(id(frame))
+    if entry is None or entry[0]() is not frame:
+        return None
+
+    return entry[1]
+
+def get_feature_names(features: DataFrame | dataSource.CodeMatrix) -> list[str]:
+    """
+    Return the names of the features of a feature frame or code matrix.
+
+    Parameters
+    ----------
+    features : DataFrame | CodeMatrix
+        The feature dataset, or the code matrix of the whole dataset.
+
+    Returns
+    -------
+    list[str]
+        The feature names in column order.
+    """
+    if isinstance(features, dataSource.CodeMatrix):
+        return features.feature_names
+    return list(features.columns)
+
+def get_feature_size(features: DataFrame | dataSource.CodeMatrix) -> int:
     """
     Calculate and return the number of features in the given dataset.
 
@@ -12,7 +247,7 @@ def get_feature_size(features: DataFrame) -> int:
 
     Parameters
     ----------
-    features : DataFrame
+    features : DataFrame | CodeMatrix
         The feature dataset for which the size is to be calculated.
     
     Returns
@@ -21,7 +256,7 @@ def get_feature_size(features: DataFrame) -> int:
         The number of features (columns) in the dataset.
     """
     # Calculate the number of features by counting the columns in the DataFrame
-    feature_size = len(features.columns)
+    feature_size = len(get_feature_names(features))
 
     # Log the number of features using the logger
     logger.info(f"Number of features: {c.CYAN}{feature_size}{c.RESET}")
@@ -29,7 +264,7 @@ def get_feature_size(features: DataFrame) -> int:
     # Return the calculated number of features
     return feature_size
 
-def get_feature_values(features: DataFrame) -> list[set]:
+def get_feature_values(features: DataFrame | dataSource.CodeMatrix) -> list[set]:
     """
     Get unique values for each feature in the dataset.
 
@@ -39,7 +274,7 @@ def get_feature_values(features: DataFrame) -> list[set]:
 
     Parameters
     ----------
-    features : DataFrame
+    features : DataFrame | CodeMatrix
         The feature dataset
 
     Returns
@@ -47,10 +282,13 @@ def get_feature_values(features: DataFrame) -> list[set]:
     List[Set]
         A list where each element is a set containing unique values for a specific feature
     """
+    # Read the unique values from the profile of the dataset
+    profile = get_profile(features)
+
     feature_values = []
-    for feature_index, feature in enumerate(features.columns):
+    for feature_index, feature in enumerate(get_feature_names(features)):
         # Get unique values for the current feature
-        unique_values = set(features[feature].unique())
+        unique_values = set(profile.unique_values(feature))
         # Append the set of unique values to the list
         feature_values.append(unique_values)
         # Log the set of unique values using the logger
@@ -60,7 +298,7 @@ def get_feature_values(features: DataFrame) -> list[set]:
     # Return the list of sets
     return feature_values
 
-def get_target_values(targets: Series) -> set:
+def get_target_values(targets: Series | dataSource.CodeMatrix) -> set:
     """
     Retrieve unique values for the target variable.
 
@@ -69,16 +307,21 @@ def get_target_values(targets: Series) -> set:
 
     Parameters
     ----------
-    targets : Series
-        The target dataset from which to extract unique values.
+    targets : Series | CodeMatrix
+        The target dataset from which to extract unique values, or the code matrix of the whole dataset.
     
     Returns
     -------
     set
         A set containing unique values from the target variable.
     """
-    # Extract unique values from the target dataset
-    unique_targets = set(targets.unique())
+    # Extract unique values from the profile of the dataset, if there is one
+    if isinstance(targets, dataSource.CodeMatrix):
+        unique_targets = set(get_profile(targets).unique_values(targets.target_name))
+    elif (profile := find_profile(targets)) is not None:
+        unique_targets = set(profile.unique_values(targets.name))
+    else:
+        unique_targets = set(targets.unique())
 
     # Log the unique values for informational purposes
     logger.info(f"Unique target values: {c.BLUE}{unique_targets}{c.RESET}")
@@ -107,19 +350,33 @@ def get_compliance_absolute_frequencies(feature_values: DataFrame, target_values
         A nested dictionary where the keys are unique feature values and the values are 
         dictionaries mapping target values to their absolute frequencies.
     """
-    # Initialize the dictionary to store frequencies
-    # The outer dictionary maps each unique feature value to another dictionary
-    # The inner dictionary maps each unique target value to its count (frequency) of occurrence
-    frequencies = {f_val: {str(target): 0 for target in target_values} for f_val in {*feature_values}}
-    
-    # Iterate over the feature and target datasets
-    # Count occurrences of each target value for each feature value
-    for f_val, target in zip(feature_values, target_values):
-        # Increment the count for the current target value and feature value
-        frequencies[f_val][str(target)] += 1
-    
+    # Count all feature/target combinations at once on the category codes
+    return log_absolute_frequencies(get_contingency_table(feature_values, target_values))
+
+def log_absolute_frequencies(table: ContingencyTable) -> dict[str, dict[str, int]]:
+    """
+    Log the absolute frequencies of a contingency table.
+
+    Parameters
+    ----------
+    table : ContingencyTable
+        The contingency table to be logged.
+
+    Returns
+    -------
+    dict[str, dict[str, int]]
+        The absolute frequencies of the observed target values for every feature value.
+    """
+    # Drop target values that never occur, the nested dictionary only lists observed ones
+    observed = table.absolute.sum(axis=0) > 0
+    table = table._replace(
+        target_values=[value for value, seen in zip(table.target_values, observed) if seen],
+        absolute=table.absolute[:, observed]
+    )
+    frequencies = table.to_dict()
+
     # Print the frequencies
-    logger.info(f"Absolute frequencies for {c.CYAN}{feature_values.name}{c.RESET}: {c.BLUE}{frequencies}{c.RESET}")
+    logger.info(f"Absolute frequencies for {c.CYAN}{table.feature}{c.RESET}: {c.BLUE}{frequencies}{c.RESET}")
 
     return frequencies
 
@@ -138,24 +395,217 @@ def get_compliance_frequencies(feature_values: Series, target_values: Series) ->
     -------
     None
     """
-    # Calculate the absolute frequencies first
-    absolute_frequencies = get_compliance_absolute_frequencies(feature_values, target_values)
-
-    # Calculate the relative frequency for each target value
-    relative_frequencies = {}
-    for feature_value, target_freqs in absolute_frequencies.items():
-        # Initialize the dictionary to store relative frequencies for this feature value
-        relative_frequencies[feature_value] = {}
-
-        # Calculate the relative frequency for each target value
-        for target_value, count in target_freqs.items():
-            # Calculate the relative frequency as a percentage
-            relative_frequency = f"{count / len(target_values) * 100:.3f}%"
-            # Store the relative frequency in the dictionary
-            relative_frequencies[feature_value][target_value] = relative_frequency
-    
+    # Count the feature/target combinations once for both frequencies
+    table = get_contingency_table(feature_values, target_values)
+
+    # Log the absolute frequencies first, then the relative frequency for each target value
+    log_absolute_frequencies(table)
+    log_relative_frequencies(table)
+
+def get_all_compliance_frequencies(features: DataFrame | dataSource.CodeMatrix,
+                                   target_values: Optional[Series] = None) -> dict[str, ContingencyTable]:
+    """
+    Calculate and log the absolute and relative frequencies of target values for every feature.
+
+    The contingency tables are taken from the profile of the dataset.
+
+    Parameters
+    ----------
+    features : DataFrame | CodeMatrix
+        The categorical feature dataset, or the code matrix of the whole dataset.
+    target_values : Optional[Series]
+        The categorical target values corresponding to each feature entry, None for a code matrix.
+
+    Returns
+    -------
+    dict[str, ContingencyTable]
+        The contingency table of every feature.
+    """
+    with instrumentation.stage("frequencies", len(features)):
+        # Take every feature x target table from the profile
+        tables = get_profile(features, target_values).tables
+
+        # Log the absolute and relative frequencies of every feature
+        for table in tables.values():
+            logger.info(f"Absolute frequencies for {c.CYAN}{table.feature}{c.RESET}: {c.BLUE}{table.to_dict()}{c.RESET}")
+            log_relative_frequencies(table)
+
+    return tables
+
+def log_relative_frequencies(table: ContingencyTable) -> None:
+    """
+    Log the relative frequencies of a contingency table as percentages.
+
+    Parameters
+    ----------
+    table : ContingencyTable
+        The contingency table to be logged.
+
+    Returns
+    -------
+    None
+    """
+    # Format every relative frequency as a percentage
+    relative_frequencies = {
+        feature_value: {target_value: f"{frequency * 100:.3f}%" for target_value, frequency in target_freqs.items()}
+        for feature_value, target_freqs in table.to_dict(relative=True).items()
+    }
+
     # Print the frequencies
-    logger.info(f"Relative frequencies for {c.CYAN}{feature_values.name}{c.RESET}: {c.BLUE}{relative_frequencies}{c.RESET}")
+    logger.info(f"Relative frequencies for {c.CYAN}{table.feature}{c.RESET}: {c.BLUE}{relative_frequencies}{c.RESET}")
+
+def get_contingency_table(feature_values: Series, target_values: Series) -> ContingencyTable:
+    """
+    Build the contingency table of a single feature with one bincount over combined codes.
+
+    Parameters
+    ----------
+    feature_values : Series
+        The feature values, categorical or not.
+    target_values : Series
+        The target values corresponding to each feature entry.
+
+    Returns
+    -------
+    ContingencyTable
+        The contingency table of the feature.
+    """
+    # Work on category codes, converting plain columns first
+    feature_values = feature_values.astype('category')
+    target_values = target_values.astype('category')
+    codes = concatenate([
+        feature_values.cat.codes.to_numpy(dtype=int64)[:, None],
+        target_values.cat.codes.to_numpy(dtype=int64)[:, None]
+    ], axis=1)
+    vocabularies = {
+        feature_values.name: [str(value) for value in feature_values.cat.categories],
+        target_values.name: [str(value) for value in target_values.cat.categories]
+    }
+
+    return get_contingency_tables(codes, vocabularies)[feature_values.name]
+
+def get_contingency_tables(codes: ndarray, vocabularies: dict[str, list[str]],
+                           block_size: int = CONTINGENCY_BLOCK_SIZE) -> dict[str, ContingencyTable]:
+    """
+    Build the contingency tables of all features in a single pass over a code matrix.
+
+    Rows with a missing feature or target value are dropped from the tables.
+
+    Parameters
+    ----------
+    codes : ndarray
+        The code matrix with one column per feature followed by the target.
+    vocabularies : dict[str, list[str]]
+        The categories of every column in column order.
+    block_size : int
+        The number of rows counted at once, bounding the temporary memory.
+
+    Returns
+    -------
+    dict[str, ContingencyTable]
+        The contingency table of every feature.
+    """
+    names = list(vocabularies)
+
+    # Count everything at once and drop the slots of missing values
+    return {
+        name: ContingencyTable(
+            feature=name,
+            feature_values=vocabularies[name],
+            target_values=vocabularies[names[-1]],
+            absolute=counts[1:, 1:],
+            total=len(codes)
+        )
+        for name, counts in count_combinations(codes, vocabularies, block_size).items()
+    }
+
+def count_combinations(codes: ndarray, vocabularies: dict[str, list[str]],
+                       block_size: int = CONTINGENCY_BLOCK_SIZE) -> dict[str, ndarray]:
+    """
+    Count every (feature value, target value) combination of all features in a single pass.
+
+    Every (feature, feature value, target value) combination is mapped onto one
+    slot of a flat counter, so all features are counted by one ``bincount`` per
+    block of rows. Missing values (code -1) get a slot of their own.
+
+    Parameters
+    ----------
+    codes : ndarray
+        The code matrix with one column per feature followed by the target.
+    vocabularies : dict[str, list[str]]
+        The categories of every column in column order.
+    block_size : int
+        The number of rows counted at once, bounding the temporary memory.
+
+    Returns
+    -------
+    dict[str, ndarray]
+        For every feature, the counts with shape (feature values + 1, target values + 1),
+        where row and column 0 hold the missing values.
+    """
+    names = list(vocabularies)
+
+    # Reserve one extra slot per feature and target for missing values
+    sizes = [len(vocabularies[name]) + 1 for name in names[:-1]]
+    offsets = concatenate([[0], cumsum(sizes)[:-1]]).astype(int64)
+    num_targets = len(vocabularies[names[-1]]) + 1
+
+    # Combine the codes in the narrowest integer type that holds every slot
+    counts = zeros(sum(sizes) * num_targets, dtype=int64)
+    dtype = int16 if len(counts) < 2 ** 15 else int64
+    feature_shift = (offsets + 1).astype(dtype)
+    target_shift, target_stride = dtype(1), dtype(num_targets)
+
+    # Count the combined codes block by block
+    for start in range(0, len(codes), block_size):
+        block = codes[start:start + block_size].astype(dtype, copy=False)
+        combined = (block[:, :-1] + feature_shift) * target_stride + (block[:, -1:] + target_shift)
+        counts += bincount(combined.ravel(), minlength=len(counts))
+
+    # Cut the flat counter into one matrix per feature
+    counts = counts.reshape(-1, num_targets)
+    return {name: counts[offset:offset + size] for name, offset, size in zip(names, offsets, sizes)}
+
+def get_pair_contingency_table(codes: ndarray, vocabularies: dict[str, list[str]],
+                               first: str, second: str) -> ContingencyTable:
+    """
+    Build the contingency table of a pair of features in a single pass over a code matrix.
+
+    The value combinations of the two features are treated as the values of one
+    combined feature, named ``first|second`` with values ``value|value``.
+
+    Parameters
+    ----------
+    codes : ndarray
+        The code matrix with one column per feature followed by the target.
+    vocabularies : dict[str, list[str]]
+        The categories of every column in column order.
+    first : str
+        The name of the first feature.
+    second : str
+        The name of the second feature.
+
+    Returns
+    -------
+    ContingencyTable
+        The contingency table of the feature pair.
+    """
+    names = list(vocabularies)
+    first_index, second_index = names.index(first), names.index(second)
+    second_size = len(vocabularies[second])
+
+    # Combine the two feature codes into one code, keeping missing values missing
+    first_codes = codes[:, first_index].astype(int64)
+    second_codes = codes[:, second_index].astype(int64)
+    pair_codes = first_codes * second_size + second_codes
+    pair_codes[(first_codes < 0) | (second_codes < 0)] = -1
 
+    # Count the combined feature like a single feature
+    pair_name = f"{first}|{second}"
+    pair_vocabularies = {
+        pair_name: [f"{a}|{b}" for a in vocabularies[first] for b in vocabularies[second]],
+        names[-1]: vocabularies[names[-1]]
+    }
+    pair_matrix = concatenate([pair_codes[:, None], codes[:, -1:].astype(int64)], axis=1)
 
-    
\ No newline at end of file
+    return get_contingency_tables(pair_matrix, pair_vocabularies)[pair_name]
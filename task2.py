@@ -1,15 +1,22 @@
+from typing import Optional
+from numpy import arange, concatenate, ndarray
 from pandas import DataFrame, Series
 
-from sklearn.datasets import load_iris
 from sklearn.model_selection import train_test_split
 
 import ansi_escape_codes as c
+import dataSource
 from logger_config import logger
 
-def splitDataSet(features: DataFrame, targets: Series, splitRatio: list[float]) -> tuple[DataFrame, DataFrame, DataFrame, Series, Series, Series]:
+def splitDataSet(features: DataFrame, targets: Series, splitRatio: list[float], stratify: bool = False,
+                 random_state: int = 42) -> tuple[DataFrame, DataFrame, DataFrame, Series, Series, Series]:
     """
     Split the dataset into training, evaluation, and test sets based on given ratios.
 
+    The rows are gathered into split order with a single copy, and every split is
+    a slice of that copy. All splits share the categorical dtypes of the input, so
+    their category codes are guaranteed to line up.
+
     Parameters
     ----------
     features : DataFrame
@@ -18,25 +25,19 @@ def splitDataSet(features: DataFrame, targets: Series, splitRatio: list[float])
         The target dataset.
     splitRatio : list[float]
         The ratio of the dataset to be used for training, evaluation, and testing.
+    stratify : bool
+        Whether to keep the target distribution equal across the splits.
+    random_state : int
+        The seed of the random permutation.
    
     Returns
     -------
     tuple[DataFrame, DataFrame, DataFrame, Series, Series, Series]
         A tuple containing the training, evaluation, and test feature and target datasets.
     """
-    # Validate the split ratios: ensure there are 3 ratios and they sum to 1.0
-    if len(splitRatio) != 3 or sum(splitRatio) != 1.0:
-        logger.fatal("{c.RED}You must provide 3 split ratios and the sum of split ratios must be 1.0{c.RESET}")
-        exit(1)
-
-    # Split the dataset into a training set and a temporary set (evaluation + test)
-    X_train, X_temp, y_train, y_temp = train_test_split(
-        features, targets, test_size=splitRatio[1] + splitRatio[2], random_state=42
-    )
-
-    # Further split the temporary set into evaluation and test sets
-    X_eval, X_test, y_eval, y_test = train_test_split(
-        X_temp, y_temp, test_size=splitRatio[2] / (splitRatio[1] + splitRatio[2]), random_state=42
+    # Draw the row indices of every split
+    train_index, eval_index, test_index = get_split_indices(
+        len(targets), splitRatio, targets.cat.codes.to_numpy() if stratify else None, random_state
     )
 
     # Log the split ratios and the shapes of the resulting datasets
@@ -44,11 +45,99 @@ def splitDataSet(features: DataFrame, targets: Series, splitRatio: list[float])
         f"Split ratios: {c.CYAN}{splitRatio[0]*100}%{c.RESET} for {c.RED}training{c.RESET}, {c.CYAN}{splitRatio[1]*100}%{c.RESET} for {c.RED}evaluation{c.RESET}, and {c.CYAN}{splitRatio[2]*100}%{c.RESET} for {c.RED}testing{c.RESET}"
     )
 
-    # Convert feature columns to categorical data type for each split dataset
-    for col in X_train.columns:
-        X_train[col] = X_train[col].astype('category')
-        X_eval[col] = X_eval[col].astype('category')
-        X_test[col] = X_test[col].astype('category')
+    # Gather the rows into split order once, keeping the categorical dtypes
+    order = concatenate([train_index, eval_index, test_index])
+    features, targets = features.take(order), targets.take(order)
+
+    # Slice the splits out of the gathered rows
+    train_end, eval_end = len(train_index), len(train_index) + len(eval_index)
+    X_train, X_eval, X_test = features.iloc[:train_end], features.iloc[train_end:eval_end], features.iloc[eval_end:]
+    y_train, y_eval, y_test = targets.iloc[:train_end], targets.iloc[train_end:eval_end], targets.iloc[eval_end:]
 
     # Return the split feature and target datasets
     return X_train, X_eval, X_test, y_train, y_eval, y_test
+
+def split_code_matrix(matrix: dataSource.CodeMatrix, splitRatio: list[float], stratify: bool = False,
+                      random_state: int = 42) -> tuple[dataSource.CodeMatrix, dataSource.CodeMatrix, dataSource.CodeMatrix]:
+    """
+    Split a code matrix into training, evaluation, and test sets based on given ratios.
+
+    The rows are drawn exactly as in ``splitDataSet``, gathered into split order
+    with a single copy of the codes, and every split is a slice of that copy
+    sharing the frozen vocabularies of the input.
+
+    Parameters
+    ----------
+    matrix : CodeMatrix
+        The code matrix of the features and the target.
+    splitRatio : list[float]
+        The ratio of the dataset to be used for training, evaluation, and testing.
+    stratify : bool
+        Whether to keep the target distribution equal across the splits.
+    random_state : int
+        The seed of the random permutation.
+
+    Returns
+    -------
+    tuple[CodeMatrix, CodeMatrix, CodeMatrix]
+        The training, evaluation, and test code matrices.
+    """
+    # Draw the row indices of every split
+    train_index, eval_index, test_index = get_split_indices(
+        len(matrix), splitRatio, matrix.targets if stratify else None, random_state
+    )
+
+    # Log the split ratios
+    logger.info(
+        f"Split ratios: {c.CYAN}{splitRatio[0]*100}%{c.RESET} for {c.RED}training{c.RESET}, {c.CYAN}{splitRatio[1]*100}%{c.RESET} for {c.RED}evaluation{c.RESET}, and {c.CYAN}{splitRatio[2]*100}%{c.RESET} for {c.RED}testing{c.RESET}"
+    )
+
+    # Gather the rows into split order once and slice the splits out of them
+    ordered = matrix.take(concatenate([train_index, eval_index, test_index]))
+    train_end, eval_end = len(train_index), len(train_index) + len(eval_index)
+    return ordered.take(slice(None, train_end)), ordered.take(slice(train_end, eval_end)), ordered.take(slice(eval_end, None))
+
+def get_split_indices(num_rows: int, splitRatio: list[float], stratify: Optional[ndarray] = None,
+                      random_state: int = 42) -> tuple[ndarray, ndarray, ndarray]:
+    """
+    Draw the row indices of the training, evaluation, and test sets.
+
+    Only index arrays are produced, so any representation of the dataset (frames
+    or code matrices) can be split with them. The indices are drawn by splitting
+    a row range with ``train_test_split`` twice, exactly like the rows were split
+    before, so the same random state still yields the same splits. If
+    stratification labels are given, both splits keep their distribution.
+
+    Parameters
+    ----------
+    num_rows : int
+        The number of rows of the dataset.
+    splitRatio : list[float]
+        The ratio of the dataset to be used for training, evaluation, and testing.
+    stratify : Optional[ndarray]
+        The labels (e.g. target codes) whose distribution every split should keep.
+    random_state : int
+        The seed of the random permutation.
+
+    Returns
+    -------
+    tuple[ndarray, ndarray, ndarray]
+        The row indices of the training, evaluation, and test sets.
+    """
+    # Validate the split ratios: ensure there are 3 ratios and they sum to 1.0
+    if len(splitRatio) != 3 or abs(sum(splitRatio) - 1.0) > 1e-9:
+        logger.fatal(f"{c.RED}You must provide 3 split ratios and the sum of split ratios must be 1.0{c.RESET}")
+        exit(1)
+
+    # Split the row range into the training rows and the temporary rows (evaluation + test)
+    train_index, temp_index = train_test_split(
+        arange(num_rows), test_size=splitRatio[1] + splitRatio[2], random_state=random_state, stratify=stratify
+    )
+
+    # Further split the temporary rows into evaluation and test rows
+    eval_index, test_index = train_test_split(
+        temp_index, test_size=splitRatio[2] / (splitRatio[1] + splitRatio[2]), random_state=random_state,
+        stratify=stratify[temp_index] if stratify is not None else None
+    )
+
+    return train_index, eval_index, test_index
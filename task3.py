@@ -1,10 +1,65 @@
-from typing import Tuple
-from lightgbm import Booster, Dataset, train
+from typing import Optional, Tuple
+from lightgbm import Booster, Dataset, Sequence, early_stopping, train
+from numpy import asarray, float32, float64, ndarray, ones, unique
 from pandas import DataFrame, Series
-from sklearn.metrics import accuracy_score
 
 import ansi_escape_codes as c
+import dataSource
+import instrumentation
+import metricsEngine
 from logger_config import logger
+import modelRegistry
+import predictionEngine
+
+# Set up the parameters for the LightGBM model
+PARAMS = {
+    # The type of the target variable
+    'objective': 'binary',
+    # The evaluation metric to be used
+    'metric': 'binary_error',
+    # Disable verbosity
+    'verbosity': -1
+}
+
+# Row-count constraints for weighted rows, where one row stands for many samples.
+# LightGBM estimates the rows in a bin or leaf from its hessian share times the
+# number of unique rows, so no setting reproduces the raw-row constraints exactly;
+# these keep categories and leaves of rare unique rows, which the raw rows back.
+WEIGHTED_PARAMS = {
+    # Allow leaves holding a single unique row
+    'min_data_in_leaf': 1,
+    # Allow categorical groups holding a single unique row
+    'min_data_per_group': 1,
+    # Give categories seen in a single unique row their own bin instead of the "other" bin
+    'min_data_in_bin': 1
+}
+
+# Number of boosting rounds without improvement on the evaluation set before training stops
+EARLY_STOPPING_ROUNDS = 10
+
+# Number of rows handed to LightGBM at once when reading from a code matrix
+CODE_BATCH_SIZE = 65536
+
+class CodeSequence(Sequence):
+    """
+    Row-batched read access to the feature columns of a code matrix.
+
+    LightGBM pulls the rows of a ``Sequence`` batch by batch while constructing a
+    dataset, so a memory-mapped code matrix is never converted into one large
+    floating point array.
+    """
+
+    def __init__(self, codes: ndarray, num_features: int, batch_size: int = CODE_BATCH_SIZE):
+        self.codes = codes
+        self.num_features = num_features
+        self.batch_size = batch_size
+
+    def __getitem__(self, index):
+        # Convert only the requested rows, LightGBM expects floating point values
+        return self.codes[index, :self.num_features].astype(float64)
+
+    def __len__(self) -> int:
+        return len(self.codes)
 
 def code_targets(y_train: Series, y_eval: Series, y_test: Series) -> Tuple[Series, Series, Series]:
     """
@@ -30,62 +85,263 @@ def code_targets(y_train: Series, y_eval: Series, y_test: Series) -> Tuple[Serie
     # Log the start of the encoding process
     logger.info("Encoding target values...")
 
-    # Encode the target values for the training dataset
-    y_train_encoded = y_train.cat.codes
+    with instrumentation.stage("encode", len(y_train) + len(y_eval) + len(y_test)):
+        # Encode the target values for the training dataset
+        y_train_encoded = y_train.cat.codes
 
-    # Encode the target values for the evaluation dataset
-    y_eval_encoded = y_eval.cat.codes
+        # Encode the target values for the evaluation dataset
+        y_eval_encoded = y_eval.cat.codes
 
-    # Encode the target values for the test dataset
-    y_test_encoded = y_test.cat.codes
+        # Encode the target values for the test dataset
+        y_test_encoded = y_test.cat.codes
 
     # Return the encoded target values as a tuple
     return y_train_encoded, y_eval_encoded, y_test_encoded
 
-def get_trained_model(X_train: DataFrame, y_train: Series) -> Booster:
+def get_dataset_from_codes(codes: ndarray, vocabularies: dict[str, list[str]], weight: Optional[ndarray] = None,
+                           params: Optional[dict] = None, reference: Optional[Dataset] = None) -> Dataset:
     """
-    Train the decision tree model using the provided training dataset.
+    Create a LightGBM dataset directly from a code matrix.
 
-    This function trains a LightGBM model using the provided training dataset and
-    returns the trained model.
+    The feature codes are passed as numeric values with every feature declared
+    categorical, and the target codes are used as labels. Missing values keep
+    the code -1, which LightGBM treats as missing like the NaN of a pandas
+    categorical column.
+
+    Parameters
+    ----------
+    codes : ndarray
+        The code matrix with one column per feature followed by the target.
+    vocabularies : dict[str, list[str]]
+        The categories of every column in column order.
+    weight : Optional[ndarray]
+        The weight of every row.
+    params : Optional[dict]
+        The LightGBM parameters the dataset is constructed with.
+    reference : Optional[Dataset]
+        The training dataset whose bins are used, for evaluation datasets.
+
+    Returns
+    -------
+    Dataset
+        The LightGBM dataset.
+    """
+    feature_names = list(vocabularies)[:-1]
+
+    # Read the features batch by batch and the target codes as labels
+    return Dataset(
+        [CodeSequence(codes, len(feature_names))],
+        label=codes[:, -1].astype(float32),
+        weight=weight,
+        feature_name=feature_names,
+        categorical_feature=feature_names,
+        params=params,
+        reference=reference
+    )
+
+def compress_training_data(X_train: DataFrame, y_train: Series) -> Tuple[DataFrame, Series, ndarray]:
+    """
+    Collapse identical (features, target) rows into unique rows with integer weights.
+
+    The unique rows keep the categorical dtypes of the input, and their weights
+    count how often they occur, so the gradient and hessian sums LightGBM builds
+    its histograms from are the same as for the raw rows. LightGBM's row-count
+    constraints count unique rows though, so ``get_trained_model`` relaxes them
+    (see ``WEIGHTED_PARAMS``) when weights are given. The model is close to the
+    raw-row model but not identical: LightGBM estimates row counts from hessians,
+    so splits near a row-count limit can differ, and early stopping can then pick
+    a different number of trees.
 
     Parameters
     ----------
     X_train : DataFrame
-        The training feature dataset.
+        The categorical training feature dataset.
     y_train : Series
-        The training target dataset.
+        The encoded training target dataset.
+
+    Returns
+    -------
+    Tuple[DataFrame, Series, ndarray]
+        The unique training features and targets and the weight of every unique row.
+    """
+    with instrumentation.stage("compress", len(X_train)):
+        # Key every row by its feature and target codes
+        codes = dataSource.concatenate_codes(X_train, y_train)
+        radices = [len(X_train[column].cat.categories) for column in X_train.columns] + [int(y_train.max()) + 1]
+        keys = dataSource.get_row_keys(codes, radices)
+
+        # Keep the first occurrence of every unique row and count its duplicates
+        _, first_rows, weights = unique(keys, return_index=True, return_counts=True)
+
+    logger.info(f"Compressed {c.CYAN}{len(X_train)}{c.RESET} training rows into {c.CYAN}{len(first_rows)}{c.RESET} unique rows "
+                f"(ratio {c.CYAN}{len(X_train) / max(len(first_rows), 1):.2f}{c.RESET})")
+
+    return X_train.iloc[first_rows], y_train.iloc[first_rows], weights.astype(float64)
+
+def compress_code_matrix(matrix: dataSource.CodeMatrix) -> Tuple[dataSource.CodeMatrix, ndarray]:
+    """
+    Collapse identical rows of a code matrix into unique rows with integer weights.
+
+    This is ``compress_training_data`` for code matrices; the unique rows come
+    in the same order, so both give the same model.
+
+    Parameters
+    ----------
+    matrix : CodeMatrix
+        The training code matrix.
+
+    Returns
+    -------
+    Tuple[CodeMatrix, ndarray]
+        The unique training rows and the weight of every unique row.
+    """
+    with instrumentation.stage("compress", len(matrix)):
+        # Keep the first occurrence of every unique row and count its duplicates
+        keys = dataSource.get_row_keys(matrix.codes, matrix.radices)
+        _, first_rows, weights = unique(keys, return_index=True, return_counts=True)
+
+    logger.info(f"Compressed {c.CYAN}{len(matrix)}{c.RESET} training rows into {c.CYAN}{len(first_rows)}{c.RESET} unique rows "
+                f"(ratio {c.CYAN}{len(matrix) / max(len(first_rows), 1):.2f}{c.RESET})")
+
+    return matrix.take(first_rows), weights.astype(float64)
+
+def get_trained_model(X_train: DataFrame | dataSource.CodeMatrix, y_train: Optional[Series] = None,
+                      X_eval: Optional[DataFrame | dataSource.CodeMatrix] = None,
+                      y_eval: Optional[Series] = None, params: Optional[dict] = None,
+                      num_boost_round: int = 100, weight: Optional[ndarray] = None,
+                      use_registry: bool = True) -> Booster:
+    """
+    Train the decision tree model using the provided training dataset.
+
+    This function trains a LightGBM model using the provided training dataset and
+    returns the trained model. If an evaluation dataset is given, training stops
+    early once the evaluation metric stops improving. With the model registry,
+    a model trained before on the same data with the same settings is loaded
+    instead of being trained again. Code matrices carry their targets and go
+    to LightGBM without any conversion; the model is given the vocabularies
+    of their features, so it is the same as if trained on frames.
+
+    Parameters
+    ----------
+    X_train : DataFrame | CodeMatrix
+        The training feature dataset, or the training code matrix.
+    y_train : Optional[Series]
+        The training target dataset, None for a code matrix.
+    X_eval : Optional[DataFrame | CodeMatrix]
+        The evaluation feature dataset or code matrix used for early stopping.
+    y_eval : Optional[Series]
+        The evaluation target dataset used for early stopping, None for a code matrix.
+    params : Optional[dict]
+        Parameters overriding the default LightGBM parameters.
+    num_boost_round : int
+        The maximum number of boosting rounds.
+    weight : Optional[ndarray]
+        The weight of every training row, e.g. from ``compress_training_data``.
+        Weighted rows are trained with the relaxed ``WEIGHTED_PARAMS`` and give a
+        close, not identical, model (see ``compress_training_data``).
+    use_registry : bool
+        Whether to look the model up in, and store it in, the model registry.
 
     Returns
     -------
     Booster
         The trained LightGBM model.
     """
-    # Set up the parameters for the LightGBM model
-    params = {
-        # The type of the target variable
-        'objective': 'binary',
-        # The evaluation metric to be used
-        'metric': 'binary_error',
-        # Disable verbosity
-        'verbosity': -1
-    }
+    # Relax the row-count constraints if every row stands for several samples
+    if weight is not None:
+        params = {**WEIGHTED_PARAMS, **(params or {})}
+    params = {**PARAMS, **(params or {})}
+
+    # Only train if this exact model has not been trained before
+    if use_registry:
+        registry_key = modelRegistry.get_model_key(X_train, y_train, params, X_eval, y_eval, weight,
+                                                   num_boost_round=num_boost_round)
+        model = modelRegistry.load_model(registry_key)
+        if model is not None:
+            return model
+
+    is_matrix = isinstance(X_train, dataSource.CodeMatrix)
 
+    with instrumentation.stage("dataset", len(X_train)):
+        # Create a LightGBM dataset from the provided feature and target datasets
+        if is_matrix:
+            dataset = get_dataset_from_codes(X_train.codes, X_train.vocabularies, weight, params).construct()
+        else:
+            dataset = Dataset(X_train, label=y_train, weight=weight, params=params).construct()
+
+        # Bin the evaluation dataset like the training dataset
+        if X_eval is None:
+            eval_dataset = None
+        elif is_matrix:
+            eval_dataset = get_dataset_from_codes(X_eval.codes, X_eval.vocabularies, params=params, reference=dataset).construct()
+
+            # Datasets built by reference from row sequences get zero weights if the reference is weighted
+            if weight is not None:
+                eval_dataset.set_field('weight', ones(len(X_eval)))
+        else:
+            eval_dataset = Dataset(X_eval, label=y_eval, reference=dataset, params=params).construct()
+
+    # Train the LightGBM model using the provided training dataset
+    num_samples = int(weight.sum()) if weight is not None else len(X_train)
+    model = get_trained_model_from_dataset(dataset, num_samples, params, eval_dataset, num_boost_round)
+
+    # Keep the vocabularies with the model, as LightGBM does for pandas categoricals
+    if is_matrix:
+        vocabularies = {name: list(X_train.vocabularies[name]) for name in X_train.feature_names}
+        model.pandas_categorical = list(vocabularies.values())
+    else:
+        vocabularies = {column: [str(value) for value in X_train[column].cat.categories] for column in X_train.columns}
+
+    # Register the model with the vocabularies it was trained on
+    if use_registry:
+        modelRegistry.store_model(registry_key, model, vocabularies, params)
+
+    return model
+
+def get_trained_model_from_dataset(dataset: Dataset, num_samples: int, params: Optional[dict] = None,
+                                   eval_dataset: Optional[Dataset] = None, num_boost_round: int = 100) -> Booster:
+    """
+    Train the decision tree model on an already constructed LightGBM dataset.
+
+    Parameters
+    ----------
+    dataset : Dataset
+        The LightGBM training dataset.
+    num_samples : int
+        The number of training samples, used for logging.
+    params : Optional[dict]
+        Parameters overriding the default LightGBM parameters.
+    eval_dataset : Optional[Dataset]
+        The LightGBM evaluation dataset used for early stopping.
+    num_boost_round : int
+        The maximum number of boosting rounds.
+
+    Returns
+    -------
+    Booster
+        The trained LightGBM model.
+    """
     # Print a message indicating the start of the training process
-    logger.info(f"Training LightGBM model with {c.CYAN}{len(X_train)}{c.RESET} samples...")
+    logger.info(f"Training LightGBM model with {c.CYAN}{num_samples}{c.RESET} samples...")
 
-    # Create a LightGBM dataset from the provided feature and target datasets
-    dataset = Dataset(X_train, label=y_train)
+    # Stop early on the evaluation dataset if there is one
+    valid_sets, callbacks = [], []
+    if eval_dataset is not None:
+        valid_sets = [eval_dataset]
+        callbacks = [early_stopping(EARLY_STOPPING_ROUNDS, verbose=False)]
 
     # Train the LightGBM model using the provided training dataset
-    model = train(params, train_set=dataset)
+    with instrumentation.stage("fit", num_samples):
+        model = train({**PARAMS, **(params or {})}, train_set=dataset, num_boost_round=num_boost_round,
+                      valid_sets=valid_sets, callbacks=callbacks)
 
     # Print a message indicating the finish of the training process if verbose is enabled
     logger.info(f"Finished training LightGBM model.")
     # Return the trained model
     return model
 
-def evaluate_model(model: Booster, X_eval: DataFrame, y_eval: Series) -> None:
+def evaluate_model(model: Booster, X_eval: DataFrame | dataSource.CodeMatrix, y_eval: Optional[Series] = None,
+                   threshold: float = metricsEngine.DECISION_THRESHOLD) -> float:
     """
     Evaluate the decision tree model using the provided evaluation dataset.
 
@@ -95,25 +351,36 @@ def evaluate_model(model: Booster, X_eval: DataFrame, y_eval: Series) -> None:
     ----------
     model : Booster
         The decision tree model to be evaluated.
-    X_eval : DataFrame
-        The evaluation feature dataset.
-    y_eval : Series
-        The evaluation target dataset.
+    X_eval : DataFrame | CodeMatrix
+        The evaluation feature dataset, or the evaluation code matrix.
+    y_eval : Optional[Series]
+        The evaluation target dataset, by default the targets of the code matrix.
+    threshold : float
+        The probability above which a prediction is the positive class.
 
     Returns
     -------
-    None
+    float
+        The accuracy on the evaluation dataset.
     """
     logger.info("Evaluating model...")
 
-    # Predict target values for the evaluation dataset
-    y_pred_prob = model.predict(X_eval)
+    # Take the targets from the code matrix
+    if y_eval is None:
+        y_eval = X_eval.targets
 
-    # Convert the predictions to binary values
-    y_pred = (y_pred_prob > 0.5).astype(int)
+    # Predict target values for the evaluation dataset, reusing cached predictions
+    y_pred_prob, = predictionEngine.predict_probabilities(model, X_eval)
 
-    # Evaluate the model using the evaluation dataset
-    accuracy = accuracy_score(y_eval, y_pred)
+    with instrumentation.stage("metrics", len(y_eval)):
+        # Convert the predictions to class labels and count the correct ones
+        y_pred = metricsEngine.get_predictions(y_pred_prob, threshold)
+        accuracy = float((y_pred == asarray(y_eval)).mean())
 
     # Print the accuracy to the console
     logger.info(f"Accuracy: {c.CYAN}{accuracy*100:.6f}%{c.RESET}")
+
+    # Keep the accuracy with the model if it is registered
+    modelRegistry.update_metrics(model, {'eval_accuracy': float(accuracy)})
+
+    return float(accuracy)
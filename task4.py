@@ -1,47 +1,54 @@
-from lightgbm import Booster, plot_tree
-import matplotlib.pyplot as plt
-from numpy import ndarray
+from typing import TYPE_CHECKING, Optional
+from lightgbm import Booster
+from numpy import asarray, ndarray
 from pandas import DataFrame, Series
-from sklearn.metrics import ConfusionMatrixDisplay, confusion_matrix
 
-import ansi_escape_codes as c
+import dataSource
 from logger_config import logger
+import instrumentation
+import metricsEngine
+import predictionEngine
 
 import os
 
-def visualizeTree(model: Booster) -> None:
+# The renderer loads matplotlib and scikit-learn, so it is only imported by the functions that plot
+if TYPE_CHECKING:
+    from artifactRenderer import ArtifactRenderer
+
+# Directory the images are saved to by default
+IMAGE_DIRECTORY = "./images"
+
+def visualizeTree(model: Booster, output_dir: str = IMAGE_DIRECTORY, renderer: Optional["ArtifactRenderer"] = None) -> None:
     """Visualize the decision tree
 
     This function renders a visual representation of the decision tree
-    using Graphviz and saves it as a PNG image.
+    using Graphviz and saves it as a PNG image. With a renderer the image is
+    rendered in the background, otherwise right away.
 
     Parameters
     ----------
     model : Booster
         The LightGBM model to be visualized.
+    output_dir : str
+        The directory the image is saved to.
+    renderer : Optional[ArtifactRenderer]
+        The renderer to queue the image with.
 
     Returns
     -------
     None
     """
-    # Check if a previous visualization exists and remove it
-    if os.path.exists(f"./images/tree.png"):
-        os.remove(f"./images/tree.png")
-        logger.info(f"Old file {c.MAGENTA}tree.png{c.RESET} has been successfully deleted.")
-
     logger.info("Visualizing decision tree...")
 
-    # Plot the decision tree
-    plt.figure(figsize=(20, 10))
-    plot_tree(model, tree_index=0)
-
-    # Save the plot as a PNG image
-    plt.savefig("./images/tree.png", dpi=300)
+    from artifactRenderer import ArtifactRenderer
 
-    # Print a message indicating that the visualization has been saved
-    logger.info(f"Decision tree saved at {c.MAGENTA}./images/tree.png{c.RESET}")
+    # Render the first tree, unless it is unchanged since the last time
+    with instrumentation.stage("render"):
+        (renderer or ArtifactRenderer(0)).render_tree(model, os.path.join(output_dir, "tree.png"))
 
-def predict(model: Booster, X_train: DataFrame, X_eval: DataFrame, X_test: DataFrame) -> tuple[Series, Series, Series]:
+def predict(model: Booster, X_train: DataFrame | dataSource.CodeMatrix, X_eval: DataFrame | dataSource.CodeMatrix,
+            X_test: DataFrame | dataSource.CodeMatrix,
+            threshold: float = metricsEngine.DECISION_THRESHOLD) -> tuple[ndarray, ndarray, ndarray]:
     """
     Predict the target values for the given feature datasets.
 
@@ -49,30 +56,38 @@ def predict(model: Booster, X_train: DataFrame, X_eval: DataFrame, X_test: DataF
     ----------
     model : Booster
         The LightGBM model to be used for prediction
-    X_train : DataFrame
-        The feature dataset for which to predict the target values for training
-    X_eval : DataFrame
-        The feature dataset for which to predict the target values for evaluation
-    X_test : DataFrame
-        The feature dataset for which to predict the target values for testing
+    X_train : DataFrame | CodeMatrix
+        The feature dataset or code matrix for which to predict the target values for training
+    X_eval : DataFrame | CodeMatrix
+        The feature dataset or code matrix for which to predict the target values for evaluation
+    X_test : DataFrame | CodeMatrix
+        The feature dataset or code matrix for which to predict the target values for testing
+    threshold : float
+        The probability above which a prediction is the positive class
 
     Returns
     -------
-    tuple[Series, Series, Series]
+    tuple[ndarray, ndarray, ndarray]
         A tuple containing the predicted target values for training, evaluation and testing
     """
     # Predict the target values using the given model and feature datasets
     logger.info("Predicting target values...")
 
-    # Use the model to predict the target values for each dataset
-    y_train_pred = (model.predict(X_train) > 0.5).astype(int)
-    y_val_pred = (model.predict(X_eval) > 0.5).astype(int)
-    y_test_pred = (model.predict(X_test) > 0.5).astype(int)
+    # Score the distinct rows of all datasets at once
+    y_train_prob, y_val_prob, y_test_prob = predictionEngine.predict_probabilities(model, X_train, X_eval, X_test)
+
+    # Use the predicted probabilities to predict the target values for each dataset
+    y_train_pred = metricsEngine.get_predictions(y_train_prob, threshold)
+    y_val_pred = metricsEngine.get_predictions(y_val_prob, threshold)
+    y_test_pred = metricsEngine.get_predictions(y_test_prob, threshold)
 
     # Return the predicted target values as a tuple
     return y_train_pred, y_val_pred, y_test_pred
 
-def generate_confusion_matrix(y_train: Series, y_train_pred: ndarray, y_eval: Series, y_eval_pred: ndarray, y_test: Series, y_test_pred: ndarray) -> None:
+def generate_confusion_matrix(y_train: Series | ndarray, y_train_pred: ndarray, y_eval: Series | ndarray, y_eval_pred: ndarray,
+                              y_test: Series | ndarray, y_test_pred: ndarray,
+                              output_dir: Optional[str] = IMAGE_DIRECTORY,
+                              renderer: Optional["ArtifactRenderer"] = None) -> tuple[ndarray, ndarray, ndarray]:
     """
     Generate and save confusion matrices for training, evaluation, and test datasets.
 
@@ -90,19 +105,25 @@ def generate_confusion_matrix(y_train: Series, y_train_pred: ndarray, y_eval: Se
         The true target values for the test dataset.
     y_test_pred : ndarray
         The predicted target values for the test dataset.
+    output_dir : Optional[str]
+        The directory the images are saved to, or None to skip saving them.
+    renderer : Optional[ArtifactRenderer]
+        The renderer to queue the images with, by default they are rendered right away.
 
     Returns
     -------
-    None
+    tuple[ndarray, ndarray, ndarray]
+        The confusion matrices of the training, evaluation, and test datasets.
     """
     # Calculate confusion matrices
     # The confusion matrix is a 2D array of size (n_classes, n_classes)
     # It is a square matrix with the number of classes as the number of rows and columns
     # The element at the i-th row and j-th column is the number of samples with true label i
     # that were predicted to have label j
-    confusion_matrix_train = confusion_matrix(y_true=y_train, y_pred=y_train_pred)
-    confusion_matrix_eval = confusion_matrix(y_true=y_eval, y_pred=y_eval_pred)
-    confusion_matrix_test = confusion_matrix(y_true=y_test, y_pred=y_test_pred)
+    with instrumentation.stage("metrics", len(y_train) + len(y_eval) + len(y_test)):
+        confusion_matrix_train = metricsEngine.get_confusion_matrix(asarray(y_train), y_train_pred)
+        confusion_matrix_eval = metricsEngine.get_confusion_matrix(asarray(y_eval), y_eval_pred)
+        confusion_matrix_test = metricsEngine.get_confusion_matrix(asarray(y_test), y_test_pred)
 
     # Print message if verbose is enabled
     logger.info("Confusion matrices have been calculated.")
@@ -110,11 +131,16 @@ def generate_confusion_matrix(y_train: Series, y_train_pred: ndarray, y_eval: Se
     # Save confusion matrices to files
     # The confusion matrix will be saved as a PNG image
     # The filename will be the name of the dataset (e.g. training_data, evaluation_data, test_data)
-    save_confusion_matrix(confusion_matrix_train, "training_data")
-    save_confusion_matrix(confusion_matrix_eval, "evaluation_data")
-    save_confusion_matrix(confusion_matrix_test, "test_data")
+    if output_dir is not None:
+        with instrumentation.stage("render"):
+            save_confusion_matrix(confusion_matrix_train, "training_data", output_dir, renderer)
+            save_confusion_matrix(confusion_matrix_eval, "evaluation_data", output_dir, renderer)
+            save_confusion_matrix(confusion_matrix_test, "test_data", output_dir, renderer)
+
+    return confusion_matrix_train, confusion_matrix_eval, confusion_matrix_test
 
-def save_confusion_matrix(confusion_matrix: ndarray, title: str) -> None:
+def save_confusion_matrix(confusion_matrix: ndarray, title: str, output_dir: str = IMAGE_DIRECTORY,
+                          renderer: Optional["ArtifactRenderer"] = None) -> None:
     """
     Save a confusion matrix to a file.
 
@@ -124,34 +150,17 @@ def save_confusion_matrix(confusion_matrix: ndarray, title: str) -> None:
         The confusion matrix to be saved
     title : str
         The title of the confusion matrix
+    output_dir : str
+        The directory the image is saved to
+    renderer : Optional[ArtifactRenderer]
+        The renderer to queue the image with, by default it is rendered right away
 
     Returns
     -------
     None
     """
-    # Create a ConfusionMatrixDisplay object
-    # This object is used to plot the confusion matrix
-    display = ConfusionMatrixDisplay(confusion_matrix=confusion_matrix, display_labels=["k0", "k1"])
-
-    # Plot the confusion matrix
-    # The confusion matrix is a square matrix with the number of classes as the number of rows and columns
-    # The element at the i-th row and j-th column is the number of samples with true label i
-    # that were predicted to have label j
-    display.plot()
-
-    # Set the title of the plot
-    plt.title(title)
-
-    # Check if the file exists, and if it does, delete it
-    # Check if the file exists, and if it does, delete it
-    # This is done to avoid overwriting an existing file
-    if os.path.exists(f"./images/confusion_matrix_{title}.png"):
-        os.remove(f"./images/confusion_matrix_{title}.png")
-        logger.info(f"Old file {c.MAGENTA}confusion_matrix_{title}.png{c.RESET} has been successfully deleted.")
-
-    # Save the confusion matrix to a file
-    # The confusion matrix is saved as a PNG image
-    plt.savefig(f"./images/confusion_matrix_{title}.png")
+    from artifactRenderer import ArtifactRenderer
 
-    # Print a message indicating that the confusion matrix has been saved
-    logger.info(f"Confusion matrix saved at {c.MAGENTA}./images/confusion_matrix_{title}.png{c.RESET}")
+    # The file is replaced atomically and skipped if the matrix did not change
+    path = os.path.join(output_dir, f"confusion_matrix_{title}.png")
+    (renderer or ArtifactRenderer(0)).render_confusion_matrix(confusion_matrix, title, path)
@@ -0,0 +1,20 @@
+import dataSource
+import featureSelection
+import syntheticData
+import task2
+
+def test_removals_are_scored_on_held_out_training_rows(tmp_path):
+    dataset_path = str(tmp_path / "synthetic.txt")
+    syntheticData.generate_data_set(dataset_path, 5000, seed=42)
+    train, evaluation, _ = task2.split_code_matrix(dataSource.read_code_matrix(dataset_path), [0.7, 0.15, 0.15], False, 42)
+
+    # Flip the evaluation targets, a selection scored on the evaluation rows would see an accuracy near zero
+    flipped = evaluation.codes.copy(order='F')
+    flipped[:, -1] = 1 - flipped[:, -1]
+    evaluation = dataSource.CodeMatrix(flipped, evaluation.vocabularies)
+
+    report = featureSelection.select_features(train, evaluation, candidates=2, max_workers=1)
+
+    # Early stopping still stops at once on the flipped rows, so the model at least predicts the majority class
+    assert report['baseline_accuracy'] > 0.5
+    assert report['holdout_rows'] == int(len(train) * featureSelection.SELECTION_HOLDOUT)
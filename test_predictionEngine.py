@@ -0,0 +1,28 @@
+from numpy import allclose, random
+from pandas import Categorical, DataFrame, Series
+
+import predictionEngine
+import task3
+
+def get_frame(generator: random.Generator, num_rows: int) -> tuple[DataFrame, Series]:
+    """Draw a small categorical dataset whose target depends on both features."""
+    first = generator.choice(["a", "b", "c", "d"], num_rows)
+    second = generator.choice(["x", "y", "z"], num_rows)
+    targets = Series(((first == "a") | (first == "c")) ^ (second == "z")).astype(int)
+    features = DataFrame({'Feature_1': Categorical(first, categories=["a", "b", "c", "d"]),
+                          'Feature_2': Categorical(second, categories=["x", "y", "z"])})
+    return features, targets
+
+def test_cache_distinguishes_reordered_vocabularies():
+    generator = random.default_rng(0)
+    features, targets = get_frame(generator, 2000)
+    model = task3.get_trained_model(features, targets, params={'seed': 0, 'min_data_in_leaf': 5}, use_registry=False)
+
+    # The same rows with the categories of a column in a different order have different codes
+    reordered = features.copy()
+    reordered['Feature_1'] = reordered['Feature_1'].cat.reorder_categories(["d", "c", "b", "a"])
+
+    cache = predictionEngine.PredictionCache()
+    for frame in (features, reordered):
+        probabilities, = predictionEngine.predict_probabilities(model, frame, cache=cache)
+        assert allclose(probabilities, model.predict(frame))
@@ -0,0 +1,30 @@
+from numpy import absolute, array_equal
+
+import dataSource
+import syntheticData
+import task2
+import task3
+
+# Largest mean probability difference allowed between the raw-row and the compressed model,
+# about 0.015 is measured on 10,000 synthetic rows
+PARITY_TOLERANCE = 0.03
+
+def test_compressed_model_is_close_to_raw_model(tmp_path):
+    dataset_path = str(tmp_path / "synthetic.txt")
+    syntheticData.generate_data_set(dataset_path, 10000, seed=42)
+    matrix = dataSource.read_code_matrix(dataset_path)
+    training, evaluation, test = task2.split_code_matrix(matrix, [0.7, 0.15, 0.15], False, 42)
+
+    # Train once on the raw rows and once on the unique rows weighted by their count
+    unique_rows, weights = task3.compress_code_matrix(training)
+    assert len(unique_rows.codes) < len(training.codes) // 10
+    raw_model = task3.get_trained_model(training, None, evaluation, None, params={'seed': 42}, use_registry=False)
+    compressed_model = task3.get_trained_model(unique_rows, None, evaluation, None, params={'seed': 42},
+                                               weight=weights, use_registry=False)
+
+    # Row counts are estimated from hessians, so the probabilities differ slightly but the classes do not
+    features = test.features.astype(float)
+    raw_probabilities = raw_model.predict(features)
+    compressed_probabilities = compressed_model.predict(features)
+    assert array_equal(raw_probabilities > 0.5, compressed_probabilities > 0.5)
+    assert absolute(raw_probabilities - compressed_probabilities).mean() < PARITY_TOLERANCE
@@ -0,0 +1,7 @@
+import subprocess
+import sys
+
+def test_import_does_not_load_matplotlib():
+    # A fresh interpreter, the test session may have loaded matplotlib already
+    code = "import sys, task4; print('matplotlib' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.strip() == "False"
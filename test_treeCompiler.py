@@ -0,0 +1,40 @@
+import lightgbm
+from numpy import allclose, random
+from pandas import Categorical, DataFrame, Series
+import pytest
+
+import task3
+import treeCompiler
+
+def get_frame(generator: random.Generator, num_rows: int) -> tuple[DataFrame, Series]:
+    """Draw a categorical dataset with a constant column in front of the columns the target depends on."""
+    first = generator.choice(["a", "b", "c", "d"], num_rows)
+    second = generator.choice(["x", "y", "z"], num_rows)
+    targets = Series(((first == "a") | (first == "c")) ^ (second == "z")).astype(int)
+    features = DataFrame({'Feature_1': Categorical(["k"] * num_rows, categories=["k"]),
+                          'Feature_2': Categorical(first, categories=["a", "b", "c", "d"]),
+                          'Feature_3': Categorical(second, categories=["x", "y", "z"])})
+    return features, targets
+
+def test_compiled_model_matches_booster_with_constant_column():
+    generator = random.default_rng(0)
+    features, targets = get_frame(generator, 2000)
+    model = task3.get_trained_model(features, targets, params={'seed': 0, 'min_data_in_leaf': 5}, use_registry=False)
+
+    # The constant column keeps its vocabulary, so the later columns are not shifted onto the wrong feature
+    compiled = treeCompiler.compile_model(model)
+    assert compiled.vocabularies['Feature_2'] == ["a", "b", "c", "d"]
+    rows = features.astype(str).values.tolist()
+    assert allclose(compiled.predict(compiled.encode(rows)), model.predict(features))
+
+def test_vocabularies_of_constant_numerical_column_are_ambiguous():
+    generator = random.default_rng(0)
+    features, targets = get_frame(generator, 2000)
+    features['Feature_1'] = 1.0
+    model = lightgbm.train({'objective': 'binary', 'verbosity': -1, 'seed': 0}, lightgbm.Dataset(features, targets), 5)
+
+    # A constant numerical column cannot be told apart from a constant categorical one in the dump
+    with pytest.raises(ValueError):
+        treeCompiler.compile_model(model)
+    vocabularies = {'Feature_2': ["a", "b", "c", "d"], 'Feature_3': ["x", "y", "z"]}
+    assert treeCompiler.compile_model(model, vocabularies).vocabularies == vocabularies
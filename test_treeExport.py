@@ -0,0 +1,41 @@
+import json
+import os
+
+from numpy import random
+from pandas import Categorical, DataFrame, Series
+
+import task3
+import treeExport
+
+def get_frame(generator: random.Generator, num_rows: int) -> tuple[DataFrame, Series]:
+    """Draw a categorical dataset with a constant column in front of the columns the target depends on."""
+    first = generator.choice(["a", "b", "c", "d"], num_rows)
+    second = generator.choice(["x", "y", "z"], num_rows)
+    targets = Series(((first == "a") | (first == "c")) ^ (second == "z")).astype(int)
+    features = DataFrame({'Feature_1': Categorical(["k"] * num_rows, categories=["k"]),
+                          'Feature_2': Categorical(first, categories=["a", "b", "c", "d"]),
+                          'Feature_3': Categorical(second, categories=["x", "y", "z"])})
+    return features, targets
+
+def get_splits(node: dict) -> list[dict]:
+    """Collect the split nodes of an exported tree."""
+    if 'leaf' in node:
+        return []
+    return [node] + get_splits(node['yes']) + get_splits(node['no'])
+
+def test_export_names_categories_with_constant_column(tmp_path):
+    generator = random.default_rng(0)
+    features, targets = get_frame(generator, 2000)
+    model = task3.get_trained_model(features, targets, params={'seed': 0, 'min_data_in_leaf': 5}, use_registry=False)
+    treeExport.export_trees(model, str(tmp_path), formats=("json",))
+
+    # Every categorical split lists tokens of its own feature, not codes or tokens of a shifted vocabulary
+    with open(os.path.join(tmp_path, "trees.json")) as file:
+        trees = json.load(file)
+    splits = [split for tree in trees for split in get_splits(tree['tree'])]
+    assert splits
+    for split in splits:
+        assert set(split['in']) <= set(features[split['feature']].cat.categories)
+
+def test_render_nothing_without_tree_indices(tmp_path):
+    assert treeExport.render_trees(str(tmp_path), []) == []
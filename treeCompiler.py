@@ -0,0 +1,448 @@
+import json
+import math
+from typing import Optional, Sequence
+
+from numpy import (abs as absolute, arange, array, ascontiguousarray, bool_, concatenate, dtype, empty, exp,
+                   float64, full, int8, int32, int64, intp, isnan, load, ndarray, savez, uint32, unique, void,
+                   where, zeros)
+
+# Missing value handling of numerical splits, as encoded in the compiled tables
+MISSING_TYPES = {'None': 0, 'Zero': 1, 'NaN': 2}
+
+# Values LightGBM treats as zero for missing type 'Zero'
+ZERO_THRESHOLD = 1e-35
+
+# Number of rows walked through the trees at once
+PREDICT_BLOCK_SIZE = 4096
+
+class CompiledModel:
+    """
+    A LightGBM model compiled into flat, array-backed tree tables.
+
+    All split nodes of all trees live in one set of arrays. A child index ``>= 0``
+    points to another split node, a negative index ``~i`` points to leaf ``i``.
+    Categorical splits hold a bitset of the category codes that go left, so rows
+    are scored from their category codes without pandas or LightGBM.
+
+    If every split is categorical, the bitsets are additionally expanded into a
+    transition table (node, code) -> next node, in which leaves point to
+    themselves. Scoring then is a fixed number of table lookups per tree.
+    """
+    __slots__ = ('feature', 'threshold', 'categorical', 'default_left', 'missing_type', 'left', 'right',
+                 'bitset_offset', 'bitset_length', 'bitsets', 'leaf_values', 'roots', 'tree_class',
+                 'objective', 'num_class', 'sigmoid', 'average_output', 'feature_names', 'vocabularies',
+                 'tables', 'token_lookup', 'transitions', 'transition_list', 'width', 'depth', 'node_feature',
+                 'start_nodes')
+
+    def __init__(self, arrays: dict[str, ndarray], metadata: dict):
+        for name in ('feature', 'threshold', 'categorical', 'default_left', 'missing_type', 'left', 'right',
+                     'bitset_offset', 'bitset_length', 'bitsets', 'leaf_values', 'roots', 'tree_class'):
+            setattr(self, name, arrays[name])
+        self.objective = metadata['objective']
+        self.num_class = metadata['num_class']
+        self.sigmoid = metadata['sigmoid']
+        self.average_output = metadata['average_output']
+        self.feature_names = metadata['feature_names']
+        self.vocabularies = metadata['vocabularies']
+
+        # Plain Python copies of the tables for the single-row fast path
+        self.tables = tuple(array.tolist() for array in (
+            self.feature, self.threshold, self.categorical, self.default_left, self.missing_type,
+            self.left, self.right, self.bitset_offset, self.bitset_length, self.bitsets, self.leaf_values
+        ))
+
+        # Map every token of every feature to its code
+        self.token_lookup = [
+            {token: code for code, token in enumerate(self.vocabularies.get(name, []))} for name in self.feature_names
+        ]
+
+        # Expand purely categorical models into a transition table
+        self.transitions = None
+        if self.categorical.all():
+            self.build_transitions()
+
+    def build_transitions(self) -> None:
+        """Build the transition table of a model whose splits are all categorical."""
+        num_nodes, num_leaves = len(self.feature), len(self.leaf_values)
+
+        # Number nodes and leaves in one index space, leaves after the nodes
+        left = where(self.left >= 0, self.left, num_nodes + ~self.left)
+        right = where(self.right >= 0, self.right, num_nodes + ~self.right)
+        self.start_nodes = where(self.roots >= 0, self.roots, num_nodes + ~self.roots).astype(intp)
+
+        # Column 0 is for missing and unknown codes, column k + 1 for code k
+        self.width = 32 * int(self.bitset_length.max(initial=0)) + 1
+        codes = arange(self.width - 1)
+        word = (codes >> 5)[None, :]
+        in_bitset = word < self.bitset_length[:, None]
+        bits = self.bitsets[where(in_bitset, self.bitset_offset[:, None] + word, 0)]
+        go_left = in_bitset & (((bits >> (codes & 31).astype(uint32)) & 1) == 1)
+
+        transitions = empty((num_nodes + num_leaves, self.width), dtype=intp)
+        transitions[:num_nodes, 0] = right
+        transitions[:num_nodes, 1:] = where(go_left, left[:, None], right[:, None])
+        transitions[num_nodes:] = arange(num_nodes, num_nodes + num_leaves)[:, None]
+        self.transitions = transitions.ravel()
+        self.transition_list = self.transitions.tolist()
+        self.node_feature = concatenate([self.feature, zeros(num_leaves, dtype=int32)]).astype(intp)
+
+        # Children follow their parents, so depths are found in one sweep
+        depths = zeros(num_nodes, dtype=int64)
+        for node, (left_child, right_child) in enumerate(zip(self.left.tolist(), self.right.tolist())):
+            for child in (left_child, right_child):
+                if child >= 0:
+                    depths[child] = depths[node] + 1
+        self.depth = int(depths.max(initial=-1)) + 1
+
+    def encode(self, rows: Sequence[Sequence[str]]) -> ndarray:
+        """
+        Encode rows of raw tokens (with or without trailing ';') into category codes.
+
+        Tokens outside the vocabulary become missing (code -1), which LightGBM
+        sends down the right branch of categorical splits just like unseen categories.
+        """
+        codes = full((len(rows), len(self.feature_names)), -1, dtype=int64)
+        for row_index, row in enumerate(rows):
+            for column, (token, lookup) in enumerate(zip(row, self.token_lookup)):
+                codes[row_index, column] = lookup.get(token.rstrip(';'), -1)
+        return codes
+
+    def predict_raw(self, codes: ndarray) -> ndarray:
+        """Return the raw scores of rows given as code matrix, one column per class."""
+        codes = ascontiguousarray(codes)
+
+        # Score every distinct row once and scatter the scores back
+        rows, inverse = unique(codes.view(dtype((void, codes.dtype.itemsize * codes.shape[1]))).ravel(),
+                               return_inverse=True)
+        rows = rows.view(codes.dtype).reshape(len(rows), codes.shape[1])
+
+        # Find the leaf every row ends in, block by block to bound the memory
+        leaves = empty((len(rows), len(self.roots)), dtype=intp)
+        for start in range(0, len(rows), PREDICT_BLOCK_SIZE):
+            block = rows[start:start + PREDICT_BLOCK_SIZE]
+            if self.transitions is not None:
+                leaves[start:start + len(block)] = self.walk_transitions(block)
+            else:
+                leaves[start:start + len(block)] = self.walk_splits(block)
+
+        # Sum the leaf values of every class
+        values = self.leaf_values[leaves]
+        raw = zeros((len(rows), self.num_class), dtype=float64)
+        for class_index in range(self.num_class):
+            raw[:, class_index] = values[:, self.tree_class == class_index].sum(axis=1)
+        if self.average_output:
+            raw /= max(len(self.roots) // self.num_class, 1)
+        return raw[inverse.ravel()]
+
+    def walk_transitions(self, codes: ndarray) -> ndarray:
+        """Return the leaf every row ends in for every tree, using the transition table."""
+        codes = codes.astype(float64)
+        num_rows, num_features = codes.shape
+
+        # Turn the codes into table columns, missing and unknown codes into column 0
+        valid = ~isnan(codes) & (codes >= 0) & (codes < self.width - 1)
+        columns = where(valid, codes + 1, 0).astype(intp).ravel()
+
+        # Take one step down every tree per level
+        row_offsets = (arange(num_rows, dtype=intp) * num_features)[:, None]
+        nodes = zeros((num_rows, len(self.start_nodes)), dtype=intp) + self.start_nodes
+        for _ in range(self.depth):
+            nodes = self.transitions[nodes * self.width + columns[row_offsets + self.node_feature[nodes]]]
+
+        return nodes - len(self.feature)
+
+    def walk_splits(self, codes: ndarray) -> ndarray:
+        """Return the leaf every row ends in for every tree, evaluating the splits."""
+        codes = codes.astype(float64)
+        num_rows, num_trees = len(codes), len(self.roots)
+
+        # Walk all rows through all trees at once, one tree level per step
+        nodes = zeros((num_rows, num_trees), dtype=int32) + self.roots
+        rows = zeros((num_rows, num_trees), dtype=int64) + arange(num_rows)[:, None]
+        active = (nodes >= 0).nonzero()
+        while len(active[0]):
+            node = nodes[active]
+            values = codes[rows[active], self.feature[node]]
+            go_left = self.decide(node, values)
+            nodes[active] = where(go_left, self.left[node], self.right[node])
+            active = tuple(axis[nodes[active] >= 0] for axis in active)
+
+        return ~nodes
+
+    def decide(self, node: ndarray, values: ndarray) -> ndarray:
+        """Return for every (split node, feature value) pair whether the value goes left."""
+        go_left = zeros(len(node), dtype=bool_)
+
+        # Categorical splits: codes in the node's bitset go left, missing and negative codes go right
+        categorical = self.categorical[node]
+        if categorical.any():
+            cat_node, cat_values = node[categorical], values[categorical]
+            valid = ~isnan(cat_values) & (cat_values >= 0)
+            codes = where(valid, cat_values, 0).astype(int64)
+            word = codes >> 5
+            valid &= word < self.bitset_length[cat_node]
+            bits = self.bitsets[where(valid, self.bitset_offset[cat_node] + word, 0)]
+            go_left[categorical] = valid & (((bits >> (codes & 31).astype(uint32)) & 1) == 1)
+
+        # Numerical splits: values below the threshold go left, missing values follow the default
+        numerical = ~categorical
+        if numerical.any():
+            num_node, num_values = node[numerical], values[numerical]
+            missing_type = self.missing_type[num_node]
+            num_values = where(isnan(num_values) & (missing_type != MISSING_TYPES['NaN']), 0.0, num_values)
+            missing = ((missing_type == MISSING_TYPES['Zero']) & (absolute(num_values) <= ZERO_THRESHOLD)) | \
+                      ((missing_type == MISSING_TYPES['NaN']) & isnan(num_values))
+            go_left[numerical] = where(missing, self.default_left[num_node], num_values <= self.threshold[num_node])
+
+        return go_left
+
+    def predict(self, codes: ndarray) -> ndarray:
+        """Return the predictions of rows given as code matrix, like ``Booster.predict``."""
+        raw = self.predict_raw(codes)
+        if self.objective in ('binary', 'cross_entropy'):
+            return 1.0 / (1.0 + exp(-self.sigmoid * raw[:, 0]))
+        if self.objective in ('multiclass', 'softmax'):
+            scores = exp(raw - raw.max(axis=1, keepdims=True))
+            return scores / scores.sum(axis=1, keepdims=True)
+        return raw[:, 0]
+
+    def predict_row(self, codes: Sequence[int]) -> float | list[float]:
+        """Return the prediction of a single row of codes, walking the trees in plain Python."""
+        (feature, threshold, categorical, default_left, missing_type,
+         left, right, bitset_offset, bitset_length, bitsets, leaf_values) = self.tables
+
+        raw = [0.0] * self.num_class
+        if self.transitions is not None:
+            # Follow the transition table, every leaf is reached after at most `depth` steps
+            transitions, width, num_nodes = self.transition_list, self.width, len(feature)
+            columns = [int(value) + 1 if value is not None and 0 <= value < width - 1 else 0 for value in codes]
+            for root, class_index in zip(self.start_nodes.tolist(), self.tree_class.tolist()):
+                node = root
+                while node < num_nodes:
+                    node = transitions[node * width + columns[feature[node]]]
+                raw[class_index] += leaf_values[node - num_nodes]
+            return self.transform_row(raw)
+
+        for root, class_index in zip(self.roots.tolist(), self.tree_class.tolist()):
+            node = root
+            while node >= 0:
+                value = codes[feature[node]]
+                if categorical[node]:
+                    # Codes in the bitset go left, missing and negative codes go right
+                    word = int(value) >> 5 if value is not None and value == value and value >= 0 else -1
+                    go_left = 0 <= word < bitset_length[node] and \
+                        (bitsets[bitset_offset[node] + word] >> (int(value) & 31)) & 1 == 1
+                else:
+                    if value is None or value != value:
+                        value = math.nan if missing_type[node] == MISSING_TYPES['NaN'] else 0.0
+                    if (missing_type[node] == MISSING_TYPES['Zero'] and abs(value) <= ZERO_THRESHOLD) or \
+                            (missing_type[node] == MISSING_TYPES['NaN'] and value != value):
+                        go_left = default_left[node]
+                    else:
+                        go_left = value <= threshold[node]
+                node = left[node] if go_left else right[node]
+            raw[class_index] += leaf_values[~node]
+
+        return self.transform_row(raw)
+
+    def transform_row(self, raw: list[float]) -> float | list[float]:
+        """Turn the raw scores of a single row into its prediction."""
+        if self.average_output:
+            raw = [score / max(len(self.roots) // self.num_class, 1) for score in raw]
+        if self.objective in ('binary', 'cross_entropy'):
+            return 1.0 / (1.0 + math.exp(-self.sigmoid * raw[0]))
+        if self.objective in ('multiclass', 'softmax'):
+            top = max(raw)
+            scores = [math.exp(score - top) for score in raw]
+            return [score / sum(scores) for score in scores]
+        return raw[0]
+
+def compile_model(model, vocabularies: Optional[dict[str, list[str]]] = None) -> CompiledModel:
+    """
+    Compile a trained LightGBM model into flat tree tables.
+
+    The model is read through ``dump_model`` only, so this module never imports
+    LightGBM. The category vocabularies are taken from the pandas categories the
+    model was trained on unless given explicitly.
+
+    Parameters
+    ----------
+    model : Booster
+        The trained LightGBM model, e.g. from ``task3.get_trained_model``.
+    vocabularies : Optional[dict[str, list[str]]]
+        The categories of every categorical feature.
+
+    Returns
+    -------
+    CompiledModel
+        The compiled model.
+    """
+    dump = model.dump_model()
+    feature_names = dump['feature_names']
+
+    # Parse the objective, e.g. 'binary sigmoid:1' or 'multiclass num_class:3'
+    objective, *options = dump['objective'].split(' ')
+    options = dict(option.split(':', 1) for option in options if ':' in option)
+    if objective not in ('binary', 'cross_entropy', 'multiclass', 'softmax', 'regression', 'regression_l1',
+                         'huber', 'fair', 'quantile', 'mape'):
+        raise ValueError(f"Objective {objective} cannot be compiled.")
+
+    # Take the vocabularies from the pandas categories the model was trained on
+    if vocabularies is None:
+        vocabularies = get_vocabularies(dump)
+
+    # Flatten the nodes of all trees into one set of tables
+    nodes, leaf_values, bitsets, roots = [], [], [], []
+    for tree in dump['tree_info']:
+        roots.append(flatten_tree(tree['tree_structure'], nodes, leaf_values, bitsets))
+
+    def column(key, dtype):
+        return array([node[key] for node in nodes], dtype=dtype)
+
+    arrays = {
+        'feature': column('feature', int32),
+        'threshold': column('threshold', float64),
+        'categorical': column('categorical', bool_),
+        'default_left': column('default_left', bool_),
+        'missing_type': column('missing_type', int8),
+        'left': column('left', int32),
+        'right': column('right', int32),
+        'bitset_offset': column('bitset_offset', int32),
+        'bitset_length': column('bitset_length', int32),
+        'bitsets': array(bitsets or [0], dtype=uint32),
+        'leaf_values': array(leaf_values, dtype=float64),
+        'roots': array(roots, dtype=int32),
+        'tree_class': array(range(len(roots)), dtype=int32) % dump['num_tree_per_iteration']
+    }
+    metadata = {
+        'objective': objective,
+        'num_class': dump['num_tree_per_iteration'],
+        'sigmoid': float(options.get('sigmoid', 1.0)),
+        'average_output': bool(dump.get('average_output', False)),
+        'feature_names': feature_names,
+        'vocabularies': vocabularies
+    }
+
+    return CompiledModel(arrays, metadata)
+
+def get_vocabularies(dump: dict) -> dict[str, list[str]]:
+    """
+    Return the pandas categories a dumped model was trained on.
+
+    Parameters
+    ----------
+    dump : dict
+        The model as returned by ``Booster.dump_model``.
+
+    Returns
+    -------
+    dict[str, list[str]]
+        The categories of every categorical feature, empty if the model was not trained on pandas categories.
+    """
+    feature_infos = dump.get('feature_infos', {})
+    pandas_categorical = dump.get('pandas_categorical') or []
+
+    # Numerical features list no values and constant features have no info at all, categorical or not
+    categorical_features = [name for name in dump['feature_names']
+                            if name not in feature_infos or feature_infos[name].get('values')]
+    if pandas_categorical and len(categorical_features) != len(pandas_categorical):
+        raise ValueError(f"The model has {len(pandas_categorical)} categorical features but "
+                         f"{len(categorical_features)} candidates, pass the vocabularies explicitly.")
+    return dict(zip(categorical_features, pandas_categorical))
+
+def flatten_tree(node: dict, nodes: list[dict], leaf_values: list[float], bitsets: list[int]) -> int:
+    """
+    Append one dumped (sub)tree to the flat tables.
+
+    Parameters
+    ----------
+    node : dict
+        The dumped node, as found in ``dump_model()['tree_info'][i]['tree_structure']``.
+    nodes : list[dict]
+        The split nodes collected so far.
+    leaf_values : list[float]
+        The leaf values collected so far.
+    bitsets : list[int]
+        The bitset words of the categorical splits collected so far.
+
+    Returns
+    -------
+    int
+        The index of the node, ``~leaf`` for leaves.
+    """
+    if 'split_feature' not in node:
+        leaf_values.append(node['leaf_value'])
+        return ~(len(leaf_values) - 1)
+
+    index = len(nodes)
+    entry = {
+        'feature': node['split_feature'],
+        'threshold': 0.0,
+        'categorical': node['decision_type'] == '==',
+        'default_left': node['default_left'],
+        'missing_type': MISSING_TYPES[node['missing_type']],
+        'bitset_offset': 0,
+        'bitset_length': 0
+    }
+    if entry['categorical']:
+        # Turn the categories going left into bitset words
+        categories = [int(category) for category in str(node['threshold']).split('||')]
+        words = [0] * (max(categories) // 32 + 1)
+        for category in categories:
+            words[category // 32] |= 1 << (category % 32)
+        entry['bitset_offset'], entry['bitset_length'] = len(bitsets), len(words)
+        bitsets.extend(words)
+    else:
+        entry['threshold'] = float(node['threshold'])
+    nodes.append(entry)
+
+    # Children are appended after their parent
+    entry['left'] = flatten_tree(node['left_child'], nodes, leaf_values, bitsets)
+    entry['right'] = flatten_tree(node['right_child'], nodes, leaf_values, bitsets)
+    return index
+
+def save_compiled_model(model: CompiledModel, path: str) -> None:
+    """
+    Save a compiled model as ``.npz`` file.
+
+    Parameters
+    ----------
+    model : CompiledModel
+        The compiled model.
+    path : str
+        The path of the file to be written.
+
+    Returns
+    -------
+    None
+    """
+    metadata = {
+        'objective': model.objective,
+        'num_class': model.num_class,
+        'sigmoid': model.sigmoid,
+        'average_output': model.average_output,
+        'feature_names': model.feature_names,
+        'vocabularies': model.vocabularies
+    }
+    arrays = {name: getattr(model, name) for name in CompiledModel.__slots__[:13]}
+    savez(path, metadata=array(json.dumps(metadata)), **arrays)
+
+def load_compiled_model(path: str) -> CompiledModel:
+    """
+    Load a compiled model saved by ``save_compiled_model``.
+
+    Parameters
+    ----------
+    path : str
+        The path of the ``.npz`` file.
+
+    Returns
+    -------
+    CompiledModel
+        The compiled model.
+    """
+    with load(path) as file:
+        arrays = {name: file[name] for name in file.files if name != 'metadata'}
+        metadata = json.loads(str(file['metadata']))
+
+    return CompiledModel(arrays, metadata)
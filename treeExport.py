@@ -0,0 +1,239 @@
+import json
+import os
+from typing import Optional
+
+import ansi_escape_codes as c
+from logger_config import logger
+import treeCompiler
+
+# Formats written by default: one DOT file per tree, and all trees as compact JSON and as indented text
+EXPORT_FORMATS = ("dot", "json", "text")
+
+# Number of characters per indentation level of the text form
+TEXT_INDENT = 2
+
+def export_trees(model, output_dir: str, vocabularies: Optional[dict[str, list[str]]] = None,
+                 formats: tuple[str, ...] = EXPORT_FORMATS) -> list[dict]:
+    """
+    Export every tree of a model as DOT, JSON and text, with a summary per tree.
+
+    The model is dumped once and every tree is walked once into a plain nested
+    form, from which all formats are written. Categorical splits list the
+    original tokens (e.g. ``kMB``) instead of category codes. Writes
+    ``tree_<i>.dot``, ``trees.json``, ``trees.txt`` and ``summary.json``; use
+    ``render_trees`` to turn chosen DOT files into images.
+
+    Parameters
+    ----------
+    model : Booster
+        The trained LightGBM model.
+    output_dir : str
+        The directory the files are written to.
+    vocabularies : Optional[dict[str, list[str]]]
+        The categories of every categorical feature, by default those the model was trained on.
+    formats : tuple[str, ...]
+        The formats to write, a subset of ``EXPORT_FORMATS``.
+
+    Returns
+    -------
+    list[dict]
+        The index, class, depth, number of leaves and splits, and split feature counts of every tree.
+    """
+    dump = model.dump_model()
+    if vocabularies is None:
+        vocabularies = treeCompiler.get_vocabularies(dump)
+    feature_names = dump['feature_names']
+
+    # Walk every tree once into its nested form and summary
+    trees, summaries = [], []
+    for tree in dump['tree_info']:
+        summary = {'index': tree['tree_index'], 'class': tree['tree_index'] % dump['num_tree_per_iteration'],
+                   'depth': 0, 'leaves': 0, 'splits': 0, 'split_features': {}}
+        trees.append(convert_node(tree['tree_structure'], feature_names, vocabularies, summary, 0))
+        summaries.append(summary)
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Write every format from the nested form
+    if "dot" in formats:
+        for summary, tree in zip(summaries, trees):
+            with open(os.path.join(output_dir, f"tree_{summary['index']}.dot"), "w") as file:
+                file.write(get_dot(tree, summary['index']))
+    if "json" in formats:
+        # Encode in one piece, json.dump would go through the slow pure Python encoder
+        with open(os.path.join(output_dir, "trees.json"), "w") as file:
+            file.write(json.dumps([{'index': summary['index'], 'class': summary['class'], 'tree': tree}
+                                   for summary, tree in zip(summaries, trees)], separators=(",", ":")))
+    if "text" in formats:
+        with open(os.path.join(output_dir, "trees.txt"), "w") as file:
+            for summary, tree in zip(summaries, trees):
+                file.write(f"Tree {summary['index']} (class {summary['class']}, {summary['leaves']} leaves, depth {summary['depth']})\n")
+                write_text(file, tree, TEXT_INDENT)
+    with open(os.path.join(output_dir, "summary.json"), "w") as file:
+        file.write(json.dumps(summaries, indent=2))
+
+    logger.info(f"Exported {c.CYAN}{len(trees)}{c.RESET} trees to {c.MAGENTA}{output_dir}{c.RESET}")
+    return summaries
+
+def convert_node(node: dict, feature_names: list[str], vocabularies: dict[str, list[str]], summary: dict, depth: int) -> dict:
+    """
+    Convert a dumped (sub)tree into the nested export form and count it in the summary.
+
+    Splits hold the feature name, either the tokens (``in``) or the threshold
+    (``le``) that send a row to the ``yes`` child, and the child rows with
+    missing values go to; leaves hold their index and value.
+
+    Parameters
+    ----------
+    node : dict
+        The dumped node, as found in ``dump_model()['tree_info'][i]['tree_structure']``.
+    feature_names : list[str]
+        The names of the features by index.
+    vocabularies : dict[str, list[str]]
+        The categories of every categorical feature.
+    summary : dict
+        The summary of the tree, updated in place.
+    depth : int
+        The depth of the node.
+
+    Returns
+    -------
+    dict
+        The node in the export form.
+    """
+    if 'split_feature' not in node:
+        summary['leaves'] += 1
+        summary['depth'] = max(summary['depth'], depth)
+        return {'leaf': node.get('leaf_index', 0), 'value': node['leaf_value']}
+
+    feature = feature_names[node['split_feature']]
+    summary['splits'] += 1
+    summary['split_features'][feature] = summary['split_features'].get(feature, 0) + 1
+
+    converted = {'feature': feature}
+    if node['decision_type'] == '==':
+        # Map the category codes going left back to their tokens, unseen and missing values go right
+        vocabulary = vocabularies.get(feature, [])
+        codes = [int(code) for code in str(node['threshold']).split('||')]
+        converted['in'] = [str(vocabulary[code]) if code < len(vocabulary) else str(code) for code in codes]
+        converted['missing'] = "no"
+    else:
+        # Missing values follow the default direction, or are compared as zero without a missing type
+        converted['le'] = node['threshold']
+        goes_left = node['default_left'] if node['missing_type'] != 'None' else 0.0 <= node['threshold']
+        converted['missing'] = "yes" if goes_left else "no"
+
+    converted['yes'] = convert_node(node['left_child'], feature_names, vocabularies, summary, depth + 1)
+    converted['no'] = convert_node(node['right_child'], feature_names, vocabularies, summary, depth + 1)
+    return converted
+
+def get_label(node: dict) -> str:
+    """
+    Describe a node of the export form in one line.
+
+    Parameters
+    ----------
+    node : dict
+        The node in the export form.
+
+    Returns
+    -------
+    str
+        The leaf value, or the condition of the split.
+    """
+    if 'leaf' in node:
+        return f"leaf {node['leaf']}: {node['value']:.6g}"
+    if 'in' in node:
+        return f"{node['feature']} in {{{', '.join(node['in'])}}}"
+    return f"{node['feature']} <= {node['le']:.6g}"
+
+def get_dot(tree: dict, index: int) -> str:
+    """
+    Write a tree of the export form as Graphviz DOT source.
+
+    Parameters
+    ----------
+    tree : dict
+        The root node in the export form.
+    index : int
+        The index of the tree.
+
+    Returns
+    -------
+    str
+        The DOT source.
+    """
+    lines = [f"digraph tree_{index} {{", "  node [shape=box, fontname=Helvetica];"]
+
+    # Name the nodes in walk order and connect every split to its children
+    stack, count = [(tree, 0)], 1
+    while stack:
+        node, name = stack.pop()
+        label = get_label(node).replace('"', '\\"')
+        if 'leaf' in node:
+            lines.append(f'  n{name} [label="{label}", shape=ellipse];')
+            continue
+        lines.append(f'  n{name} [label="{label}"];')
+        for branch in ("yes", "no"):
+            edge = f"{branch}, missing" if node['missing'] == branch else branch
+            lines.append(f'  n{name} -> n{count} [label="{edge}"];')
+            stack.append((node[branch], count))
+            count += 1
+
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+def write_text(file, node: dict, indent: int) -> None:
+    """
+    Write a (sub)tree of the export form as indented text.
+
+    Parameters
+    ----------
+    file : TextIO
+        The file to write to.
+    node : dict
+        The node in the export form.
+    indent : int
+        The indentation of the node.
+    """
+    file.write(f"{' ' * indent}{get_label(node)}\n")
+    if 'leaf' in node:
+        return
+    for branch in ("yes", "no"):
+        suffix = ", missing" if node['missing'] == branch else ""
+        file.write(f"{' ' * (indent + TEXT_INDENT)}{branch}{suffix}:\n")
+        write_text(file, node[branch], indent + 2 * TEXT_INDENT)
+
+def render_trees(output_dir: str, tree_indices: list[int], image_format: str = "png") -> list[str]:
+    """
+    Render chosen trees from their exported DOT files into images.
+
+    This needs the graphviz package and the Graphviz ``dot`` program and is
+    therefore only done on request.
+
+    Parameters
+    ----------
+    output_dir : str
+        The directory the trees were exported to.
+    tree_indices : list[int]
+        The indices of the trees to render.
+    image_format : str
+        The image format understood by Graphviz.
+
+    Returns
+    -------
+    list[str]
+        The paths of the images.
+    """
+    # Plot runs without trees to render need neither the graphviz package nor Graphviz
+    if not tree_indices:
+        return []
+
+    import graphviz
+
+    paths = []
+    for index in tree_indices:
+        source = graphviz.Source.from_file(os.path.join(output_dir, f"tree_{index}.dot"))
+        paths.append(source.render(outfile=os.path.join(output_dir, f"tree_{index}.{image_format}"), cleanup=False))
+        logger.info(f"Tree {c.CYAN}{index}{c.RESET} rendered at {c.MAGENTA}{paths[-1]}{c.RESET}")
+    return paths